@@ -1,18 +1,22 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Query, Depends, Body
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Dict, Any, Optional
 import uvicorn
 import uuid
+import asyncio
+from functools import partial
 from contextlib import asynccontextmanager
 import logging
 
 from services.document_processor import process_document, get_processing_status
-from services.vector_store import search_documents
+from config import SEARCH_BATCH_MAX_QUERIES, SEARCH_BATCH_MAX_K
+from services.vector_store import search_documents, search_documents_batch
 from services.openai_service import generate_response, clear_conversation, get_document_ids_for_session, get_conversation_history
+from services.llm_gateway import get_metrics
 # Import the routers
 from routes.scraper import router as scraper_router
-from routes.chat import router as chat_router
+from routes.chat import router as chat_router, SearchFilters, resolve_filters
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -40,6 +44,14 @@ class DocumentRequest(BaseModel):
     document_id: str
 
 
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    module_code: Optional[str] = None
+    k: int = Field(5, ge=1, le=SEARCH_BATCH_MAX_K)
+    session_id: Optional[str] = "default"
+    filters: Optional[SearchFilters] = None
+
+
 # API routes
 @app.post("/documents/upload")
 async def upload_document(file: UploadFile = File(...), module_code: Optional[str] = None):
@@ -108,6 +120,37 @@ async def delete_document(document_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/search/batch")
+async def search_batch(request: BatchSearchRequest):
+    """
+    Search for several questions in one call, returning the matching chunks for each
+    """
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="No queries given")
+    if len(request.queries) > SEARCH_BATCH_MAX_QUERIES:
+        raise HTTPException(
+            status_code=400, detail=f"At most {SEARCH_BATCH_MAX_QUERIES} queries per batch")
+
+    collection_name = f"module_{request.module_code}" if request.module_code else "all"
+
+    try:
+        # Search runs blocking I/O, so keep it off the event loop
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(None, partial(
+            search_documents_batch, request.queries, collection_name, request.k,
+            resolve_filters(request)))
+        return {
+            "collection_searched": collection_name,
+            "results": [
+                {"query": query, "results_count": len(query_results), "results": query_results}
+                for query, query_results in zip(request.queries, results)
+            ]
+        }
+    except Exception as e:
+        logger.error(f"Error in batch search: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.get("/health")
 async def health_check():
     """
@@ -116,6 +159,14 @@ async def health_check():
     return {"status": "healthy", "version": "1.1.0"}
 
 
+@app.get("/llm/metrics")
+async def llm_metrics():
+    """
+    Per-model OpenAI call counts, retries, rate limiting and latency
+    """
+    return {"models": get_metrics()}
+
+
 # Include the routers
 app.include_router(scraper_router)
 app.include_router(chat_router)
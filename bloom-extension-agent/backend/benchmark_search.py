@@ -0,0 +1,197 @@
+"""
+BLOOM Search Benchmark
+
+Compares query latency of the ChromaDB backend with the in-process NumPy
+exact-search backend on the same vectors, and reports how many of
+ChromaDB's approximate top-k results match the exact top-k (recall). The
+NumPy backend's int8 and binary quantization modes are measured too, with
+their memory footprint and recall against exact search.
+
+By default it uses synthetic unit vectors, so it needs no API key and
+touches no existing data. With --collection it copies an existing ChromaDB
+collection (embeddings included) instead; --export also keeps that copy in
+NUMPY_STORE_DIR, ready for VECTOR_BACKEND=numpy.
+
+Usage (from the backend directory):
+    python benchmark_search.py
+    python benchmark_search.py --chunks 20000 --queries 500
+    python benchmark_search.py --collection module_CST3350 --export
+"""
+
+import argparse
+import json
+import logging
+import sys
+import tempfile
+import time
+from typing import Dict, List, Any
+
+import chromadb
+import numpy as np
+
+from config import CHROMA_DB_DIR, NUMPY_STORE_DIR
+from services.numpy_store import NumpyClient, QUANTIZATION_MODES
+
+logger = logging.getLogger(__name__)
+
+COPY_BATCH_SIZE = 1000
+
+
+def synthetic_data(chunks: int, dimension: int, seed: int = 0) -> Dict[str, Any]:
+    """Random unit vectors with chunk-like metadata, spread over a few documents"""
+    rng = np.random.default_rng(seed)
+    embeddings = rng.standard_normal((chunks, dimension)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return {
+        "ids": [f"doc{i // 50}_{i % 50}" for i in range(chunks)],
+        "documents": [f"Synthetic chunk {i}" for i in range(chunks)],
+        "metadatas": [{"document_id": f"doc{i // 50}", "filename": f"doc{i // 50}.pdf",
+                       "chunk_index": i % 50} for i in range(chunks)],
+        "embeddings": embeddings
+    }
+
+
+def read_collection(collection) -> Dict[str, Any]:
+    """Read every chunk of a collection, with embeddings"""
+    data = {"ids": [], "documents": [], "metadatas": [], "embeddings": []}
+    total = collection.count()
+    for offset in range(0, total, COPY_BATCH_SIZE):
+        batch = collection.get(limit=COPY_BATCH_SIZE, offset=offset,
+                               include=["documents", "metadatas", "embeddings"])
+        for key in data:
+            data[key].extend(batch[key])
+    data["embeddings"] = np.asarray(data["embeddings"], dtype=np.float32)
+    return data
+
+
+def load(collection, data: Dict[str, Any]):
+    """Add chunks to a collection in batches"""
+    for start in range(0, len(data["ids"]), COPY_BATCH_SIZE):
+        end = start + COPY_BATCH_SIZE
+        collection.add(
+            ids=data["ids"][start:end],
+            documents=data["documents"][start:end],
+            metadatas=data["metadatas"][start:end],
+            embeddings=data["embeddings"][start:end].tolist()
+        )
+
+
+def time_queries(collection, queries: np.ndarray, k: int) -> Dict[str, Any]:
+    """Run single-vector queries one at a time, as the chat endpoints do"""
+    latencies = []
+    results = []
+    for query in queries:
+        started = time.perf_counter()
+        response = collection.query(query_embeddings=[query.tolist()], n_results=k,
+                                    include=["documents", "metadatas", "distances"])
+        latencies.append((time.perf_counter() - started) * 1000)
+        results.append(response["ids"][0])
+
+    latencies = np.asarray(latencies)
+    return {
+        "results": results,
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "mean_ms": round(float(latencies.mean()), 3)
+    }
+
+
+def recall(results: List[List[str]], exact: List[List[str]]) -> float:
+    """Mean fraction of the exact top-k found by each query"""
+    return round(float(np.mean([len(set(a) & set(b)) / max(len(b), 1)
+                                for a, b in zip(results, exact)])), 4)
+
+
+def run_benchmark(data: Dict[str, Any], chroma_collection, numpy_path: str, name: str,
+                  queries: int, k: int, seed: int = 1) -> Dict[str, Any]:
+    """
+    Time ChromaDB and each NumPy quantization mode on the same queries
+
+    Queries are stored vectors with a little noise, so each has true near neighbours.
+    """
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, len(data["ids"]), size=queries)
+    query_vectors = data["embeddings"][picks] + \
+        0.05 * rng.standard_normal((queries, data["embeddings"].shape[1])).astype(np.float32)
+
+    # Warm up (index load, page cache)
+    chroma_collection.query(query_embeddings=[query_vectors[0].tolist()], n_results=k)
+    chroma = time_queries(chroma_collection, query_vectors, k)
+
+    numpy_results = {}
+    for mode in QUANTIZATION_MODES:
+        collection = NumpyClient(numpy_path, quantization=mode).get_collection(name)
+        collection.query(query_embeddings=[query_vectors[0].tolist()], n_results=k)
+        numpy_results[mode] = {**time_queries(collection, query_vectors, k),
+                               **collection.memory_usage()}
+
+    exact = numpy_results["none"]
+    chroma["recall_at_k"] = recall(chroma.pop("results"), exact["results"])
+    for mode in QUANTIZATION_MODES:
+        stats = numpy_results[mode]
+        stats["recall_at_k"] = recall(stats["results"], exact["results"])
+        if stats["codes_bytes"]:
+            stats["memory_saving"] = round(stats["vectors_bytes"] / stats["codes_bytes"], 1)
+    for stats in numpy_results.values():
+        del stats["results"]
+
+    return {
+        "chunks": len(data["ids"]),
+        "dimension": int(data["embeddings"].shape[1]),
+        "queries": queries,
+        "k": k,
+        "chroma": chroma,
+        "numpy": numpy_results,
+        "speedup_p50": round(chroma["p50_ms"] / exact["p50_ms"], 2) if exact["p50_ms"] else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark ChromaDB against the NumPy exact-search backend")
+    parser.add_argument("--collection",
+                        help="Existing ChromaDB collection to benchmark (default: synthetic data)")
+    parser.add_argument("--chunks", type=int, default=5000,
+                        help="Synthetic chunk count")
+    parser.add_argument("--dimension", type=int, default=1536,
+                        help="Synthetic embedding dimension")
+    parser.add_argument("--queries", type=int, default=200,
+                        help="Number of queries to time")
+    parser.add_argument("-k", type=int, default=24,
+                        help="Results per query")
+    parser.add_argument("--export", action="store_true",
+                        help=f"Keep the NumPy copy of --collection in {NUMPY_STORE_DIR}")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if args.collection:
+            chroma_collection = chromadb.PersistentClient(
+                path=CHROMA_DB_DIR).get_collection(args.collection)
+            data = read_collection(chroma_collection)
+        else:
+            data = synthetic_data(args.chunks, args.dimension)
+            chroma_collection = chromadb.PersistentClient(
+                path=f"{temp_dir}/chroma").create_collection("benchmark")
+            load(chroma_collection, data)
+
+        if not data["ids"]:
+            print("Collection is empty", file=sys.stderr)
+            return 1
+
+        name = args.collection or "benchmark"
+        numpy_path = NUMPY_STORE_DIR if args.collection and args.export else f"{temp_dir}/numpy"
+        numpy_collection = NumpyClient(numpy_path, quantization="none").get_or_create_collection(name)
+        if numpy_collection.count() != len(data["ids"]):
+            load(numpy_collection, data)
+
+        report = run_benchmark(data, chroma_collection, numpy_path, name,
+                               args.queries, args.k)
+
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
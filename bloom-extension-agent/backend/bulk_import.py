@@ -0,0 +1,387 @@
+"""
+BLOOM Bulk Importer
+
+Command-line tool that walks a directory of course files (for example the
+backend's data/modules tree or an archive export) and ingests them through
+the same process_document pipeline used by the API. Text extraction runs in
+a process pool, embeddings are batched through DocumentWriteBuffer, and a
+state file lets an interrupted import resume where it stopped. The state
+file also records the documents each file was imported as, so a changed
+file replaces its earlier chunks rather than adding a second copy.
+
+Usage (from the backend directory):
+    python bulk_import.py data/modules
+    python bulk_import.py ~/exports/CST3350 --module CST3350 --workers 8
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Any, Optional, Tuple
+
+from config import PRECOMPUTE_SUMMARIES
+from services.document_processor import process_document
+from services.document_summarizer import precompute_summaries
+from services.scraper_service import process_text_content
+from services.vector_store import DocumentWriteBuffer, WRITE_BUFFER_MAX_CHUNKS, delete_document
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.docx', '.doc', '.txt')
+STATE_FILENAME = ".bloom_import_state.json"
+SOURCE_FOLDERS = ("scraped", "user_uploads")
+
+
+class LocalFile:
+    """UploadFile-like wrapper around a file on disk"""
+
+    def __init__(self, path: str):
+        self.filename = os.path.basename(path)
+        with open(path, 'rb') as f:
+            self._content = f.read()
+
+    async def read(self):
+        return self._content
+
+    async def seek(self, position):
+        pass
+
+
+class ChunkCollector:
+    """Stands in for a write buffer inside workers, keeping chunks for the parent"""
+
+    def __init__(self):
+        self.batches = []
+
+    def add(self, texts, metadatas, collection_name="bloom_documents", on_flush=None, on_error=None):
+        self.batches.append((texts, metadatas, collection_name))
+
+    async def add_async(self, texts, metadatas, collection_name="bloom_documents", on_flush=None, on_error=None):
+        self.add(texts, metadatas, collection_name, on_flush, on_error)
+
+
+def infer_module_code(path: str, root: str) -> Optional[str]:
+    """
+    Infer the module code from a data/modules style path
+
+    Files laid out as <module_code>/scraped/<file> or
+    <module_code>/user_uploads/<file> belong to that module.
+
+    Args:
+        path: Path of the file
+        root: Root directory of the import
+
+    Returns:
+        The module code, or None if the layout doesn't say
+    """
+    parts = os.path.relpath(path, root).split(os.sep)
+    if len(parts) < 2 or parts[-2] not in SOURCE_FOLDERS:
+        return None
+    if len(parts) >= 3:
+        return parts[-3]
+    # The root itself is a module directory
+    return os.path.basename(os.path.abspath(root))
+
+
+def find_files(root: str) -> List[str]:
+    """
+    Find all importable files under a directory, in a stable order
+
+    Args:
+        root: Directory to walk
+
+    Returns:
+        Sorted list of file paths
+    """
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(SUPPORTED_EXTENSIONS) and not filename.startswith('.'):
+                paths.append(os.path.join(dirpath, filename))
+    return paths
+
+
+def extract_chunks(path: str, module_code: Optional[str]) -> List[Tuple[List[str], List[Dict[str, Any]], str]]:
+    """
+    Extract and chunk one file in a worker process
+
+    Args:
+        path: Path of the file
+        module_code: Module code for the file, if any
+
+    Returns:
+        List of (texts, metadatas, collection_name) batches
+    """
+    logging.getLogger().setLevel(logging.WARNING)
+    collector = ChunkCollector()
+
+    if path.lower().endswith('.txt'):
+        if not module_code:
+            raise ValueError("Text files can only be imported into a module")
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            content = f.read()
+        filename = os.path.basename(path)
+        source_type = "moodle_page" if filename.endswith(
+            "_page_content.txt") else "scraped_text"
+        asyncio.run(process_text_content(content, module_code, module_code, filename,
+                                         source_type=source_type, write_buffer=collector))
+    else:
+        # Files from a data/modules tree keep the source they were saved under
+        source_type = "scraped" if os.path.basename(
+            os.path.dirname(path)) == "scraped" else "user_upload"
+        asyncio.run(process_document(LocalFile(path), module_code,
+                    write_buffer=collector, source_type=source_type))
+
+    return collector.batches
+
+
+def load_state(state_path: str) -> Dict[str, Any]:
+    """Load the resume state, keyed by file path"""
+    state = {"completed": {}, "documents": {}}
+    if os.path.exists(state_path):
+        with open(state_path, 'r') as f:
+            state.update(json.load(f))
+    return state
+
+
+def save_state(state_path: str, state: Dict[str, Any]):
+    """Atomically write the resume state"""
+    temp_path = state_path + ".tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(temp_path, state_path)
+
+
+def file_signature(path: str) -> List[float]:
+    """Size and modification time, used to detect files changed since the last run"""
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime]
+
+
+def print_progress(done: int, total: int, chunks: int, started: float):
+    """Render a single-line progress bar on stderr"""
+    width = 30
+    fraction = done / total if total else 1
+    filled = int(width * fraction)
+    elapsed = time.monotonic() - started
+    rate = done / elapsed if elapsed > 0 else 0
+    sys.stderr.write(
+        f"\r[{'#' * filled}{'.' * (width - filled)}] {done}/{total} files "
+        f"{chunks} chunks {rate:.1f} files/s")
+    sys.stderr.flush()
+
+
+def run_import(root: str, module_code: Optional[str] = None, workers: Optional[int] = None,
+               batch_size: int = WRITE_BUFFER_MAX_CHUNKS, state_path: Optional[str] = None,
+               resume: bool = True) -> Dict[str, Any]:
+    """
+    Import every supported file under a directory into the vector store
+
+    Args:
+        root: Directory to import
+        module_code: Module code for all files (inferred from the path if not set)
+        workers: Number of extraction processes (defaults to the CPU count)
+        batch_size: Chunks per embedding/write batch
+        state_path: Path of the resume state file
+        resume: Skip files completed by a previous run
+
+    Returns:
+        Throughput report
+    """
+    state_path = state_path or os.path.join(root, STATE_FILENAME)
+    state = load_state(state_path)
+    if not resume:
+        # Keep the documents of earlier runs so they are still replaced
+        state["completed"] = {}
+    completed = state["completed"]
+    # path -> [[document_id, collection_name], ...] written for it
+    imported = state["documents"]
+
+    paths = find_files(root)
+    pending = [path for path in paths
+               if completed.get(path) != file_signature(path)]
+    skipped = len(paths) - len(pending)
+    if skipped:
+        logger.info(f"Resuming: skipping {skipped} already imported files")
+
+    write_buffer = DocumentWriteBuffer(
+        max_chunks=batch_size, max_seconds=float('inf'))
+    report = {
+        "files_total": len(paths),
+        "files_skipped": skipped,
+        "files_imported": 0,
+        "files_failed": 0,
+        "chunks": 0,
+        "bytes": 0,
+        "errors": []
+    }
+
+    # (document_id, collection_name) of every document written, for summaries
+    documents = set()
+
+    # Files whose chunks could not be written; they are not marked done, so a re-run retries them
+    write_failed = set()
+
+    def track_file(path: str, signature: List[float], batch_count: int):
+        """
+        Callbacks recording one file's batches as they are written
+
+        Each written document is recorded straight away, so a later run can
+        replace it. The file is marked done once all its batches are written,
+        and only then are the documents an earlier run wrote for it deleted,
+        so a failed or interrupted write never leaves the file out of the index.
+
+        Returns:
+            (written, finish): written(entry) gives the on_flush callback for the
+            batch of one (document_id, collection_name); finish marks the file done
+        """
+        previous = [list(entry) for entry in imported.get(path, [])]
+        remaining = [batch_count]
+
+        def finish():
+            entries = imported.setdefault(path, [])
+            for entry in previous:
+                try:
+                    delete_document(*entry)
+                except Exception as e:
+                    logger.error(f"Failed to remove the previous import of {path}: {str(e)}")
+                    continue
+                entries.remove(entry)
+            completed[path] = signature
+
+        def written(entry: Tuple[str, str]):
+            def callback():
+                documents.add(entry)
+                entries = imported.setdefault(path, [])
+                if list(entry) not in entries:
+                    entries.append(list(entry))
+                remaining[0] -= 1
+                if not remaining[0] and path not in write_failed:
+                    finish()
+            return callback
+
+        return written, finish
+
+    def mark_failed(path: str):
+        def callback(error):
+            if path not in write_failed:
+                write_failed.add(path)
+                report["errors"].append(f"{path}: {str(error)}")
+        return callback
+
+    started = time.monotonic()
+    done = 0
+    saved_flushes = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(extract_chunks, path, module_code or infer_module_code(path, root)): path
+            for path in pending
+        }
+
+        for future in as_completed(futures):
+            path = futures[future]
+            done += 1
+            try:
+                batches = [batch for batch in future.result() if batch[0]]
+                signature = file_signature(path)
+            except Exception as e:
+                logger.error(f"Failed to import {path}: {str(e)}")
+                report["files_failed"] += 1
+                report["errors"].append(f"{path}: {str(e)}")
+            else:
+                written, finish = track_file(path, signature, len(batches))
+                if not batches:
+                    # Nothing to write, e.g. an empty text file
+                    finish()
+                for texts, metadatas, collection_name in batches:
+                    report["chunks"] += len(texts)
+                    try:
+                        write_buffer.add(texts, metadatas, collection_name,
+                                         on_flush=written((metadatas[0]["document_id"], collection_name)),
+                                         on_error=mark_failed(path))
+                    except Exception as e:
+                        # The failed files were recorded by their on_error callbacks
+                        logger.error(f"Failed to write buffered chunks: {str(e)}")
+                report["bytes"] += signature[0]
+
+            # Persist progress whenever a batch has been written
+            if write_buffer.flushes != saved_flushes:
+                save_state(state_path, state)
+                saved_flushes = write_buffer.flushes
+
+            print_progress(done, len(pending), report["chunks"], started)
+
+    try:
+        write_buffer.flush()
+    except Exception as e:
+        logger.error(f"Failed to write buffered chunks: {str(e)}")
+    # A file with any unwritten chunks is imported again next time
+    for path in write_failed:
+        completed.pop(path, None)
+    save_state(state_path, state)
+    sys.stderr.write("\n")
+
+    report["files_failed"] += len(write_failed)
+    report["files_imported"] = len(pending) - report["files_failed"]
+
+    if PRECOMPUTE_SUMMARIES and documents:
+        sys.stderr.write(f"Summarizing {len(documents)} documents\n")
+        report["documents_summarized"] = asyncio.run(precompute_summaries(sorted(documents)))
+
+    elapsed = time.monotonic() - started
+    report["batches"] = write_buffer.flushes
+    report["elapsed_seconds"] = round(elapsed, 2)
+    report["files_per_second"] = round(
+        report["files_imported"] / elapsed, 2) if elapsed else 0
+    report["chunks_per_second"] = round(
+        report["chunks"] / elapsed, 2) if elapsed else 0
+    report["megabytes_per_second"] = round(
+        report["bytes"] / elapsed / 1e6, 2) if elapsed else 0
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Bulk import a directory of course files into BLOOM's vector store")
+    parser.add_argument("source", help="Directory to import, e.g. data/modules")
+    parser.add_argument("--module", dest="module_code",
+                        help="Module code for all files (default: inferred from <module>/scraped|user_uploads/ paths)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Extraction processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=WRITE_BUFFER_MAX_CHUNKS,
+                        help="Chunks per embedding and write batch")
+    parser.add_argument("--state", dest="state_path",
+                        help=f"Resume state file (default: <source>/{STATE_FILENAME})")
+    parser.add_argument("--restart", action="store_true",
+                        help="Ignore previous progress and import everything again")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Show service logs")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.source):
+        parser.error(f"{args.source} is not a directory")
+
+    logging.getLogger().setLevel(
+        logging.INFO if args.verbose else logging.WARNING)
+
+    report = run_import(
+        args.source,
+        module_code=args.module_code,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        state_path=args.state_path,
+        resume=not args.restart
+    )
+
+    print(json.dumps(report, indent=2))
+    return 1 if report["files_failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
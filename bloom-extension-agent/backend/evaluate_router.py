@@ -0,0 +1,41 @@
+"""
+BLOOM Intent Router Evaluation
+
+Runs the agent intent router over a set of labelled queries and reports its
+accuracy, per-action precision and recall, and every misrouted query with
+its scores. The default set is services/intent_router_queries.jsonl; add a
+line to it whenever a query is routed wrongly, then adjust FEATURE_WEIGHTS
+or AGENT_ROUTER_THRESHOLD until the evaluation passes again.
+
+Usage (from the backend directory):
+    python evaluate_router.py
+    python evaluate_router.py --threshold 0.7
+    python evaluate_router.py --queries my_queries.jsonl
+"""
+
+import argparse
+import json
+import sys
+
+from config import AGENT_ROUTER_THRESHOLD
+from services.intent_router import IntentRouter, LABELLED_QUERIES_PATH, load_labelled_queries, evaluate
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Evaluate the agent intent router against labelled queries")
+    parser.add_argument("--queries", default=LABELLED_QUERIES_PATH,
+                        help="JSON-lines file of {\"query\", \"action\"} objects")
+    parser.add_argument("--threshold", type=float, default=AGENT_ROUTER_THRESHOLD,
+                        help="Confidence needed to route to an action")
+    args = parser.parse_args()
+
+    report = evaluate(IntentRouter(use_classifier=True, threshold=args.threshold),
+                      load_labelled_queries(args.queries))
+
+    print(json.dumps(report, indent=2))
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""
+BLOOM Collection Migration
+
+Command-line tool that copies the per-module layout (bloom_documents and one
+module_<code> collection per module) into the single unified collection used
+when UNIFIED_COLLECTION is enabled. Each chunk keeps its ID, text, metadata
+and embedding, and gains a "collection" metadata key naming the collection
+it came from, so nothing is re-embedded. Chunks already migrated are skipped,
+so an interrupted run can simply be started again.
+
+Usage (from the backend directory):
+    python migrate_collections.py
+    python migrate_collections.py --delete-source
+
+Then set UNIFIED_COLLECTION = True in config.py and restart the server.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, List, Any
+
+from config import HYBRID_SEARCH, UNIFIED_COLLECTION_NAME
+from services.lexical_index import index_chunks, LexicalIndex
+from services.vector_store import get_client, get_collection, register_partition
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def find_source_collections(client) -> List[str]:
+    """Names of the per-module layout's collections"""
+    return sorted(
+        collection.name for collection in client.list_collections()
+        if collection.name == "bloom_documents" or collection.name.startswith("module_"))
+
+
+def migrate_collection(source, target, batch_size: int) -> Dict[str, int]:
+    """
+    Copy one collection into the unified collection
+
+    Args:
+        source: The per-module collection
+        target: The unified collection
+        batch_size: Chunks read and written per request
+
+    Returns:
+        Counts of chunks found and copied
+    """
+    total = source.count()
+    copied = 0
+
+    for offset in range(0, total, batch_size):
+        batch = source.get(limit=batch_size, offset=offset,
+                           include=["documents", "metadatas", "embeddings"])
+        if not batch["ids"]:
+            break
+
+        # Skip chunks a previous run already copied
+        existing = set(target.get(ids=batch["ids"], include=[])["ids"])
+        keep = [i for i, chunk_id in enumerate(batch["ids"]) if chunk_id not in existing]
+        if keep:
+            ids = [batch["ids"][i] for i in keep]
+            texts = [batch["documents"][i] for i in keep]
+            target.add(
+                ids=ids,
+                documents=texts,
+                metadatas=[{**(batch["metadatas"][i] or {}), "collection": source.name}
+                           for i in keep],
+                embeddings=[batch["embeddings"][i] for i in keep]
+            )
+            if HYBRID_SEARCH:
+                index_chunks(UNIFIED_COLLECTION_NAME, ids, texts, target)
+            copied += len(keep)
+
+        sys.stderr.write(
+            f"\r{source.name}: {min(offset + batch_size, total)}/{total} chunks")
+        sys.stderr.flush()
+
+    sys.stderr.write("\n")
+    register_partition(target, source.name)
+    return {"chunks": total, "copied": copied}
+
+
+def run_migration(batch_size: int = DEFAULT_BATCH_SIZE, delete_source: bool = False) -> Dict[str, Any]:
+    """
+    Migrate every per-module collection into the unified collection
+
+    Args:
+        batch_size: Chunks read and written per request
+        delete_source: Delete each source collection once its chunks are verified
+
+    Returns:
+        Migration report
+    """
+    client = get_client()
+    target = get_collection(UNIFIED_COLLECTION_NAME)
+    started = time.monotonic()
+    report = {"collections": {}, "deleted": [], "errors": []}
+
+    for name in find_source_collections(client):
+        source = client.get_collection(name)
+        try:
+            counts = migrate_collection(source, target, batch_size)
+        except Exception as e:
+            logger.error(f"Failed to migrate {name}: {str(e)}")
+            report["errors"].append(f"{name}: {str(e)}")
+            continue
+
+        # Only drop the source once every chunk is present in the unified collection
+        migrated = len(target.get(where={"collection": name}, include=[])["ids"])
+        counts["verified"] = migrated
+        report["collections"][name] = counts
+
+        if delete_source:
+            if migrated < counts["chunks"]:
+                report["errors"].append(
+                    f"{name}: only {migrated}/{counts['chunks']} chunks verified, not deleted")
+                continue
+            client.delete_collection(name)
+            index = LexicalIndex(name)
+            for index_path in (index.path, index.log_path):
+                if os.path.exists(index_path):
+                    os.remove(index_path)
+            report["deleted"].append(name)
+
+    report["total_chunks"] = target.count()
+    report["elapsed_seconds"] = round(time.monotonic() - started, 2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=f"Migrate per-module collections into the unified '{UNIFIED_COLLECTION_NAME}' collection")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Chunks per read and write")
+    parser.add_argument("--delete-source", action="store_true",
+                        help="Delete each per-module collection after its chunks are verified")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Show service logs")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(
+        logging.INFO if args.verbose else logging.WARNING)
+
+    report = run_migration(args.batch_size, args.delete_source)
+
+    print(json.dumps(report, indent=2))
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,19 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
+import asyncio
+import json
 import logging
+from functools import partial
 
-from services.vector_store import search_documents, list_collections
-from services.openai_service import generate_response, clear_conversation, get_document_ids_for_session, get_conversation_history
+from config import RERANK_CANDIDATES
+
+from services.vector_store import search_documents, list_collections, build_where
+from services.embedding_service import get_embeddings
+from services.response_cache import response_cache
+from services.reranker import rerank, reranking_enabled
+from services.openai_service import generate_response, clear_conversation, get_document_ids_for_session, get_conversation_history, record_exchange
 from utils.folder_manager import list_modules, get_module_metadata
 
 # Set up logging
@@ -18,10 +27,18 @@ router = APIRouter(
 )
 
 
+class SearchFilters(BaseModel):
+    document_ids: Optional[List[str]] = None
+    filenames: Optional[List[str]] = None
+    source_types: Optional[List[str]] = None  # e.g. user_upload, scraped, moodle_page
+    session_documents: Optional[bool] = False  # only documents already used in this session
+
+
 class ChatQuery(BaseModel):
     query: str
     session_id: Optional[str] = "default"
     module_code: Optional[str] = None
+    filters: Optional[SearchFilters] = None
 
 
 class SessionRequest(BaseModel):
@@ -47,43 +64,220 @@ async def chat(query: ChatQuery):
             collection_name = f"module_{query.module_code}"
             logger.info(f"Searching in module collection: {collection_name}")
 
+        where = resolve_filters(query)
+
+        # Answer repeated questions from the response cache
+        cached, query_embedding = await lookup_cached_response(
+            query, collection_name, where)
+        if cached:
+            return {
+                "response": cached.response,
+                "sources": cached.sources,
+                "cached": True
+            }
+
         # Search for relevant document chunks
-        results = search_documents(query.query, collection_name, k=8)
+        results = await retrieve_chunks(
+            query.query, collection_name, query_embedding, where)
 
         logger.info(f"Found {len(results)} relevant chunks for query")
 
         # Generate response using OpenAI with session tracking
         # FIX: Add 'await' here to properly await the coroutine
-        response = await generate_response(query.query, results, query.session_id)
-
-        # Format sources for the response
-        sources = []
-        for result in results:
-            if "metadata" in result:
-                source = {
-                    "document_id": result["metadata"]["document_id"],
-                    "filename": result["metadata"]["filename"],
-                    "relevance": result["score"]
-                }
-
-                # Add module_code if present in metadata
-                if "module_code" in result["metadata"]:
-                    source["module_code"] = result["metadata"]["module_code"]
-                else:
-                    source["module_code"] = "Unknown"
-
-                sources.append(source)
+        response = await generate_response(
+            query.query, results, query.session_id, collection_name=collection_name, where=where)
 
         # Return top 3 sources
+        sources = format_sources(results)[:3]
+        if query_embedding is not None:
+            response_cache.store(collection_name, query.query,
+                                 query_embedding, response, sources)
+
         return {
             "response": response,
-            "sources": sources[:3]
+            "sources": sources
         }
     except Exception as e:
         logger.error(f"Error in chat endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/stream")
+async def chat_stream(query: ChatQuery):
+    """
+    Chat with documents, streaming the response as server-sent events.
+
+    Emits a 'sources' event first, then 'token' events as the model
+    generates, and finally 'done' with the complete response (or 'error').
+    """
+    try:
+        logger.info(
+            f"Received streaming chat query: {query.query} for session: {query.session_id}, module: {query.module_code or 'all'}")
+
+        collection_name = f"module_{query.module_code}" if query.module_code else "all"
+        where = resolve_filters(query)
+
+        cached, query_embedding = await lookup_cached_response(
+            query, collection_name, where)
+        if not cached:
+            results = await retrieve_chunks(
+                query.query, collection_name, query_embedding, where)
+            logger.info(f"Found {len(results)} relevant chunks for query")
+    except Exception as e:
+        logger.error(f"Error in chat stream endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def cached_stream():
+        yield format_event("sources", {"sources": cached.sources})
+        yield format_event("token", {"text": cached.response})
+        yield format_event("done", {"response": cached.response, "cached": True})
+
+    async def event_stream():
+        tokens = asyncio.Queue()
+        generation = asyncio.create_task(generate_response(
+            query.query, results, query.session_id, on_token=tokens.put_nowait,
+            collection_name=collection_name, where=where))
+        generation.add_done_callback(lambda _: tokens.put_nowait(None))
+
+        sources = format_sources(results)[:3]
+        yield format_event("sources", {"sources": sources})
+
+        while True:
+            token = await tokens.get()
+            if token is None:
+                break
+            yield format_event("token", {"text": token})
+
+        try:
+            response = generation.result()
+        except Exception as e:
+            logger.error(f"Error streaming chat response: {str(e)}")
+            yield format_event("error", {"detail": str(e)})
+            return
+
+        if query_embedding is not None:
+            response_cache.store(collection_name, query.query,
+                                 query_embedding, response, sources)
+        yield format_event("done", {"response": response})
+
+    return StreamingResponse(
+        cached_stream() if cached else event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def resolve_filters(query: ChatQuery) -> Optional[Dict[str, Any]]:
+    """
+    Turn a query's metadata filters into a ChromaDB where clause
+
+    Returns None when the query has no filters.
+    """
+    filters = query.filters
+    if not filters:
+        return None
+
+    document_ids = filters.document_ids
+    if filters.session_documents:
+        session_ids = get_document_ids_for_session(query.session_id)
+        document_ids = [doc_id for doc_id in document_ids if doc_id in session_ids] \
+            if document_ids is not None else list(session_ids)
+        if not document_ids:
+            # Nothing can match; a placeholder ID keeps the filter from being dropped
+            document_ids = [""]
+
+    return build_where({
+        "document_id": document_ids,
+        "filename": filters.filenames,
+        "source_type": filters.source_types
+    })
+
+
+async def retrieve_chunks(query_text: str, collection_name: str, query_embedding=None,
+                          where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Search for the chunks to answer a query with
+
+    With reranking enabled, over-fetches RERANK_CANDIDATES results and
+    keeps the best RERANK_TOP_N after rescoring them against the query.
+    Otherwise returns the top 8 search results. A where clause restricts
+    the search to chunks with matching metadata.
+    """
+    # Searching embeds the query and reads the collections, so keep it off the event loop
+    loop = asyncio.get_running_loop()
+    if not reranking_enabled():
+        return await loop.run_in_executor(None, partial(
+            search_documents, query_text, collection_name, k=8,
+            query_embedding=query_embedding, where=where))
+
+    candidates = await loop.run_in_executor(None, partial(
+        search_documents, query_text, collection_name, k=RERANK_CANDIDATES,
+        query_embedding=query_embedding, where=where))
+
+    # Scoring is CPU-bound (especially with the cross-encoder), so keep it off the event loop too
+    return await loop.run_in_executor(None, partial(rerank, query_text, candidates))
+
+
+async def lookup_cached_response(query: ChatQuery, collection_name: str, where: Optional[Dict[str, Any]] = None):
+    """
+    Look up a cached answer for a standalone question.
+
+    Returns the cache entry (or None) and the query embedding computed for
+    the lookup, so a miss can reuse it for the search. Cached answers ignore
+    conversation context and metadata filters, so follow-up questions in an
+    ongoing session and filtered questions skip the cache. A hit is recorded
+    in the session's history like a normal answer.
+    """
+    if where or get_conversation_history(query.session_id, 1):
+        return None, None
+
+    cached = response_cache.lookup(collection_name, query.query)
+    query_embedding = None
+    if not cached:
+        # Embedding blocks on the API, so keep it off the event loop
+        loop = asyncio.get_running_loop()
+        query_embedding = (await loop.run_in_executor(None, get_embeddings, [query.query]))[0]
+        cached = response_cache.lookup(
+            collection_name, query.query, query_embedding)
+
+    if cached:
+        record_exchange(query.session_id, query.query, cached.response,
+                        [source["document_id"] for source in cached.sources])
+
+    return cached, query_embedding
+
+
+def format_sources(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Format search results as sources for the chat response
+    """
+    sources = []
+    for result in results:
+        if "metadata" in result:
+            source = {
+                "document_id": result["metadata"]["document_id"],
+                "filename": result["metadata"]["filename"],
+                "relevance": result["score"]
+            }
+
+            # Add module_code if present in metadata
+            if "module_code" in result["metadata"]:
+                source["module_code"] = result["metadata"]["module_code"]
+            else:
+                source["module_code"] = "Unknown"
+
+            sources.append(source)
+
+    return sources
+
+
+def format_event(event: str, data: Dict[str, Any]) -> str:
+    """
+    Format a server-sent event
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
 @router.post("/clear")
 async def clear_chat_history(session: SessionRequest):
     """
@@ -149,11 +343,10 @@ async def debug_collections():
     Debug endpoint to inspect the vector database collections
     """
     try:
-        # Get all collections from ChromaDB
-        import chromadb
-        from config import CHROMA_DB_DIR
+        # Get all collections from the vector store
+        from services.vector_store import get_client
 
-        client = chromadb.PersistentClient(path=CHROMA_DB_DIR)
+        client = get_client()
         collections = client.list_collections()
 
         collection_info = []
@@ -216,8 +409,9 @@ async def debug_search(query: ChatQuery):
             logger.info(f"Searching in module collection: {collection_name}")
 
         # Search for relevant document chunks
-        from services.vector_store import search_documents
-        results = search_documents(query.query, collection_name, k=8)
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(None, partial(
+            search_documents, query.query, collection_name, k=8, where=resolve_filters(query)))
 
         logger.info(f"Found {len(results)} relevant chunks for query")
 
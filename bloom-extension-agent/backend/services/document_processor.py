@@ -1,14 +1,17 @@
 import os
 import uuid
+import asyncio
 from fastapi import UploadFile
 import fitz  # PyMuPDF
 import docx
 import tempfile
 import logging
 import re
-from typing import Dict, Any, Optional
+from functools import partial
+from typing import Callable, Dict, Any, Optional
 
-from services.vector_store import get_collection, add_documents
+from services.vector_store import get_collection, add_documents, DocumentWriteBuffer
+from services.document_summarizer import schedule_summary
 from utils.text_splitter import split_text
 
 # Set up logging with more detail
@@ -20,7 +23,11 @@ logger = logging.getLogger(__name__)
 processing_status = {}
 
 
-async def process_document(file: UploadFile, module_code: Optional[str] = None) -> str:
+async def process_document(file: UploadFile, module_code: Optional[str] = None,
+                           write_buffer: Optional[DocumentWriteBuffer] = None,
+                           source_type: str = "user_upload",
+                           on_flush: Optional[Callable[[], None]] = None,
+                           on_error: Optional[Callable[[Exception], None]] = None) -> str:
     """
     Process a document and add it to the vector store.
     This is a simplified version that doesn't use a background queue.
@@ -28,6 +35,14 @@ async def process_document(file: UploadFile, module_code: Optional[str] = None)
     Args:
         file (UploadFile): The uploaded file
         module_code (str, optional): Module code for collection organization
+        write_buffer (DocumentWriteBuffer, optional): Buffer to batch the
+            vector store write with other documents instead of writing now
+        source_type (str): Where the file came from ("user_upload" or "scraped"),
+            stored with each chunk for filtered search
+        on_flush (callable, optional): With write_buffer, run once this
+            document's chunks are written
+        on_error (callable, optional): With write_buffer, given the exception
+            if writing this document's chunks fails
 
     Returns:
         str: The document ID
@@ -123,7 +138,8 @@ async def process_document(file: UploadFile, module_code: Optional[str] = None)
                 "document_id": document_id,
                 "filename": file.filename,
                 "chunk_index": i,
-                "total_chunks": len(chunks)
+                "total_chunks": len(chunks),
+                "source_type": source_type
             }
 
             # Only add module_code if it's not None
@@ -144,7 +160,8 @@ async def process_document(file: UploadFile, module_code: Optional[str] = None)
                 "document_id": document_id,
                 "filename": file.filename,
                 "chunk_index": 0,
-                "total_chunks": 1
+                "total_chunks": 1,
+                "source_type": source_type
             }]
             if module_code is not None:
                 metadatas[0]["module_code"] = module_code
@@ -152,6 +169,34 @@ async def process_document(file: UploadFile, module_code: Optional[str] = None)
         # Update progress
         processing_status[document_id]["progress"] = 70
 
+        # Hand the chunks to the write buffer; the document completes when it flushes
+        if write_buffer is not None:
+            def mark_complete():
+                processing_status[document_id]["status"] = "complete"
+                processing_status[document_id]["progress"] = 100
+                schedule_summary(document_id, collection_name)
+                if on_flush:
+                    on_flush()
+
+            def mark_failed(error):
+                processing_status[document_id]["status"] = "failed"
+                processing_status[document_id]["error"] = str(error)
+                if on_error:
+                    on_error(error)
+
+            processing_status[document_id]["status"] = "buffered"
+            processing_status[document_id]["progress"] = 90
+            try:
+                await write_buffer.add_async(texts, metadatas, collection_name,
+                                             on_flush=mark_complete, on_error=mark_failed)
+            except Exception as e:
+                # A flush here writes other documents' chunks too; each one,
+                # this document included, learns the outcome from its callbacks
+                logger.error(f"Error writing buffered chunks: {str(e)}")
+            logger.info(
+                f"Buffered {len(texts)} chunks for collection '{collection_name}' from document '{file.filename}'")
+            return document_id
+
         # Add documents to ChromaDB using the specified collection
         try:
             # Print verification of what's being added
@@ -159,7 +204,9 @@ async def process_document(file: UploadFile, module_code: Optional[str] = None)
             logger.info(f"First chunk preview: {texts[0][:100]}...")
             logger.info(f"Metadata: {metadatas[0]}")
 
-            add_documents(texts, metadatas, collection_name)
+            # Embedding and writing block, so keep them off the event loop
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, partial(add_documents, texts, metadatas, collection_name))
             logger.info(
                 f"Successfully added {len(texts)} chunks to collection '{collection_name}' for document '{file.filename}'")
         except Exception as e:
@@ -173,6 +220,9 @@ async def process_document(file: UploadFile, module_code: Optional[str] = None)
         logger.info(
             f"Completed processing document '{file.filename}' with ID {document_id}")
 
+        # Optionally summarize the document now, so agent requests can use the stored summary
+        schedule_summary(document_id, collection_name)
+
         return document_id
 
     except Exception as e:
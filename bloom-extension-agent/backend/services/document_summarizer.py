@@ -0,0 +1,355 @@
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional
+
+from config import (SUMMARY_MODEL, DOCUMENT_SUMMARY_DIR, SUMMARY_WINDOW_TOKENS,
+                    SUMMARY_MAX_WINDOWS, SUMMARY_MAX_WINDOW_TOKENS, SUMMARY_CONCURRENCY,
+                    SUMMARY_PARTIAL_TOKENS, SUMMARY_DOCUMENT_TOKENS, SUMMARY_KEY_POINTS_TOKENS,
+                    PRECOMPUTE_SUMMARIES, COMPARE_DIGEST_TOKENS, DIGEST_CACHE_MAX_ENTRIES)
+from services.prompt_builder import count_tokens
+from services.response_cache import ResponseCache
+from services.llm_gateway import chat_completion
+from services.vector_store import get_document_chunks
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DOCUMENT_PROMPT = "You summarize a university course document for a student. Cover its structure and main themes, and keep definitions, key facts, requirements, dates and deadlines. Do not add information that is not in the text."
+MAP_PROMPT = "You summarize one section of a university course document for a student. Keep definitions, key facts, requirements, dates and deadlines, and name the topics covered. Write concise prose or bullet points; do not add information that is not in the text."
+KEY_POINTS_PROMPT = "You list the key points of a university course document for a student, from its summary. Give 5 to 12 points, one per line, each a complete sentence that stands on its own. Keep deadlines, requirements and key definitions. Do not add information that is not in the summary."
+QUESTION_DIGEST_PROMPT = "You condense one university course document so it can be compared with others. From its excerpts, and its summary when given, write a digest of everything relevant to the student's question: positions, definitions, requirements, figures, dates and deadlines, naming sections where known. Say briefly if the question asks about something the text does not cover. Do not add information that is not in the text."
+REDUCE_PROMPT = "You combine consecutive section summaries of one university course document into a single summary for a student. Keep the document's structure and main themes, and every deadline, requirement and key definition. Do not add information that is not in the summaries."
+
+# (document_id, version) -> summary record
+_summaries = {}
+
+# Summaries being generated, so concurrent requests for a document share one run
+_in_flight = {}
+
+# Created on first use, inside the event loop
+_semaphore = None
+
+# (normalized question, excerpts version, has summary) -> digest, in LRU order
+_digests = OrderedDict()
+
+# Background summaries started at ingest time, kept referenced until they finish
+_background = set()
+
+
+def document_version(chunks: List[Dict[str, Any]]) -> str:
+    """Hash of a document's chunk IDs and texts, which changes whenever its content does"""
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk["id"].encode())
+        digest.update(b"\0")
+        digest.update((chunk.get("text") or "").encode())
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+def split_windows(texts: List[str], window_tokens: int) -> List[List[str]]:
+    """
+    Group consecutive texts into windows of at most window_tokens
+
+    A single text longer than the window gets a window of its own.
+    """
+    windows = []
+    current = []
+    current_tokens = 0
+    for text in texts:
+        tokens = count_tokens(text)
+        if current and current_tokens + tokens > window_tokens:
+            windows.append(current)
+            current = []
+            current_tokens = 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        windows.append(current)
+    return windows
+
+
+def window_size(total_tokens: int) -> int:
+    """Window size giving at most SUMMARY_MAX_WINDOWS windows, within the model's limits"""
+    needed = -(-total_tokens // SUMMARY_MAX_WINDOWS)
+    return min(max(SUMMARY_WINDOW_TOKENS, needed), SUMMARY_MAX_WINDOW_TOKENS)
+
+
+async def _complete(system_message: str, text: str, max_tokens: int) -> str:
+    """Run one summarization call, limited to SUMMARY_CONCURRENCY at a time"""
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(SUMMARY_CONCURRENCY)
+
+    async with _semaphore:
+        response = await chat_completion(
+            model=SUMMARY_MODEL,
+            messages=[
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": text}
+            ],
+            temperature=0.2,
+            max_tokens=max_tokens
+        )
+    return response.choices[0].message['content'].strip()
+
+
+async def map_reduce_summary(texts: List[str], filename: str = "") -> Dict[str, Any]:
+    """
+    Summarize a long text by summarizing windows of it concurrently, then combining them
+
+    Args:
+        texts: The document's chunks, in order
+        filename: Document name, for the prompts
+
+    Returns:
+        The summary with the number of windows and reduce rounds used
+    """
+    title = f"Document: {filename}\n\n" if filename else ""
+    window_tokens = window_size(sum(count_tokens(text) for text in texts))
+    windows = split_windows(texts, window_tokens)
+    # Chunks don't pack windows exactly, so grow them until the count fits
+    while len(windows) > SUMMARY_MAX_WINDOWS and window_tokens < SUMMARY_MAX_WINDOW_TOKENS:
+        window_tokens = min(int(window_tokens * 1.25), SUMMARY_MAX_WINDOW_TOKENS)
+        windows = split_windows(texts, window_tokens)
+
+    if len(windows) == 1:
+        summary = await _complete(DOCUMENT_PROMPT, title + "\n\n".join(windows[0]),
+                                  SUMMARY_DOCUMENT_TOKENS)
+        return {"summary": summary, "windows": 1, "reduce_rounds": 0}
+
+    # Map: summarize every window concurrently
+    summaries = await asyncio.gather(*[
+        _complete(MAP_PROMPT, f"{title}Section {i + 1} of {len(windows)}:\n\n" + "\n\n".join(window),
+                  SUMMARY_PARTIAL_TOKENS)
+        for i, window in enumerate(windows)
+    ])
+
+    # Reduce: combine groups of partial summaries until one is left
+    rounds = 0
+    while len(summaries) > 1:
+        groups = split_windows(list(summaries), SUMMARY_WINDOW_TOKENS)
+        if len(groups) == len(summaries) > 1:
+            # Each summary fills a window on its own; pair them so the reduction makes progress
+            groups = [list(summaries[i:i + 2]) for i in range(0, len(summaries), 2)]
+        final = len(groups) == 1
+        summaries = await asyncio.gather(*[
+            _complete(REDUCE_PROMPT, title + "\n\n".join(
+                f"Section summary {i + 1}:\n{summary}" for i, summary in enumerate(group)),
+                SUMMARY_DOCUMENT_TOKENS if final else SUMMARY_PARTIAL_TOKENS)
+            for group in groups
+        ])
+        rounds += 1
+
+    return {"summary": summaries[0], "windows": len(windows), "reduce_rounds": rounds}
+
+
+def parse_key_points(text: str) -> List[str]:
+    """Split a model's key-point list into points, dropping bullets and numbering"""
+    points = [re.sub(r'^\s*(?:[-*•]|\d+[.)])\s*', '', line).strip() for line in text.splitlines()]
+    return [point for point in points if point]
+
+
+def _cache_path(document_id: str) -> str:
+    return os.path.join(DOCUMENT_SUMMARY_DIR, f"{document_id}.json")
+
+
+def load_summary(document_id: str, version: str) -> Optional[Dict[str, Any]]:
+    """A stored summary of this version of a document, or None"""
+    record = _summaries.get((document_id, version))
+    if record is not None:
+        return record
+
+    try:
+        with open(_cache_path(document_id), 'r') as f:
+            record = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if record.get("version") != version:
+        return None
+
+    _summaries[(document_id, version)] = record
+    return record
+
+
+def save_summary(document_id: str, record: Dict[str, Any]):
+    """Store a document summary in memory and on disk, replacing older versions"""
+    for key in [key for key in _summaries if key[0] == document_id]:
+        del _summaries[key]
+    _summaries[(document_id, record["version"])] = record
+
+    os.makedirs(DOCUMENT_SUMMARY_DIR, exist_ok=True)
+    temp_path = _cache_path(document_id) + ".tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(record, f)
+    os.replace(temp_path, _cache_path(document_id))
+
+
+async def summarize_document(document_id: str, collection_name: str = "bloom_documents") -> Optional[Dict[str, Any]]:
+    """
+    Summarize a whole document, reusing the stored summary of its current version
+
+    Args:
+        document_id: The document to summarize
+        collection_name: Collection holding the document's chunks
+
+    Returns:
+        Summary record (document_id, filename, version, summary, key_points, chunks,
+        windows, reduce_rounds, created_at), or None if the document has no chunks
+    """
+    loop = asyncio.get_running_loop()
+    chunks = await loop.run_in_executor(None, get_document_chunks, document_id, collection_name)
+    if not chunks:
+        logger.warning(f"No chunks found for document {document_id} in {collection_name}")
+        return None
+
+    version = document_version(chunks)
+    record = load_summary(document_id, version)
+    if record is not None and "key_points" in record:
+        return record
+
+    key = (document_id, version)
+    task = _in_flight.get(key)
+    if task is None:
+        # Summaries stored before key points were added only need the key points
+        task = loop.create_task(_build_summary(document_id, version, chunks, record))
+        _in_flight[key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(key, None))
+    return await task
+
+
+async def _build_summary(document_id: str, version: str, chunks: List[Dict[str, Any]],
+                         previous: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    filename = chunks[0]["metadata"].get("filename", "")
+    started = time.monotonic()
+
+    if previous is not None:
+        result = previous
+    else:
+        result = await map_reduce_summary([chunk["text"] for chunk in chunks], filename)
+
+    title = f"Document: {filename}\n\n" if filename else ""
+    key_points = parse_key_points(await _complete(
+        KEY_POINTS_PROMPT, title + result["summary"], SUMMARY_KEY_POINTS_TOKENS))
+
+    record = {
+        "document_id": document_id,
+        "filename": filename,
+        "version": version,
+        "summary": result["summary"],
+        "key_points": key_points,
+        "chunks": len(chunks),
+        "windows": result["windows"],
+        "reduce_rounds": result["reduce_rounds"],
+        "created_at": time.time()
+    }
+    save_summary(document_id, record)
+
+    logger.info(
+        f"Summarized {filename or document_id}: {len(chunks)} chunks in {result['windows']} windows, "
+        f"{result['reduce_rounds']} reduce rounds, {time.monotonic() - started:.1f}s")
+    return record
+
+
+async def question_digest(question: str, chunks: List[Dict[str, Any]],
+                          summary: Optional[str] = None) -> str:
+    """
+    Condense what one document says about a question, for comparing it with others
+
+    Args:
+        question: The user's question
+        chunks: Excerpts of the document, in order
+        summary: The document's stored whole-document summary, if there is one
+
+    Returns:
+        The digest
+    """
+    key = (ResponseCache.normalize_query(question), document_version(chunks), bool(summary))
+    digest = _digests.get(key)
+    if digest is not None:
+        _digests.move_to_end(key)
+        return digest
+
+    filename = chunks[0]["metadata"].get("filename", "") if chunks else ""
+    text = f"Question: {question}\n\nDocument: {filename}\n\n"
+    if summary:
+        text += f"Summary of the whole document:\n{summary}\n\n"
+    text += "Excerpts:\n\n" + "\n\n".join(chunk["text"] for chunk in chunks)
+
+    digest = await _complete(QUESTION_DIGEST_PROMPT, text, COMPARE_DIGEST_TOKENS)
+    _digests[key] = digest
+    while len(_digests) > DIGEST_CACHE_MAX_ENTRIES:
+        _digests.popitem(last=False)
+    return digest
+
+
+def stored_summary(document_id: str, collection_name: str = "bloom_documents") -> Optional[Dict[str, Any]]:
+    """
+    The stored summary of a document's current version, without generating one
+
+    Args:
+        document_id: The document
+        collection_name: Collection holding the document's chunks
+
+    Returns:
+        Summary record, or None if there is none for the current version
+    """
+    chunks = get_document_chunks(document_id, collection_name)
+    if not chunks:
+        return None
+    return load_summary(document_id, document_version(chunks))
+
+
+async def precompute_summaries(documents: List[tuple]) -> int:
+    """
+    Summarize documents ahead of any request for them
+
+    Args:
+        documents: (document_id, collection_name) pairs
+
+    Returns:
+        Number of documents summarized
+    """
+    results = await asyncio.gather(
+        *[summarize_document(document_id, collection_name)
+          for document_id, collection_name in documents],
+        return_exceptions=True)
+
+    summarized = 0
+    for (document_id, _), result in zip(documents, results):
+        if isinstance(result, Exception):
+            logger.error(f"Error precomputing summary for {document_id}: {str(result)}")
+        elif result:
+            summarized += 1
+    return summarized
+
+
+def schedule_summary(document_id: str, collection_name: str = "bloom_documents"):
+    """
+    Summarize a newly ingested document in the background, if PRECOMPUTE_SUMMARIES is on
+
+    Does nothing outside an event loop; bulk imports call precompute_summaries
+    once their writes are done instead.
+
+    Args:
+        document_id: The ingested document
+        collection_name: Collection its chunks were added to
+    """
+    if not PRECOMPUTE_SUMMARIES:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        logger.debug(f"No event loop; not precomputing summary for {document_id}")
+        return
+
+    task = loop.create_task(precompute_summaries([(document_id, collection_name)]))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
@@ -1,22 +1,54 @@
-import openai
-from config import OPENAI_API_KEY, EMBEDDING_MODEL
+import numpy as np
+from config import EMBEDDING_MODEL
+from services.llm_gateway import create_embeddings
 
-# Set API key
-openai.api_key = OPENAI_API_KEY
+# Full embedding size of each model, i.e. what dimensions=None returns
+MODEL_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536
+}
 
 
-def get_embeddings(texts):
+def get_embeddings(texts, dimensions=None):
     """
     Generate embeddings for a list of texts using OpenAI's API
+
+    Pass dimensions to get shortened text-embedding-3 embeddings, or None
+    for the model's full size.
     """
     if not isinstance(texts, list):
         texts = [texts]
 
-    response = openai.Embedding.create(
+    arguments = {"dimensions": dimensions} if dimensions else {}
+    response = create_embeddings(
         input=texts,
-        model=EMBEDDING_MODEL
+        model=EMBEDDING_MODEL,
+        **arguments
     )
 
     # Extract embeddings from response
     embeddings = [data['embedding'] for data in response['data']]
     return embeddings
+
+
+def shorten_embeddings(embeddings, dimensions):
+    """
+    Shorten one embedding or a list of embeddings to their first `dimensions` values
+
+    text-embedding-3 models are trained so that a prefix of an embedding is
+    itself a usable embedding (Matryoshka representation learning), so
+    truncating and re-normalizing gives the same vectors as requesting
+    `dimensions` from the API. Embeddings that are already that size or
+    shorter are returned unchanged.
+    """
+    if not dimensions:
+        return embeddings
+
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    if vectors.shape[-1] <= dimensions:
+        return embeddings
+
+    vectors = vectors[..., :dimensions]
+    vectors = vectors / (np.linalg.norm(vectors, axis=-1, keepdims=True) + 1e-12)
+    return vectors.tolist()
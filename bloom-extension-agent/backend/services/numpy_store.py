@@ -0,0 +1,546 @@
+import os
+import json
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+
+from config import VECTOR_QUANTIZATION, QUANTIZATION_RESCORE_MULTIPLIER
+
+# File locks are POSIX only; without them only one process may write to a collection
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+VECTORS_FILENAME = "vectors.f32"
+RECORDS_FILENAME = "records.jsonl"
+HEADER_FILENAME = "collection.json"
+LOCK_FILENAME = "collection.lock"
+
+QUANTIZATION_MODES = ("none", "int8", "binary")
+
+# Rows converted or compared per step when scanning quantized codes, which
+# bounds the temporary memory of a scan
+SCAN_BLOCK_ROWS = 4096
+
+# Set bits in each byte value, for Hamming distances between binary codes
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+# (path, quantization) -> NumpyCollection, shared by every client in the process
+_open_collections = {}
+_open_lock = threading.Lock()
+
+
+class NumpyCollection:
+    """
+    Exact-search collection stored as a contiguous float32 matrix.
+
+    Vectors are appended to a raw float32 file that is memory-mapped for
+    queries, with IDs, documents and metadata in a JSON-lines file alongside.
+    A small header records how many rows are committed, so a crash mid-write
+    never exposes a partial row. Writes hold an exclusive lock on a lock file
+    in the collection's directory, so several processes (the server and a
+    bulk import, say) can write to one collection. Deleting rows rewrites both files without
+    them and bumps a generation number in the header, which tells other
+    processes to reload rather than read on from their last offset. Queries compute squared L2 distances for the
+    whole collection with one matrix product and take the top k with
+    argpartition, which for a few thousand chunks is faster than an ANN
+    index and always exact.
+
+    With quantization "int8" (one byte per dimension plus a per-row scale) or
+    "binary" (one bit per dimension, the sign), a query first scans the
+    compact codes held in memory, then rescores a shortlist against the
+    full-precision vectors, which stay on disk and are only read for the
+    shortlisted rows.
+
+    Implements the subset of the ChromaDB Collection API used by
+    vector_store (add, query, get, peek, count, modify, delete), returning results
+    in the same shapes.
+    """
+
+    def __init__(self, name: str, directory: str, embedding_function=None,
+                 quantization: Optional[str] = None):
+        self.name = name
+        self.directory = directory
+        self.embedding_function = embedding_function
+        self.quantization = quantization or VECTOR_QUANTIZATION
+        if self.quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization mode: {self.quantization}")
+        self.metadata = None
+        self._lock = threading.RLock()
+        self._ids = []
+        self._documents = []
+        self._metadatas = []
+        self._positions = {}
+        self._columns = {}
+        self._vectors = None
+        self._squared_norms = np.zeros(0, dtype=np.float32)
+        self._codes = None
+        self._scales = np.zeros(0, dtype=np.float32)
+        self._dimension = None
+        self._records_bytes = 0
+        self._generation = 0
+        self._header_mtime = None
+        self._refresh()
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    def _read_header(self) -> Dict[str, Any]:
+        try:
+            with open(self._path(HEADER_FILENAME), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"dimension": None, "count": 0, "records_bytes": 0, "metadata": None, "generation": 0}
+
+    def _write_header(self):
+        header = {
+            "dimension": self._dimension,
+            "count": len(self._ids),
+            "records_bytes": self._records_bytes,
+            "metadata": self.metadata,
+            "generation": self._generation
+        }
+        temp_path = self._path(HEADER_FILENAME + ".tmp")
+        with open(temp_path, 'w') as f:
+            json.dump(header, f)
+        os.replace(temp_path, self._path(HEADER_FILENAME))
+        self._header_mtime = os.stat(self._path(HEADER_FILENAME)).st_mtime_ns
+
+    @contextmanager
+    def _write_lock(self):
+        """
+        Lock the collection against writes by other threads and processes
+
+        Rows committed by another process while waiting are read in before
+        writing, so appends start from the current end of the files.
+        """
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            # Closing the file releases the lock
+            with open(self._path(LOCK_FILENAME), 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                # Read the header even if its mtime looks unchanged, as two
+                # writes can land within the filesystem's timestamp resolution
+                self._header_mtime = None
+                self._refresh()
+                yield
+
+    def _refresh(self):
+        """Pick up rows committed since the last read, including by other processes"""
+        try:
+            mtime = os.stat(self._path(HEADER_FILENAME)).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._header_mtime:
+            return
+
+        with self._lock:
+            header = self._read_header()
+            self._header_mtime = mtime
+            self.metadata = header.get("metadata")
+            self._dimension = header["dimension"]
+            if header.get("generation", 0) != self._generation:
+                # Rows were deleted and the files rewritten, so read them again from the start
+                self._reset()
+                self._generation = header.get("generation", 0)
+            if header["count"] == len(self._ids):
+                return
+
+            # Read only the records appended since the last refresh
+            with open(self._path(RECORDS_FILENAME), 'rb') as f:
+                f.seek(self._records_bytes)
+                data = f.read(header["records_bytes"] - self._records_bytes)
+            for line in data.splitlines():
+                record = json.loads(line)
+                self._positions[record["id"]] = len(self._ids)
+                self._ids.append(record["id"])
+                self._documents.append(record["document"])
+                self._metadatas.append(record["metadata"])
+            self._records_bytes = header["records_bytes"]
+            self._columns = {}
+            self._map_vectors()
+
+    def _reset(self):
+        """Forget every row read so far"""
+        self._ids = []
+        self._documents = []
+        self._metadatas = []
+        self._positions = {}
+        self._columns = {}
+        self._vectors = None
+        self._squared_norms = np.zeros(0, dtype=np.float32)
+        self._codes = None
+        self._scales = np.zeros(0, dtype=np.float32)
+        self._records_bytes = 0
+
+    def _map_vectors(self):
+        count = len(self._ids)
+        if not count:
+            self._vectors = None
+            self._squared_norms = np.zeros(0, dtype=np.float32)
+            return
+        self._vectors = np.memmap(self._path(VECTORS_FILENAME), dtype=np.float32,
+                                  mode='r', shape=(count, self._dimension))
+        known = len(self._squared_norms)
+        new_norms = np.einsum('ij,ij->i', self._vectors[known:], self._vectors[known:])
+        self._squared_norms = np.concatenate([self._squared_norms, new_norms])
+        if self.quantization != "none":
+            self._quantize_from(known)
+
+    def _quantize_from(self, start: int):
+        """Append quantized codes for the rows from start onwards"""
+        codes = []
+        scales = []
+        for block_start in range(start, len(self._vectors), SCAN_BLOCK_ROWS):
+            block = np.asarray(self._vectors[block_start:block_start + SCAN_BLOCK_ROWS])
+            if self.quantization == "int8":
+                block_scales = np.abs(block).max(axis=1) / 127
+                block_scales[block_scales == 0] = 1
+                codes.append(np.round(block / block_scales[:, None]).astype(np.int8))
+                scales.append(block_scales.astype(np.float32))
+            else:
+                codes.append(np.packbits(block > 0, axis=1))
+        if not codes:
+            return
+        if self._codes is not None:
+            codes.insert(0, self._codes)
+            scales.insert(0, self._scales)
+        self._codes = np.concatenate(codes)
+        if self.quantization == "int8":
+            self._scales = np.concatenate(scales)
+
+    def _approximate_distances(self, queries: np.ndarray, codes: np.ndarray,
+                               scales: np.ndarray, squared_norms: np.ndarray) -> np.ndarray:
+        """
+        Rank every row against each query using the quantized codes (lower is closer)
+
+        int8 codes give an estimate of squared L2 distance; binary codes give
+        the Hamming distance between sign patterns, which orders rows by angle.
+        """
+        distances = np.empty((len(queries), len(codes)), dtype=np.float32)
+        if self.quantization == "int8":
+            for start in range(0, len(codes), SCAN_BLOCK_ROWS):
+                block = slice(start, start + SCAN_BLOCK_ROWS)
+                dots = (codes[block].astype(np.float32) @ queries.T).T * scales[block]
+                distances[:, block] = squared_norms[block] - 2 * dots
+        else:
+            query_codes = np.packbits(queries > 0, axis=1)
+            for i, query_code in enumerate(query_codes):
+                for start in range(0, len(codes), SCAN_BLOCK_ROWS):
+                    block = slice(start, start + SCAN_BLOCK_ROWS)
+                    distances[i, block] = POPCOUNT[codes[block] ^ query_code].sum(axis=1)
+        return distances
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Bytes of the full-precision vectors and of the in-memory quantized codes"""
+        self._refresh()
+        with self._lock:
+            return {
+                "vectors_bytes": self._vectors.nbytes if self._vectors is not None else 0,
+                "codes_bytes": self._codes.nbytes + self._scales.nbytes
+                if self._codes is not None else 0
+            }
+
+    def count(self) -> int:
+        self._refresh()
+        return len(self._ids)
+
+    def modify(self, name: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None):
+        with self._write_lock():
+            if name is not None and name != self.name:
+                self._rename(name)
+            if metadata is not None:
+                self.metadata = metadata
+                self._write_header()
+
+    def _rename(self, name: str):
+        """Move the collection's directory, updating every open handle to it"""
+        directory = os.path.join(os.path.dirname(self.directory), name)
+        if os.path.exists(directory):
+            raise ValueError(f"Collection {name} already exists.")
+
+        with _open_lock:
+            moved = [key for key in _open_collections if key[0] == self.directory]
+            collections = [_open_collections.pop(key) for key in moved]
+            os.replace(self.directory, directory)
+            for key, collection in zip(moved, collections):
+                _open_collections[(directory, key[1])] = collection
+            for collection in set(collections) | {self}:
+                collection.name = name
+                collection.directory = directory
+                collection._map_vectors()
+
+    def add(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]],
+            embeddings: Optional[List[List[float]]] = None):
+        if embeddings is None:
+            embeddings = self.embedding_function(documents)
+
+        with self._write_lock():
+            # Like ChromaDB, skip IDs that already exist
+            keep = []
+            seen = set()
+            for i, chunk_id in enumerate(ids):
+                if chunk_id in self._positions or chunk_id in seen:
+                    logger.warning(f"Add of existing ID {chunk_id} to {self.name} ignored")
+                    continue
+                seen.add(chunk_id)
+                keep.append(i)
+            if not keep:
+                return
+
+            vectors = np.asarray([embeddings[i] for i in keep], dtype=np.float32)
+            if self._dimension is None:
+                self._dimension = vectors.shape[1]
+            elif vectors.shape[1] != self._dimension:
+                raise ValueError(
+                    f"Embedding dimension {vectors.shape[1]} does not match collection dimension {self._dimension}")
+
+            records = b"".join(
+                json.dumps({"id": ids[i], "document": documents[i], "metadata": metadatas[i]}).encode() + b"\n"
+                for i in keep)
+
+            # Drop anything past the committed rows (left by an interrupted write), then append
+            vector_bytes = len(self._ids) * self._dimension * 4
+            for filename, size, data in ((VECTORS_FILENAME, vector_bytes, vectors.tobytes()),
+                                         (RECORDS_FILENAME, self._records_bytes, records)):
+                with open(self._path(filename), 'ab') as f:
+                    f.truncate(size)
+                    f.write(data)
+
+            for i in keep:
+                self._positions[ids[i]] = len(self._ids)
+                self._ids.append(ids[i])
+                self._documents.append(documents[i])
+                self._metadatas.append(metadatas[i])
+            self._records_bytes += len(records)
+            self._columns = {}
+            self._map_vectors()
+            self._write_header()
+
+    def _column(self, field: str) -> np.ndarray:
+        if field not in self._columns:
+            self._columns[field] = np.asarray(
+                [(metadata or {}).get(field) for metadata in self._metadatas], dtype=object)
+        return self._columns[field]
+
+    def _mask(self, where: Dict[str, Any]) -> np.ndarray:
+        """Evaluate a where clause ($and, $or, $in, $nin, $eq, $ne or equality) over all rows"""
+        mask = np.ones(len(self._ids), dtype=bool)
+        for field, condition in where.items():
+            if field == "$and":
+                for clause in condition:
+                    mask &= self._mask(clause)
+            elif field == "$or":
+                mask &= np.logical_or.reduce([self._mask(clause) for clause in condition])
+            elif isinstance(condition, dict):
+                column = self._column(field)
+                for operator, value in condition.items():
+                    if operator == "$in":
+                        mask &= np.isin(column, value)
+                    elif operator == "$nin":
+                        mask &= ~np.isin(column, value)
+                    elif operator == "$eq":
+                        mask &= column == value
+                    elif operator == "$ne":
+                        mask &= column != value
+                    else:
+                        raise ValueError(f"Unsupported where operator: {operator}")
+            else:
+                mask &= self._column(field) == condition
+        return mask
+
+    def query(self, query_embeddings: Optional[List[List[float]]] = None,
+              query_texts: Optional[List[str]] = None, n_results: int = 10,
+              where: Optional[Dict[str, Any]] = None,
+              include: List[str] = ("metadatas", "documents", "distances")) -> Dict[str, Any]:
+        self._refresh()
+        if query_embeddings is None:
+            query_embeddings = self.embedding_function(query_texts)
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+
+        with self._lock:
+            vectors = self._vectors
+            squared_norms = self._squared_norms
+            codes = self._codes
+            scales = self._scales
+            # Deletes replace these lists, so rows stay valid for this query
+            row_ids = self._ids
+            row_documents = self._documents
+            row_metadatas = self._metadatas
+            candidates = self._mask(where) if where else None
+
+        rows = []
+        distances = []
+        if vectors is not None:
+            available = len(squared_norms) if candidates is None else int(candidates.sum())
+            k = min(n_results, available)
+            query_norms = np.einsum('ij,ij->i', queries, queries)
+
+            if self.quantization == "none":
+                # Squared L2 for every row at once: |x|^2 - 2 x.q + |q|^2
+                all_distances = squared_norms[None, :] - 2 * (queries @ vectors.T) \
+                    + query_norms[:, None]
+                if candidates is not None:
+                    all_distances[:, ~candidates] = np.inf
+                for row_distances in all_distances:
+                    top = _top_k(row_distances, k)
+                    rows.append(top)
+                    distances.append(np.maximum(row_distances[top], 0).tolist())
+            else:
+                all_distances = self._approximate_distances(queries, codes, scales, squared_norms)
+                if candidates is not None:
+                    all_distances[:, ~candidates] = np.inf
+                shortlist_size = min(k * QUANTIZATION_RESCORE_MULTIPLIER[self.quantization], available)
+                for query, query_norm, row_distances in zip(queries, query_norms, all_distances):
+                    # Rescore the shortlist at full precision, reading rows in file order
+                    shortlist = np.sort(_top_k(row_distances, shortlist_size))
+                    exact = squared_norms[shortlist] - 2 * (vectors[shortlist] @ query) + query_norm
+                    top = _top_k(exact, k)
+                    rows.append(shortlist[top])
+                    distances.append(np.maximum(exact[top], 0).tolist())
+        else:
+            rows = [np.zeros(0, dtype=int) for _ in queries]
+            distances = [[] for _ in queries]
+
+        return {
+            "ids": [[row_ids[i] for i in top] for top in rows],
+            "documents": [[row_documents[i] for i in top] for top in rows]
+            if "documents" in include else None,
+            "metadatas": [[row_metadatas[i] for i in top] for top in rows]
+            if "metadatas" in include else None,
+            "distances": distances if "distances" in include else None,
+            "embeddings": [[vectors[i] for i in top] for top in rows]
+            if "embeddings" in include else None
+        }
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None,
+            limit: Optional[int] = None, offset: Optional[int] = None,
+            include: List[str] = ("metadatas", "documents")) -> Dict[str, Any]:
+        self._refresh()
+        with self._lock:
+            if ids is not None:
+                rows = [self._positions[chunk_id] for chunk_id in ids if chunk_id in self._positions]
+            else:
+                rows = range(len(self._ids))
+            if where:
+                mask = self._mask(where)
+                rows = [i for i in rows if mask[i]]
+            rows = list(rows)[offset or 0:]
+            if limit is not None:
+                rows = rows[:limit]
+
+            return {
+                "ids": [self._ids[i] for i in rows],
+                "documents": [self._documents[i] for i in rows] if "documents" in include else None,
+                "metadatas": [self._metadatas[i] for i in rows] if "metadatas" in include else None,
+                "embeddings": [self._vectors[i] for i in rows] if "embeddings" in include else None
+            }
+
+    def peek(self, limit: int = 10) -> Dict[str, Any]:
+        return self.get(limit=limit, include=["documents", "metadatas", "embeddings"])
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None):
+        with self._write_lock():
+            remove = np.ones(len(self._ids), dtype=bool)
+            if ids is not None:
+                remove[:] = False
+                remove[[self._positions[chunk_id] for chunk_id in ids if chunk_id in self._positions]] = True
+            if where:
+                remove &= self._mask(where)
+            if not remove.any():
+                return
+
+            keep = np.flatnonzero(~remove)
+            records = b"".join(
+                json.dumps({"id": self._ids[i], "document": self._documents[i],
+                            "metadata": self._metadatas[i]}).encode() + b"\n"
+                for i in keep)
+            vectors = np.asarray(self._vectors[keep], dtype=np.float32)
+
+            # Write the remaining rows to new files and swap them in; open memmaps keep the old ones
+            for filename, data in ((VECTORS_FILENAME, vectors.tobytes()), (RECORDS_FILENAME, records)):
+                temp_path = self._path(filename + ".tmp")
+                with open(temp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(temp_path, self._path(filename))
+
+            squared_norms = self._squared_norms[keep]
+            codes = self._codes[keep] if self._codes is not None and len(keep) else None
+            scales = self._scales[keep] if self.quantization == "int8" and len(keep) else self._scales[:0]
+            ids = [self._ids[i] for i in keep]
+            documents = [self._documents[i] for i in keep]
+            metadatas = [self._metadatas[i] for i in keep]
+            self._reset()
+            self._ids = ids
+            self._documents = documents
+            self._metadatas = metadatas
+            self._positions = {chunk_id: i for i, chunk_id in enumerate(ids)}
+            self._squared_norms = squared_norms
+            self._codes = codes
+            self._scales = scales
+            self._records_bytes = len(records)
+            self._generation += 1
+            self._map_vectors()
+            self._write_header()
+
+
+def _top_k(distances: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k smallest distances, closest first"""
+    if k <= 0:
+        return np.zeros(0, dtype=int)
+    if k < len(distances):
+        top = np.argpartition(distances, k - 1)[:k]
+    else:
+        top = np.arange(len(distances))
+    return top[np.argsort(distances[top])]
+
+
+class NumpyClient:
+    """Client for NumpyCollection stores, mirroring the ChromaDB client methods vector_store uses"""
+
+    def __init__(self, path: str, quantization: Optional[str] = None):
+        self.path = path
+        self.quantization = quantization or VECTOR_QUANTIZATION
+        os.makedirs(path, exist_ok=True)
+
+    def _open(self, name: str, embedding_function=None) -> NumpyCollection:
+        directory = os.path.join(self.path, name)
+        key = (directory, self.quantization)
+        with _open_lock:
+            collection = _open_collections.get(key)
+            if collection is None:
+                collection = _open_collections[key] = NumpyCollection(
+                    name, directory, embedding_function, self.quantization)
+            elif embedding_function is not None:
+                collection.embedding_function = embedding_function
+            return collection
+
+    def list_collections(self) -> List[NumpyCollection]:
+        return [self._open(name) for name in sorted(os.listdir(self.path))
+                if os.path.isdir(os.path.join(self.path, name))]
+
+    def get_collection(self, name: str, embedding_function=None) -> NumpyCollection:
+        if not os.path.isdir(os.path.join(self.path, name)):
+            raise ValueError(f"Collection {name} does not exist.")
+        return self._open(name, embedding_function)
+
+    def get_or_create_collection(self, name: str, embedding_function=None) -> NumpyCollection:
+        os.makedirs(os.path.join(self.path, name), exist_ok=True)
+        return self._open(name, embedding_function)
+
+    def delete_collection(self, name: str):
+        directory = os.path.join(self.path, name)
+        with _open_lock:
+            for key in [key for key in _open_collections if key[0] == directory]:
+                del _open_collections[key]
+        shutil.rmtree(directory, ignore_errors=True)
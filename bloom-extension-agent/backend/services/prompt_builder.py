@@ -0,0 +1,211 @@
+import logging
+from typing import Callable, Dict, List, Any, Optional
+
+from config import (CHAT_MODEL, PROMPT_MAX_TOKENS, PROMPT_BUDGET_SYSTEM, PROMPT_BUDGET_HISTORY,
+                    PROMPT_BUDGET_CONTEXT, PROMPT_BUDGET_QUESTION)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Use tiktoken for exact counts when it's installed, otherwise estimate
+try:
+    import tiktoken
+    try:
+        _encoding = tiktoken.encoding_for_model(CHAT_MODEL)
+    except KeyError:
+        _encoding = tiktoken.get_encoding("o200k_base")
+except ImportError:
+    _encoding = None
+
+# Rough characters per token for English text, used without tiktoken
+CHARS_PER_TOKEN = 4
+# Tokens the chat format adds around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+# Don't bother truncating a chunk into less room than this
+MIN_CHUNK_TOKENS = 100
+
+
+def count_tokens(text: str) -> int:
+    """Count the tokens in a piece of text"""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def count_message_tokens(messages: List[Dict[str, str]]) -> int:
+    """Count the tokens in a list of chat messages, including per-message overhead"""
+    return sum(count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text down to at most max_tokens tokens"""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if _encoding is not None:
+        return _encoding.decode(_encoding.encode(text)[:max_tokens])
+    return text[:max_tokens * CHARS_PER_TOKEN]
+
+
+def format_chunk(chunk: Dict[str, Any], index: int) -> str:
+    """Format a chunk with its source, as used in chat and agent prompts"""
+    filename = chunk.get("metadata", {}).get("filename", "Unknown")
+    return f"[Document: {filename}, Chunk {index + 1}]\n{chunk.get('text', '')}\n"
+
+
+def relevance_key(chunk: Dict[str, Any]) -> float:
+    """Sort key putting the most relevant chunk first, using the best score it has"""
+    if "rerank_score" in chunk:
+        return -chunk["rerank_score"]
+    if "rrf_score" in chunk:
+        return -chunk["rrf_score"]
+    return chunk.get("score", 1.0)
+
+
+def fit_chunks(chunks: List[Dict[str, Any]], max_tokens: int,
+               formatter: Callable[[Dict[str, Any], int], str] = format_chunk) -> List[Dict[str, Any]]:
+    """
+    Select the most relevant chunks that fit in a token budget
+
+    Chunks are taken in order of relevance: rerank score, then fused
+    hybrid score, then lowest distance.
+    The first chunk that doesn't fit is truncated if enough room is left,
+    and every less relevant chunk is dropped. The selection keeps the
+    chunks' original order.
+
+    Args:
+        chunks: Retrieved chunks with 'text' and optional scores
+        max_tokens: Token budget for the formatted chunks
+        formatter: Formats a chunk and its position for the prompt
+
+    Returns:
+        The chunks to include, the least relevant of which may be truncated
+    """
+    ranked = sorted(range(len(chunks)), key=lambda i: relevance_key(chunks[i]))
+
+    selected = {}
+    remaining = max_tokens
+    for i in ranked:
+        # Joining parts adds a newline between chunks
+        tokens = count_tokens(formatter(chunks[i], len(selected))) + 1
+        if tokens <= remaining:
+            selected[i] = chunks[i]
+            remaining -= tokens
+            continue
+
+        if remaining >= MIN_CHUNK_TOKENS:
+            header_tokens = tokens - count_tokens(chunks[i].get("text", ""))
+            truncated = dict(chunks[i])
+            truncated["text"] = truncate_to_tokens(
+                chunks[i].get("text", ""), remaining - header_tokens - 1)
+            selected[i] = truncated
+        break
+
+    return [selected[i] for i in sorted(selected)]
+
+
+def fit_history(messages: List[Dict[str, str]], max_tokens: int) -> List[Dict[str, str]]:
+    """
+    Keep the most recent history messages that fit in a token budget
+
+    Args:
+        messages: Conversation messages, oldest first
+        max_tokens: Token budget for the messages
+
+    Returns:
+        The newest messages that fit, oldest first
+    """
+    kept = []
+    remaining = max_tokens
+    for message in reversed(messages):
+        tokens = count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+        if tokens > remaining:
+            break
+        kept.append(message)
+        remaining -= tokens
+
+    # Don't start the history halfway through an exchange
+    if kept and kept[-1]["role"] == "assistant":
+        kept.pop()
+
+    return list(reversed(kept))
+
+
+def build_prompt(system_message: str, question: str, user_template: str = "{context}\n\n{question}",
+                 history: Optional[List[Dict[str, str]]] = None, chunks: Optional[List[Dict[str, Any]]] = None,
+                 formatter: Callable[[Dict[str, Any], int], str] = format_chunk,
+                 max_tokens: int = PROMPT_MAX_TOKENS,
+                 budgets: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    """
+    Assemble chat messages within a token budget
+
+    Each section (system, history, context, question) has its own budget.
+    The oldest history messages and the least relevant chunks are dropped
+    first, and room the history doesn't use goes to the context.
+
+    Args:
+        system_message: System prompt
+        question: The user's question
+        user_template: Template for the final user message, with {context}
+            and {question} placeholders
+        history: Previous conversation messages, oldest first, without the system message
+        chunks: Retrieved chunks for the context
+        formatter: Formats a chunk and its position for the prompt
+        max_tokens: Total token budget for the prompt
+        budgets: Per-section budgets overriding the defaults from config
+
+    Returns:
+        Dictionary with the messages, the chunks used and a token report
+    """
+    budgets = {
+        "system": PROMPT_BUDGET_SYSTEM,
+        "history": PROMPT_BUDGET_HISTORY,
+        "context": PROMPT_BUDGET_CONTEXT,
+        "question": PROMPT_BUDGET_QUESTION,
+        **(budgets or {})
+    }
+    history = history or []
+    chunks = chunks or []
+
+    system_message = truncate_to_tokens(system_message, budgets["system"])
+    question = truncate_to_tokens(question, budgets["question"])
+    template_tokens = count_tokens(user_template.format(context="", question=""))
+
+    system_tokens = count_tokens(system_message) + MESSAGE_OVERHEAD_TOKENS
+    question_tokens = count_tokens(question) + template_tokens + MESSAGE_OVERHEAD_TOKENS
+
+    kept_history = fit_history(history, min(
+        budgets["history"], max_tokens - system_tokens - question_tokens))
+    history_tokens = count_message_tokens(kept_history)
+
+    context_budget = max(0, min(
+        budgets["context"] + (budgets["history"] - history_tokens),
+        max_tokens - system_tokens - question_tokens - history_tokens))
+    kept_chunks = fit_chunks(chunks, context_budget, formatter)
+    context = "\n".join(formatter(chunk, i)
+                        for i, chunk in enumerate(kept_chunks))
+
+    messages = [{"role": "system", "content": system_message}]
+    messages.extend(kept_history)
+    messages.append({"role": "user", "content": user_template.format(
+        context=context, question=question)})
+
+    report = {
+        "system_tokens": system_tokens,
+        "history_tokens": history_tokens,
+        "context_tokens": count_tokens(context),
+        "question_tokens": question_tokens,
+        "total_tokens": count_message_tokens(messages),
+        "history_messages_dropped": len(history) - len(kept_history),
+        "chunks_used": len(kept_chunks),
+        "chunks_dropped": len(chunks) - len(kept_chunks),
+        "exact": _encoding is not None
+    }
+    logger.info(
+        f"Built prompt with {report['total_tokens']} tokens: {report['chunks_used']} chunks "
+        f"({report['chunks_dropped']} dropped), {len(kept_history)} history messages "
+        f"({report['history_messages_dropped']} dropped)")
+
+    return {"messages": messages, "chunks": kept_chunks, "report": report}
@@ -0,0 +1,136 @@
+import re
+import math
+import logging
+from collections import Counter
+from typing import Dict, List, Any, Optional
+
+from config import RERANKER, RERANK_MODEL, RERANK_TOP_N, RERANK_SEMANTIC_WEIGHT
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# The cross-encoder needs sentence-transformers, which is optional
+try:
+    from sentence_transformers import CrossEncoder
+except ImportError:
+    CrossEncoder = None
+
+TOKEN_RE = re.compile(r"\w+")
+
+# BM25 parameters for the lexical score
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Loaded on first use
+_cross_encoder = None
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens, ignoring very short words"""
+    return [token for token in TOKEN_RE.findall(text.lower()) if len(token) > 2]
+
+
+def reranking_enabled() -> bool:
+    """Whether search results should be over-fetched and reranked"""
+    return RERANKER in ("fusion", "cross-encoder")
+
+
+def lexical_scores(query: str, texts: List[str]) -> List[float]:
+    """
+    Score texts against a query with BM25, using the candidates themselves as the corpus
+
+    Args:
+        query: The user's query
+        texts: Candidate chunk texts
+
+    Returns:
+        BM25 score for each text
+    """
+    query_terms = set(tokenize(query))
+    documents = [Counter(tokenize(text)) for text in texts]
+    if not query_terms or not documents:
+        return [0.0] * len(texts)
+
+    average_length = sum(sum(doc.values()) for doc in documents) / len(documents) or 1
+    document_frequency = {term: sum(1 for doc in documents if term in doc)
+                          for term in query_terms}
+
+    scores = []
+    for doc in documents:
+        length = sum(doc.values())
+        score = 0.0
+        for term in query_terms:
+            frequency = doc.get(term, 0)
+            if not frequency:
+                continue
+            df = document_frequency[term]
+            idf = math.log(1 + (len(documents) - df + 0.5) / (df + 0.5))
+            score += idf * frequency * (BM25_K1 + 1) / (
+                frequency + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length))
+        scores.append(score)
+    return scores
+
+
+def fusion_scores(query: str, results: List[Dict[str, Any]]) -> List[float]:
+    """
+    Blend each result's embedding similarity with a lexical BM25 score
+
+    Distances are squared L2 between unit embeddings, so similarity is
+    1 - distance / 2. The lexical score is scaled to [0, 1] across the
+    candidates before blending.
+    """
+    semantic = [1 - result.get("score", 1.0) / 2 for result in results]
+    lexical = lexical_scores(query, [result.get("text", "") for result in results])
+    top = max(lexical) or 1
+    return [RERANK_SEMANTIC_WEIGHT * s + (1 - RERANK_SEMANTIC_WEIGHT) * (l / top)
+            for s, l in zip(semantic, lexical)]
+
+
+def cross_encoder_scores(query: str, results: List[Dict[str, Any]]) -> Optional[List[float]]:
+    """Score query/chunk pairs with a local cross-encoder, or None if it's unavailable"""
+    global _cross_encoder
+    if CrossEncoder is None:
+        return None
+    if _cross_encoder is None:
+        logger.info(f"Loading cross-encoder {RERANK_MODEL}")
+        _cross_encoder = CrossEncoder(RERANK_MODEL, device="cpu")
+    scores = _cross_encoder.predict(
+        [(query, result.get("text", "")) for result in results])
+    return [float(score) for score in scores]
+
+
+def rerank(query: str, results: List[Dict[str, Any]], top_n: int = RERANK_TOP_N) -> List[Dict[str, Any]]:
+    """
+    Rescore search results against the query and keep the best
+
+    Uses the cross-encoder when RERANKER is 'cross-encoder' and
+    sentence-transformers is installed, and the lexical/semantic fusion
+    scorer otherwise. Each kept result gets a 'rerank_score' (higher is
+    better); its distance 'score' is left unchanged.
+
+    Args:
+        query: The user's query
+        results: Search results from search_documents
+        top_n: Number of results to keep
+
+    Returns:
+        The top_n results, best first
+    """
+    if not results:
+        return results
+
+    scores = None
+    if RERANKER == "cross-encoder":
+        scores = cross_encoder_scores(query, results)
+        if scores is None:
+            logger.warning(
+                "sentence-transformers is not installed, falling back to fusion reranking")
+    if scores is None:
+        scores = fusion_scores(query, results)
+
+    ranked = sorted(zip(scores, range(len(results))), reverse=True)[:top_n]
+    reranked = [{**results[i], "rerank_score": score} for score, i in ranked]
+    logger.info(
+        f"Reranked {len(results)} candidates, keeping {len(reranked)}")
+    return reranked
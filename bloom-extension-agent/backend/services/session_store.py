@@ -0,0 +1,216 @@
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from config import SESSION_MAX_COUNT, SESSION_IDLE_TTL, SESSION_MAX_BYTES, SESSION_DB_PATH
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# How often expired sessions are deleted from the persistent backend
+BACKEND_PRUNE_INTERVAL = 300  # seconds
+
+
+class SQLiteSessionBackend:
+    """Persists session records in SQLite so they survive restarts and are shared across workers"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, check_same_thread=False, timeout=30)
+        with self._lock, self._connection:
+            # WAL lets several uvicorn workers read while one writes
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+        logger.info(f"Persisting sessions to {path}")
+
+    def load(self, session_id: str):
+        """Return (data, updated_at) for a session, or None if it isn't stored"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT data, updated_at FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row
+
+    def updated_at(self, session_id: str) -> Optional[float]:
+        """Return when a session was last saved, or None if it isn't stored"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT updated_at FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else None
+
+    def save(self, session_id: str, data: str, updated_at: float):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, data, updated_at) VALUES (?, ?, ?)",
+                (session_id, data, updated_at))
+
+    def delete(self, session_id: str):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def prune(self, cutoff: float) -> int:
+        """Delete sessions last saved before a cutoff time"""
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "DELETE FROM sessions WHERE updated_at < ?", (cutoff,))
+        return cursor.rowcount
+
+
+class SessionStore:
+    """
+    Bounded store of per-session records (conversation history and agent state).
+
+    Records are kept in memory in least-recently-used order. Sessions idle
+    for longer than the TTL are expired, and the least recently used are
+    evicted while the store holds more than max_sessions records or more than
+    max_bytes of serialized data. With a backend, every save is written
+    through, so a session evicted from memory (or saved by another worker)
+    is loaded back on its next access.
+
+    Records are plain JSON-serializable dicts. Callers mutate the record
+    returned by get() and then call save() to persist the change.
+    """
+
+    def __init__(self, max_sessions: int = SESSION_MAX_COUNT, idle_ttl: float = SESSION_IDLE_TTL,
+                 max_bytes: int = SESSION_MAX_BYTES, backend: Optional[SQLiteSessionBackend] = None):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.backend = backend
+        # session_id -> record, in LRU order
+        self._records = OrderedDict()
+        # session_id -> (serialized size, last access time, last saved time)
+        self._meta = {}
+        self._total_bytes = 0
+        self._last_backend_prune = 0
+        self.evictions = 0
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a session's record
+
+        Args:
+            session_id: Identifier for the conversation session
+
+        Returns:
+            The session's record, or None if it doesn't exist or has expired
+        """
+        now = time.time()
+        self.prune(now)
+
+        if session_id in self._records:
+            size, _, saved_at = self._meta[session_id]
+            # Another worker may have saved a newer version
+            if self.backend is None or (self.backend.updated_at(session_id) or 0) <= saved_at:
+                self._meta[session_id] = (size, now, saved_at)
+                self._records.move_to_end(session_id)
+                return self._records[session_id]
+
+        if self.backend is None:
+            return None
+
+        row = self.backend.load(session_id)
+        if row is None or now - row[1] > self.idle_ttl:
+            self._discard(session_id)
+            return None
+
+        data, saved_at = row
+        self._put(session_id, json.loads(data), len(data), now, saved_at)
+        return self._records[session_id]
+
+    def save(self, session_id: str, record: Dict[str, Any]):
+        """
+        Store a session's record, writing it through to the backend
+
+        Args:
+            session_id: Identifier for the conversation session
+            record: The session's record
+        """
+        now = time.time()
+        data = json.dumps(record)
+        self._put(session_id, record, len(data), now, now)
+        if self.backend is not None:
+            self.backend.save(session_id, data, now)
+
+    def delete(self, session_id: str):
+        """Remove a session from memory and the backend"""
+        self._discard(session_id)
+        if self.backend is not None:
+            self.backend.delete(session_id)
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """
+        Expire idle sessions
+
+        Args:
+            now: Current time (defaults to time.time())
+
+        Returns:
+            Number of sessions expired from memory
+        """
+        now = now or time.time()
+        cutoff = now - self.idle_ttl
+
+        expired = 0
+        # LRU order is last-access order, so idle sessions are at the front
+        while self._records:
+            session_id = next(iter(self._records))
+            if self._meta[session_id][1] >= cutoff:
+                break
+            self._discard(session_id)
+            expired += 1
+
+        if self.backend is not None and now - self._last_backend_prune > BACKEND_PRUNE_INTERVAL:
+            self._last_backend_prune = now
+            removed = self.backend.prune(cutoff)
+            if removed:
+                logger.info(f"Deleted {removed} expired sessions from {self.backend.path}")
+
+        return expired
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the number and size of sessions held in memory"""
+        return {
+            "sessions": len(self._records),
+            "bytes": self._total_bytes,
+            "evictions": self.evictions,
+            "persistent": self.backend is not None
+        }
+
+    def _put(self, session_id: str, record: Dict[str, Any], size: int, accessed_at: float, saved_at: float):
+        self._discard(session_id)
+        self._records[session_id] = record
+        self._meta[session_id] = (size, accessed_at, saved_at)
+        self._total_bytes += size
+
+        # Evict least recently used sessions, but always keep the one just stored
+        while len(self._records) > 1 and (len(self._records) > self.max_sessions
+                                          or self._total_bytes > self.max_bytes):
+            oldest = next(iter(self._records))
+            self._discard(oldest)
+            self.evictions += 1
+
+    def _discard(self, session_id: str):
+        if session_id in self._records:
+            del self._records[session_id]
+            self._total_bytes -= self._meta.pop(session_id)[0]
+
+
+def create_session_store() -> SessionStore:
+    """Create a session store, persisted to SESSION_DB_PATH when it is set"""
+    backend = SQLiteSessionBackend(SESSION_DB_PATH) if SESSION_DB_PATH else None
+    return SessionStore(backend=backend)
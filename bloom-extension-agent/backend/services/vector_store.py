@@ -1,7 +1,21 @@
 import chromadb
 import os
-from config import CHROMA_DB_DIR
-from services.embedding_service import get_embeddings
+import asyncio
+import json
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import numpy as np
+from config import (CHROMA_DB_DIR, VECTOR_BACKEND, NUMPY_STORE_DIR, EMBEDDING_DIMENSIONS,
+                    COLLECTION_EMBEDDING_DIMENSIONS, HYBRID_SEARCH, RRF_K, MMR_ENABLED, MMR_LAMBDA,
+                    MMR_FETCH_MULTIPLIER, MMR_MAX_PER_DOCUMENT, UNIFIED_COLLECTION,
+                    UNIFIED_COLLECTION_NAME)
+from services.embedding_service import get_embeddings, shorten_embeddings
+from services.response_cache import response_cache
+from services.lexical_index import get_lexical_index, index_chunks, remove_chunks, reciprocal_rank_fusion
+from services.numpy_store import NumpyClient
 import logging
 
 # Set up logging
@@ -11,20 +25,51 @@ logger = logging.getLogger(__name__)
 # Ensure DB directory exists
 os.makedirs(CHROMA_DB_DIR, exist_ok=True)
 
+# Runs lexical searches alongside vector queries
+_lexical_search_pool = ThreadPoolExecutor(max_workers=4)
+
+# Write buffer limits for bulk ingestion
+WRITE_BUFFER_MAX_CHUNKS = 256
+WRITE_BUFFER_MAX_SECONDS = 30
+# Most chunks and characters sent in one embedding request when flushing
+EMBEDDING_BATCH_MAX_TEXTS = 256
+EMBEDDING_BATCH_MAX_CHARS = 400000
+
+# (collection name, where clause) -> (collection count, matching chunk IDs), least recently used first
+WHERE_IDS_CACHE_MAX_ENTRIES = 256
+_where_ids = OrderedDict()
+_where_ids_lock = threading.Lock()
+
 # Create a proper embedding function class
 
 
 class OpenAIEmbeddingFunction:
+    def __init__(self, dimensions=None):
+        self.dimensions = dimensions
+
     def __call__(self, input):
         """
         The __call__ method needs to have a parameter named exactly 'input'
         """
-        return get_embeddings(input)
+        return get_embeddings(input, self.dimensions)
 
 
 # Collections cache to avoid multiple instances
 _collections = {}
 
+# collection_name -> embedding dimensions (None for the model's full size)
+_collection_dimensions = {}
+
+
+def get_client():
+    """
+    Returns the client for the configured vector store backend: ChromaDB, or the
+    in-process NumPy exact-search store
+    """
+    if VECTOR_BACKEND == "numpy":
+        return NumpyClient(NUMPY_STORE_DIR)
+    return chromadb.PersistentClient(path=CHROMA_DB_DIR)
+
 
 def get_collection(collection_name="bloom_documents"):
     """
@@ -32,59 +77,205 @@ def get_collection(collection_name="bloom_documents"):
     """
     global _collections
     if collection_name not in _collections:
-        # Initialize ChromaDB client
-        client = chromadb.PersistentClient(path=CHROMA_DB_DIR)
+        # Initialize vector store client
+        client = get_client()
 
         # Get or create collection with proper embedding function
-        _collections[collection_name] = client.get_or_create_collection(
+        collection = client.get_or_create_collection(
             name=collection_name,
             embedding_function=OpenAIEmbeddingFunction()
         )
 
+        # Embed query texts and documents at the collection's dimensions
+        dimensions = collection_dimensions(collection)
+        if dimensions:
+            collection = client.get_collection(
+                name=collection_name,
+                embedding_function=OpenAIEmbeddingFunction(dimensions)
+            )
+
+        _collection_dimensions[collection_name] = dimensions
+        _collections[collection_name] = collection
+
     return _collections[collection_name]
 
 
+def configured_dimensions(collection_name):
+    """
+    Embedding dimensions config asks for a collection, or None for the model's full size
+    """
+    return COLLECTION_EMBEDDING_DIMENSIONS.get(collection_name, EMBEDDING_DIMENSIONS)
+
+
+def collection_dimensions(collection):
+    """
+    Embedding dimensions a collection is indexed at, or None for the model's full size
+
+    The size is recorded in the collection's metadata when it is created, so
+    chunks and queries stay consistent if the setting later changes; an
+    existing collection only changes size through reembed_collections.py.
+    """
+    metadata = collection.metadata or {}
+    if "embedding_dimensions" in metadata:
+        return metadata["embedding_dimensions"] or None
+
+    dimensions = configured_dimensions(collection.name)
+    if not dimensions:
+        return None
+    if collection.count():
+        logger.warning(
+            f"{collection.name} is indexed at full size; run reembed_collections.py to shorten it to {dimensions}")
+        return None
+
+    collection.modify(metadata={**metadata, "embedding_dimensions": dimensions})
+    return dimensions
+
+
+def get_collection_dimensions(collection_name):
+    """
+    Embedding dimensions of a collection, or None for the model's full size
+    """
+    get_collection(collection_name)
+    return _collection_dimensions.get(collection_name)
+
+
 def list_collections():
     """
     List all available collections/modules
     """
-    client = chromadb.PersistentClient(path=CHROMA_DB_DIR)
+    if UNIFIED_COLLECTION:
+        return list_partitions(get_collection(UNIFIED_COLLECTION_NAME))
+
+    client = get_client()
     collections = client.list_collections()
     return [collection.name for collection in collections]
 
 
-def search_documents(query, collection_name="bloom_documents", k=5):
+def list_partitions(collection):
+    """
+    List the logical collections (bloom_documents, module_<code>) stored in a unified collection
+    """
+    partitions = (collection.metadata or {}).get("partitions", "")
+    return [name for name in partitions.split(",") if name]
+
+
+def register_partition(collection, collection_name):
+    """
+    Record a logical collection in the unified collection's metadata, so it can be listed
+    without scanning every chunk
+    """
+    if collection_name in list_partitions(collection):
+        return
+
+    # Re-read the metadata in case another process registered a partition since
+    client = get_client()
+    metadata = dict(client.get_collection(collection.name).metadata or {})
+    partitions = [name for name in metadata.get("partitions", "").split(",") if name]
+    if collection_name not in partitions:
+        metadata["partitions"] = ",".join(sorted(partitions + [collection_name]))
+    collection.modify(metadata=metadata)
+
+
+def partition_where(collection_name, where=None):
+    """
+    Where clause selecting one logical collection's chunks in the unified collection,
+    combined with any other filter
+    """
+    partition = {"collection": collection_name}
+    return {"$and": [partition, where]} if where else partition
+
+
+def build_where(filters):
     """
-    Search for similar documents in the specified collection or across all collections
+    Build a ChromaDB where clause from metadata filters
+
+    Args:
+        filters: Dict of metadata field to a value or list of accepted values,
+            e.g. {"source_type": "user_upload", "document_id": ["a", "b"]}
+
+    Returns:
+        The where clause, or None if there is nothing to filter on
+    """
+    conditions = []
+    for field, value in (filters or {}).items():
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple, set)):
+            values = list(value)
+            conditions.append({field: values[0]} if len(values) == 1 else {field: {"$in": values}})
+        else:
+            conditions.append({field: value})
+
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def search_documents(query, collection_name="bloom_documents", k=5, query_embedding=None, where=None):
+    """
+    Search for similar documents in the specified collection or across all collections,
+    optionally restricted to chunks whose metadata matches a where clause
     """
+    if UNIFIED_COLLECTION:
+        return search_unified(query, collection_name, k, query_embedding, where)
+
     # Check if we should search all collections
     if collection_name == "all" or not collection_name:
         logger.info(f"Searching across all collections for query: {query}")
-        return search_all_collections(query, k)
+        return search_all_collections(query, k, query_embedding, where)
     else:
         logger.info(
             f"Searching in collection {collection_name} for query: {query}")
-        collection = get_collection(collection_name)
         try:
-            results = collection.query(
-                query_texts=[query],
-                n_results=k
-            )
-            return format_results(results)
+            if MMR_ENABLED and query_embedding is None:
+                query_embedding = get_embeddings([query])[0]
+            results = query_collection(
+                collection_name, query, candidate_count(k), query_embedding, where)
+            return select_results(results, query_embedding, k)
         except Exception as e:
             logger.error(
                 f"Error searching collection {collection_name}: {str(e)}")
             return []
 
 
-def search_all_collections(query, k=5):
+def search_unified(query, collection_name="all", k=5, query_embedding=None, where=None):
+    """
+    Search the unified collection, where every module is a partition.
+
+    Searching all modules is a single query; searching one module filters
+    on its partition key.
+    """
+    if collection_name == "all" or not collection_name:
+        logger.info(f"Searching all partitions of {UNIFIED_COLLECTION_NAME} for query: {query}")
+    else:
+        logger.info(
+            f"Searching partition {collection_name} of {UNIFIED_COLLECTION_NAME} for query: {query}")
+        where = partition_where(collection_name, where)
+
+    try:
+        if MMR_ENABLED and query_embedding is None:
+            query_embedding = get_embeddings([query])[0]
+        results = query_collection(
+            UNIFIED_COLLECTION_NAME, query, candidate_count(k), query_embedding, where)
+        return select_results(results, query_embedding, k)
+    except Exception as e:
+        logger.error(
+            f"Error searching {UNIFIED_COLLECTION_NAME}: {str(e)}")
+        return []
+
+
+def search_all_collections(query, k=5, query_embedding=None, where=None):
     """
     Search across all collections and return combined results with additional debugging
     """
-    client = chromadb.PersistentClient(path=CHROMA_DB_DIR)
+    client = get_client()
     collections = client.list_collections()
     all_results = []
 
+    # Embed the query once for every collection
+    if query_embedding is None and (HYBRID_SEARCH or MMR_ENABLED):
+        query_embedding = get_embeddings([query])[0]
+
     logger.info(f"Found {len(collections)} collections to search")
 
     # List all collections for debugging
@@ -101,11 +292,8 @@ def search_all_collections(query, k=5):
         c.name == "bloom_documents" for c in collections)
     if default_collection_exists:
         try:
-            default_results = get_collection("bloom_documents").query(
-                query_texts=[query],
-                n_results=k
-            )
-            default_formatted = format_results(default_results)
+            default_formatted = query_collection(
+                "bloom_documents", query, candidate_count(k), query_embedding, where)
             logger.info(
                 f"Found {len(default_formatted)} results in default collection")
 
@@ -130,12 +318,8 @@ def search_all_collections(query, k=5):
     for collection in module_collections:
         try:
             logger.info(f"Searching collection: {collection.name}")
-            module_collection = get_collection(collection.name)
-            module_results = module_collection.query(
-                query_texts=[query],
-                n_results=k
-            )
-            module_formatted = format_results(module_results)
+            module_formatted = query_collection(
+                collection.name, query, candidate_count(k), query_embedding, where)
             logger.info(
                 f"Found {len(module_formatted)} results in {collection.name}")
 
@@ -153,11 +337,11 @@ def search_all_collections(query, k=5):
             logger.error(
                 f"Error searching collection {collection.name}: {str(e)}")
 
-    # Sort by relevance (lower distance means more relevant)
-    all_results.sort(key=lambda x: x.get("score", 1.0))
+    # Sort by relevance across the collections
+    merge_results(all_results)
 
-    # Take top k results
-    final_results = all_results[:k]
+    # Take top k results, diversified across documents
+    final_results = select_results(all_results, query_embedding, k)
     logger.info(
         f"Returning top {len(final_results)} results across all collections")
 
@@ -176,6 +360,344 @@ def search_all_collections(query, k=5):
     return final_results
 
 
+def search_documents_batch(queries, collection_name="bloom_documents", k=5, where=None):
+    """
+    Search for several queries at once, returning one result list per query
+
+    Embeds every query in one request and queries each collection once with
+    all of the query embeddings, instead of one embedding request and one
+    collection query per question. Results per query match search_documents.
+    """
+    if not queries:
+        return []
+
+    query_embeddings = get_embeddings(queries)
+
+    # The physical collections to query, each with its where clause
+    if UNIFIED_COLLECTION:
+        if collection_name and collection_name != "all":
+            where = partition_where(collection_name, where)
+        targets = [UNIFIED_COLLECTION_NAME]
+    elif collection_name == "all" or not collection_name:
+        targets = [collection.name for collection in get_client().list_collections()
+                   if collection.name == "bloom_documents" or collection.name.startswith("module_")]
+    else:
+        targets = [collection_name]
+
+    logger.info(
+        f"Batch searching {len(queries)} queries in {len(targets)} collections")
+
+    combined = [[] for _ in queries]
+    for target in targets:
+        try:
+            batches = query_collection_batch(
+                target, queries, candidate_count(k), query_embeddings, where)
+        except Exception as e:
+            logger.error(f"Error batch searching collection {target}: {str(e)}")
+            continue
+        for results, batch in zip(combined, batches):
+            results.extend(batch)
+
+    final_results = []
+    for results, query_embedding in zip(combined, query_embeddings):
+        # Merge collections by relevance, as search_all_collections does
+        if len(targets) > 1:
+            merge_results(results)
+        final_results.append(select_results(results, query_embedding, k))
+    return final_results
+
+
+def merge_results(results):
+    """
+    Order results gathered from several collections by relevance, in place
+
+    Fused scores are computed from ranks within one collection, so they can't
+    be compared across collections. With hybrid search, reciprocal rank fusion
+    is run again over all of the results: the vector ranking by embedding
+    distance, and the lexical ranking by BM25 score. Their 'rrf_score' is
+    replaced by the new fused score, which MMR then uses as relevance.
+    Without hybrid search results are ordered by distance.
+    """
+    results.sort(key=lambda x: x.get("score", 1.0))
+    if not HYBRID_SEARCH:
+        return results
+
+    lexical = sorted((i for i, result in enumerate(results) if result.get("lexical_score")),
+                     key=lambda i: -results[i]["lexical_score"])
+    fused = reciprocal_rank_fusion([list(range(len(results))), lexical], RRF_K)
+    for i, result in enumerate(results):
+        result["rrf_score"] = fused[i]
+    results.sort(key=lambda x: -x["rrf_score"])
+    return results
+
+
+def candidate_count(k):
+    """Number of results to fetch per collection for a final top k"""
+    return k * MMR_FETCH_MULTIPLIER if MMR_ENABLED else k
+
+
+def select_results(results, query_embedding, k):
+    """
+    Pick the final top k from relevance-ordered results, dropping their embeddings
+    """
+    if MMR_ENABLED and query_embedding is not None:
+        selected = mmr_select(results, query_embedding, k)
+    else:
+        selected = results[:k]
+
+    for result in selected:
+        result.pop("embedding", None)
+    return selected
+
+
+def mmr_select(results, query_embedding, k, lambda_mult=MMR_LAMBDA, max_per_document=MMR_MAX_PER_DOCUMENT):
+    """
+    Select k diverse results with Maximal Marginal Relevance
+
+    Greedily picks the result with the best trade-off between relevance to
+    the query and similarity to the results already picked, taking at most
+    max_per_document chunks from any one document. Overlapping neighbouring
+    chunks of the same file are therefore unlikely to fill every slot. When
+    too few documents match to fill k slots under the cap, the remaining
+    slots are filled from the capped chunks, still in MMR order.
+    Relevance is the fused hybrid score when present (fused over every
+    collection searched, see merge_results), otherwise cosine similarity to
+    the query. Results without embeddings keep their order.
+    """
+    if len(results) <= 1 or any("embedding" not in result for result in results):
+        return results[:k]
+
+    # Collections can be indexed at different dimensions; shortened
+    # embeddings are prefixes of the full ones, so compare the shared prefix
+    dimensions = min(len(result["embedding"]) for result in results)
+    embeddings = np.asarray([result["embedding"][:dimensions] for result in results], dtype=np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-12
+    query_vector = np.asarray(query_embedding[:dimensions], dtype=np.float32)
+    query_vector /= np.linalg.norm(query_vector) + 1e-12
+
+    if all("rrf_score" in result for result in results):
+        relevance = np.asarray([result["rrf_score"] for result in results], dtype=np.float32)
+        relevance /= relevance.max()
+    else:
+        relevance = embeddings @ query_vector
+
+    documents = [result.get("metadata", {}).get("document_id") for result in results]
+    per_document = {}
+    available = np.ones(len(results), dtype=bool)
+    capped = np.zeros(len(results), dtype=bool)
+    max_similarity = np.full(len(results), -1.0, dtype=np.float32)
+    selected = []
+
+    while len(selected) < k:
+        if not available.any():
+            if not capped.any():
+                break
+            # Not enough other documents; lift the cap for the remaining slots
+            available = capped
+            capped = np.zeros(len(results), dtype=bool)
+            max_per_document = None
+        scores = lambda_mult * relevance - (1 - lambda_mult) * np.maximum(max_similarity, 0)
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        available[best] = False
+
+        document = documents[best]
+        if document is not None and max_per_document is not None:
+            if per_document.get(document, 0) >= max_per_document:
+                capped[best] = True
+                continue
+            per_document[document] = per_document.get(document, 0) + 1
+
+        selected.append(results[best])
+        # Only the picked rows of the similarity matrix are ever needed
+        np.maximum(max_similarity, embeddings @ embeddings[best], out=max_similarity)
+
+    return selected
+
+
+def query_collection(collection_name, query, k=5, query_embedding=None, where=None):
+    """
+    Query one collection, fusing vector and lexical results when hybrid search is on
+
+    The vector query and the BM25 lookup run in parallel and are merged with
+    reciprocal rank fusion, so exact terms like module codes and assessment
+    IDs are found even when they are missed by embedding similarity. Every
+    result keeps its embedding distance as 'score'; fused results are ordered
+    by 'rrf_score'. A where clause is pushed down to ChromaDB and restricts
+    the lexical search to the same chunks.
+    """
+    query_embeddings = [query_embedding] if query_embedding is not None else None
+    return query_collection_batch(collection_name, [query], k, query_embeddings, where)[0]
+
+
+def query_collection_batch(collection_name, queries, k=5, query_embeddings=None, where=None):
+    """
+    Query one collection for several queries with a single vector query
+
+    Works like query_collection for each query, but passes every query
+    embedding to one collection.query call; the lexical lookups run in
+    parallel with it. Returns one result list per query, in order.
+    """
+    collection = get_collection(collection_name)
+    include = ["documents", "metadatas", "distances"]
+    if MMR_ENABLED:
+        include.append("embeddings")
+
+    if HYBRID_SEARCH and query_embeddings is None:
+        query_embeddings = get_embeddings(queries)
+    if query_embeddings is not None:
+        query_embeddings = shorten_embeddings(
+            query_embeddings, get_collection_dimensions(collection_name))
+
+    query_arguments = {}
+    allowed_ids = None
+    if where:
+        # ChromaDB errors when asked for more results than match the filter
+        allowed_ids = matching_ids(collection_name, collection, where)
+        if not allowed_ids:
+            return [[] for _ in queries]
+        k = min(k, len(allowed_ids))
+        query_arguments["where"] = where
+
+    if query_embeddings is not None:
+        query_arguments["query_embeddings"] = query_embeddings
+    else:
+        query_arguments["query_texts"] = queries
+
+    if not HYBRID_SEARCH:
+        return format_batch_results(collection.query(
+            n_results=k,
+            include=include,
+            **query_arguments
+        ))
+
+    lexical_futures = [
+        _lexical_search_pool.submit(
+            lambda query=query: get_lexical_index(collection_name, collection).search(query, k, allowed_ids))
+        for query in queries
+    ]
+    dense_batches = format_batch_results(collection.query(
+        n_results=k,
+        include=include,
+        **query_arguments
+    ))
+
+    return [
+        fuse_results(collection_name, collection, dense, future, query_embedding, k)
+        for dense, future, query_embedding in zip(dense_batches, lexical_futures, query_embeddings)
+    ]
+
+
+def matching_ids(collection_name, collection, where):
+    """
+    IDs of the chunks in a collection that match a where clause
+
+    Cached per clause until the collection is next written; a change in the
+    collection's count also drops the cached IDs, which catches writes made
+    by other processes.
+    """
+    key = (collection_name, json.dumps(where, sort_keys=True))
+    count = collection.count()
+    with _where_ids_lock:
+        cached = _where_ids.get(key)
+        if cached is not None and cached[0] == count:
+            _where_ids.move_to_end(key)
+            return cached[1]
+
+    ids = collection.get(where=where, include=[])["ids"]
+    with _where_ids_lock:
+        _where_ids[key] = (count, ids)
+        _where_ids.move_to_end(key)
+        while len(_where_ids) > WHERE_IDS_CACHE_MAX_ENTRIES:
+            _where_ids.popitem(last=False)
+    return ids
+
+
+def invalidate_matching_ids(collection_name):
+    """Drop the cached where clause matches of a collection after it is written"""
+    with _where_ids_lock:
+        for key in [key for key in _where_ids if key[0] == collection_name]:
+            del _where_ids[key]
+
+
+def fuse_results(collection_name, collection, dense, lexical_future, query_embedding, k):
+    """
+    Merge one query's vector results with its lexical search by reciprocal rank fusion
+    """
+    try:
+        lexical = lexical_future.result()
+    except Exception as e:
+        logger.error(
+            f"Error in lexical search of {collection_name}: {str(e)}")
+        return dense
+
+    fused = reciprocal_rank_fusion(
+        [[result["id"] for result in dense], [chunk_id for chunk_id, _ in lexical]], RRF_K)
+    results = {result["id"]: result for result in dense}
+
+    # Fetch the chunks only the lexical search found, with distances for consistent scoring
+    missing = [chunk_id for chunk_id, _ in lexical if chunk_id not in results]
+    if missing:
+        for result in fetch_chunks(collection, missing, query_embedding):
+            results[result["id"]] = result
+
+    ranked = sorted(results.values(), key=lambda result: -fused[result["id"]])[:k]
+    lexical_scores = dict(lexical)
+    for result in ranked:
+        result["rrf_score"] = fused[result["id"]]
+        # Kept so results from several collections can be fused again
+        if result["id"] in lexical_scores:
+            result["lexical_score"] = lexical_scores[result["id"]]
+
+    logger.info(
+        f"Hybrid search of {collection_name}: {len(dense)} vector and {len(lexical)} lexical matches, "
+        f"{len(missing)} found only lexically")
+    return ranked
+
+
+def fetch_chunks(collection, ids, query_embedding):
+    """
+    Fetch chunks by ID as formatted results, scored by distance to the query embedding
+    """
+    fetched = collection.get(
+        ids=ids, include=["documents", "metadatas", "embeddings"])
+    if not fetched["ids"]:
+        return []
+
+    embeddings = np.asarray(fetched["embeddings"], dtype=np.float32)
+    query_vector = np.asarray(query_embedding, dtype=np.float32)
+    # Squared L2, matching the collection's distance function
+    distances = ((embeddings - query_vector) ** 2).sum(axis=1)
+
+    return [
+        {
+            "id": chunk_id,
+            "text": text,
+            "metadata": metadata or {"warning": "No metadata available"},
+            "score": float(distance),
+            "embedding": embedding
+        }
+        for chunk_id, text, metadata, distance, embedding in zip(
+            fetched["ids"], fetched["documents"], fetched["metadatas"], distances, embeddings)
+    ]
+
+
+def get_document_chunks(document_id, collection_name="bloom_documents"):
+    """
+    All chunks of one document, in document order
+    """
+    target_name = UNIFIED_COLLECTION_NAME if UNIFIED_COLLECTION else collection_name
+    fetched = get_collection(target_name).get(
+        where={"document_id": document_id}, include=["documents", "metadatas"])
+
+    chunks = [
+        {"id": chunk_id, "text": text, "metadata": metadata or {}}
+        for chunk_id, text, metadata in zip(fetched["ids"], fetched["documents"], fetched["metadatas"])
+    ]
+    chunks.sort(key=lambda chunk: chunk["metadata"].get("chunk_index", 0))
+    return chunks
+
+
 def format_results(results):
     """Format ChromaDB results into a standardized format with better error handling"""
     formatted_results = []
@@ -224,6 +746,10 @@ def format_results(results):
                 "score": results["distances"][0][i] if "distances" in results and results["distances"][0] else 1.0
             }
 
+            # Embeddings are only returned when requested, for MMR selection
+            if results.get("embeddings") is not None:
+                result["embedding"] = results["embeddings"][0][i]
+
             # Verify basic result integrity
             if not result["text"] or len(result["text"].strip()) < 10:
                 logger.warning(f"Result {i} has very little text content")
@@ -239,9 +765,22 @@ def format_results(results):
     return formatted_results
 
 
-def add_documents(texts, metadatas, collection_name="bloom_documents"):
+def format_batch_results(results):
+    """Split a multi-query ChromaDB result into one formatted result list per query"""
+    count = len(results.get("ids") or []) if results else 0
+    return [
+        format_results({
+            field: [values[i]] if values is not None else None
+            for field, values in results.items()
+            if field in ("ids", "documents", "metadatas", "distances", "embeddings")
+        })
+        for i in range(count)
+    ]
+
+
+def add_documents(texts, metadatas, collection_name="bloom_documents", embeddings=None):
     """
-    Add documents to the specified collection
+    Add documents to the specified collection, optionally with precomputed embeddings
     """
     if not texts or not metadatas:
         logger.warning(
@@ -250,7 +789,17 @@ def add_documents(texts, metadatas, collection_name="bloom_documents"):
 
     logger.info(
         f"Adding {len(texts)} documents to collection {collection_name}")
-    collection = get_collection(collection_name)
+
+    # In unified mode the logical collection becomes a partition key
+    target_name = collection_name
+    if UNIFIED_COLLECTION:
+        target_name = UNIFIED_COLLECTION_NAME
+        metadatas = [{**metadata, "collection": collection_name}
+                     for metadata in metadatas]
+    collection = get_collection(target_name)
+    if embeddings is not None:
+        embeddings = shorten_embeddings(
+            embeddings, get_collection_dimensions(target_name))
 
     # Generate IDs based on metadata
     ids = []
@@ -261,15 +810,231 @@ def add_documents(texts, metadatas, collection_name="bloom_documents"):
 
     # Add to collection
     try:
-        collection.add(
-            ids=ids,
-            documents=texts,
-            metadatas=metadatas
-        )
+        if embeddings is not None:
+            collection.add(
+                ids=ids,
+                documents=texts,
+                metadatas=metadatas,
+                embeddings=embeddings
+            )
+        else:
+            collection.add(
+                ids=ids,
+                documents=texts,
+                metadatas=metadatas
+            )
         logger.info(
             f"Successfully added {len(texts)} documents to {collection_name}")
     except Exception as e:
         logger.error(f"Error adding documents to {collection_name}: {str(e)}")
         raise e
 
+    if UNIFIED_COLLECTION:
+        register_partition(collection, collection_name)
+    invalidate_matching_ids(target_name)
+
+    # Keep the lexical index in step with the collection
+    if HYBRID_SEARCH:
+        try:
+            index_chunks(target_name, ids, texts, collection)
+        except Exception as e:
+            logger.error(
+                f"Error updating lexical index for {target_name}: {str(e)}")
+
+    # Cached answers for this collection may now be out of date
+    response_cache.invalidate(collection_name)
+
+    return ids
+
+
+def delete_document(document_id, collection_name="bloom_documents"):
+    """
+    Remove every chunk of one document from the specified collection
+
+    Returns:
+        IDs of the chunks removed
+    """
+    target_name = UNIFIED_COLLECTION_NAME if UNIFIED_COLLECTION else collection_name
+    collection = get_collection(target_name)
+    ids = collection.get(where={"document_id": document_id}, include=[])["ids"]
+    if not ids:
+        return []
+
+    collection.delete(ids=ids)
+    invalidate_matching_ids(target_name)
+    logger.info(
+        f"Deleted {len(ids)} chunks of document {document_id} from {collection_name}")
+
+    if HYBRID_SEARCH:
+        try:
+            remove_chunks(target_name, ids)
+        except Exception as e:
+            logger.error(
+                f"Error updating lexical index for {target_name}: {str(e)}")
+
+    response_cache.invalidate(collection_name)
+
     return ids
+
+
+def embedding_batches(texts):
+    """Split texts into consecutive batches small enough for one embedding request"""
+    batch = []
+    chars = 0
+    for text in texts:
+        if batch and (len(batch) >= EMBEDDING_BATCH_MAX_TEXTS or chars + len(text) > EMBEDDING_BATCH_MAX_CHARS):
+            yield batch
+            batch = []
+            chars = 0
+        batch.append(text)
+        chars += len(text)
+    if batch:
+        yield batch
+
+
+class DocumentWriteBuffer:
+    """
+    Collects chunks from many documents and writes them in large batches.
+
+    Each flush embeds a collection's pending chunks in as few bounded
+    requests as possible and makes one add_documents call per collection,
+    instead of one of each per file. On an event loop use add_async and
+    flush_async, which do the embedding and writing in a worker thread.
+    """
+
+    def __init__(self, max_chunks=WRITE_BUFFER_MAX_CHUNKS, max_seconds=WRITE_BUFFER_MAX_SECONDS):
+        self.max_chunks = max_chunks
+        self.max_seconds = max_seconds
+        # collection_name -> {"texts", "metadatas", "on_flush", "on_error"}
+        self._pending = {}
+        self._count = 0
+        self._oldest = None
+        self._flush_lock = None
+        self.flushes = 0
+        self.chunks_written = 0
+
+    def add(self, texts, metadatas, collection_name="bloom_documents", on_flush=None, on_error=None):
+        """
+        Queue chunks for a collection, flushing when the buffer is full or stale
+
+        Args:
+            texts: Chunk texts
+            metadatas: Chunk metadata, one per text
+            collection_name: Target collection
+            on_flush: Optional callback run once these chunks are written
+            on_error: Optional callback given the exception if writing them fails
+        """
+        if self._queue(texts, metadatas, collection_name, on_flush, on_error):
+            self.flush()
+
+    async def add_async(self, texts, metadatas, collection_name="bloom_documents", on_flush=None, on_error=None):
+        """Like add, but flushes with flush_async"""
+        if self._queue(texts, metadatas, collection_name, on_flush, on_error):
+            await self.flush_async()
+
+    def _queue(self, texts, metadatas, collection_name, on_flush, on_error):
+        """Add chunks to the buffer, returning whether it is due a flush"""
+        if not texts:
+            # Nothing to write, so nothing to wait for
+            if on_flush:
+                on_flush()
+            return False
+
+        pending = self._pending.setdefault(
+            collection_name, {"texts": [], "metadatas": [], "on_flush": [], "on_error": []})
+        pending["texts"].extend(texts)
+        pending["metadatas"].extend(metadatas)
+        if on_flush:
+            pending["on_flush"].append(on_flush)
+        if on_error:
+            pending["on_error"].append(on_error)
+
+        self._count += len(texts)
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+
+        return self._count >= self.max_chunks or time.monotonic() - self._oldest >= self.max_seconds
+
+    def _take(self):
+        """Empty the buffer, returning its pending chunks per collection"""
+        logger.info(
+            f"Flushing {self._count} buffered chunks across {len(self._pending)} collections")
+        pending = self._pending
+        self._pending = {}
+        self._count = 0
+        self._oldest = None
+        self.flushes += 1
+        return pending
+
+    @staticmethod
+    def _write(collection_name, pending):
+        """Embed and store one collection's pending chunks"""
+        embeddings = []
+        for batch in embedding_batches(pending["texts"]):
+            embeddings.extend(get_embeddings(batch))
+        add_documents(pending["texts"], pending["metadatas"], collection_name,
+                      embeddings=embeddings)
+
+    def _finish(self, collection_name, pending, error=None):
+        """Run the callbacks of one collection's chunks once writing them succeeded or failed"""
+        if error is not None:
+            logger.error(
+                f"Failed to write {len(pending['texts'])} buffered chunks to {collection_name}: {str(error)}")
+            callbacks = [partial(callback, error) for callback in pending["on_error"]]
+        else:
+            self.chunks_written += len(pending["texts"])
+            callbacks = pending["on_flush"]
+        for callback in callbacks:
+            callback()
+
+    def flush(self):
+        """
+        Write all pending chunks, one collection at a time
+
+        Chunks that fail to write are dropped and their on_error callbacks
+        run; the other collections are still written, then the first error
+        is raised.
+        """
+        if not self._count:
+            return
+
+        first_error = None
+        for collection_name, pending in self._take().items():
+            try:
+                self._write(collection_name, pending)
+            except Exception as e:
+                first_error = first_error or e
+                self._finish(collection_name, pending, e)
+            else:
+                self._finish(collection_name, pending)
+
+        if first_error is not None:
+            raise first_error
+
+    async def flush_async(self):
+        """
+        Like flush, but embeds and writes in a worker thread so the event loop keeps running
+
+        Callbacks still run on the event loop. Flushes run one at a time, so
+        a final flush returns only once every earlier one has finished.
+        """
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        loop = asyncio.get_running_loop()
+        async with self._flush_lock:
+            if not self._count:
+                return
+
+            first_error = None
+            for collection_name, pending in self._take().items():
+                try:
+                    await loop.run_in_executor(None, partial(self._write, collection_name, pending))
+                except Exception as e:
+                    first_error = first_error or e
+                    self._finish(collection_name, pending, e)
+                else:
+                    self._finish(collection_name, pending)
+
+        if first_error is not None:
+            raise first_error
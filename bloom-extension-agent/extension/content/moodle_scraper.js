@@ -549,6 +549,7 @@ class MoodleScraper {
           cookies,
           documents: documents, // Include extracted documents
           has_folders: this.folderLinks.length > 0,
+          crawl_folders: true, // Let the server traverse folders itself
         }),
       });
 
@@ -561,8 +562,8 @@ class MoodleScraper {
       const result = await response.json();
       const taskId = result.task_id;
 
-      // Process folders if found
-      if (this.folderLinks.length > 0) {
+      // Process folders if found (unless the server is crawling them)
+      if (this.folderLinks.length > 0 && !result.crawl_folders) {
         console.log(
           `Beginning to process ${this.folderLinks.length} folders...`
         );
@@ -534,8 +534,8 @@ document.addEventListener("DOMContentLoaded", function () {
     scrollToBottom();
 
     try {
-      // Send request to API with the selected module
-      const response = await fetch(`${apiUrl}/chat`, {
+      // Send request to the streaming API with the selected module
+      const response = await fetch(`${apiUrl}/chat/stream`, {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
@@ -547,33 +547,67 @@ document.addEventListener("DOMContentLoaded", function () {
         }),
       });
 
-      const data = await response.json();
-
-      // Remove thinking indicator
-      messagesContainer.removeChild(thinkingDiv);
-
-      if (response.ok) {
-        // Add bot response with real-time Markdown streaming
-        addBotMessage(data.response);
-
-        // Store sources
-        if (data.sources && data.sources.length > 0) {
-          latestSources = data.sources;
-          updateSourcePreview();
-
-          // Show sources if not already showing
-          if (!showingSources) {
-            toggleSourcePreview(true);
-          }
-        }
-      } else {
-        // Add error message
+      if (!response.ok) {
+        const data = await response.json();
+        messagesContainer.removeChild(thinkingDiv);
         addBotMessage("Sorry, I encountered an error. Please try again.");
         console.error("Chat error:", data.detail);
+        return;
       }
+
+      // Render tokens into a single message as they arrive
+      let messageDiv = null;
+      let responseText = "";
+
+      await readEventStream(response, (event, data) => {
+        if (event === "sources") {
+          // Store sources
+          if (data.sources && data.sources.length > 0) {
+            latestSources = data.sources;
+            updateSourcePreview();
+
+            // Show sources if not already showing
+            if (!showingSources) {
+              toggleSourcePreview(true);
+            }
+          }
+        } else if (event === "token") {
+          if (!messageDiv) {
+            messagesContainer.removeChild(thinkingDiv);
+            messageDiv = document.createElement("div");
+            messageDiv.className = "bloom-message bloom-bot-message streaming";
+            messagesContainer.appendChild(messageDiv);
+          }
+          responseText += data.text;
+          messageDiv.innerHTML = parseMarkdown(responseText);
+          scrollToBottom();
+        } else if (event === "done") {
+          if (messageDiv && !data.response.startsWith("[BLOOM Agent")) {
+            // Final render of the streamed message
+            messageDiv.innerHTML = parseMarkdown(data.response);
+            messageDiv.classList.remove("streaming");
+            scrollToBottom();
+          } else {
+            // Agent responses get their own formatting
+            messagesContainer.removeChild(messageDiv || thinkingDiv);
+            addBotMessage(data.response);
+          }
+          messageDiv = null;
+        } else if (event === "error") {
+          if (messageDiv) {
+            messageDiv.classList.remove("streaming");
+          } else {
+            messagesContainer.removeChild(thinkingDiv);
+          }
+          addBotMessage("Sorry, I encountered an error. Please try again.");
+          console.error("Chat error:", data.detail);
+        }
+      });
     } catch (error) {
       // Remove thinking indicator
-      messagesContainer.removeChild(thinkingDiv);
+      if (thinkingDiv.parentNode) {
+        messagesContainer.removeChild(thinkingDiv);
+      }
 
       // Add error message
       addBotMessage(
@@ -583,6 +617,39 @@ document.addEventListener("DOMContentLoaded", function () {
     }
   }
 
+  // Read server-sent events from a fetch response
+  async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+
+      buffer += decoder.decode(value, { stream: true });
+
+      // Events are separated by a blank line
+      let boundary;
+      while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+        const rawEvent = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+
+        let event = "message";
+        let data = "";
+        rawEvent.split("\n").forEach((line) => {
+          if (line.startsWith("event: ")) {
+            event = line.slice(7);
+          } else if (line.startsWith("data: ")) {
+            data += line.slice(6);
+          }
+        });
+
+        onEvent(event, data ? JSON.parse(data) : {});
+      }
+    }
+  }
+
   // Update source preview with latest sources
   function updateSourcePreview() {
     sourcesContainer.innerHTML = "";
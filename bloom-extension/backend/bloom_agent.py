@@ -6,18 +6,116 @@ enabling autonomous document analysis tasks like summarization,
 key point extraction, study guide creation, and document comparison.
 """
 
+import os
 import re
-from typing import Dict, List, Any, Optional
+import asyncio
+from collections import Counter
+from functools import partial
+from typing import Callable, Dict, List, Any, Optional
 import logging
-import openai
-from config import OPENAI_API_KEY, CHAT_MODEL
+from config import (CHAT_MODEL, SUMMARY_MODEL, PROMPT_BUDGET_CONTEXT, PROMPT_BUDGET_HISTORY,
+                    AGENT_QUERY_EXPANSION, AGENT_SUB_QUERIES, AGENT_RESULTS_PER_QUERY, RRF_K,
+                    COMPARE_MAX_DOCUMENTS, COMPARE_DOCUMENT_TOKENS)
+from services.prompt_builder import fit_chunks, format_chunk, count_tokens, count_message_tokens
+from services.lexical_index import reciprocal_rank_fusion
+from services.vector_store import search_documents_batch
+from services.document_summarizer import summarize_document, stored_summary, question_digest
+from services.intent_router import router
+from services.llm_gateway import chat_completion
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Set API key
-openai.api_key = OPENAI_API_KEY
+# Number of past actions kept per session
+MAX_AGENT_HISTORY = 20
+
+# Agent prompts carry no conversation history, so that budget goes to the context
+AGENT_CONTEXT_TOKENS = PROMPT_BUDGET_CONTEXT + PROMPT_BUDGET_HISTORY
+
+# Words showing a summary request is about whole documents rather than a topic
+WHOLE_DOCUMENT_RE = re.compile(
+    r'\b(this|whole|entire|full|document|handbook|file|pdf|paper|chapter|lecture|slides)\b')
+
+# Most documents summarized in full for one request
+MAX_SUMMARY_DOCUMENTS = 3
+
+# Words that only ask for a whole-document summary or key points; a request
+# with nothing else in it can be answered with the stored digest
+DIGEST_REQUEST_RE = re.compile(
+    r"\b(please|can|could|would|you|me|us|i|we|a|an|the|this|that|these|those|of|for|from|in|on|to|"
+    r"it|its|my|our|give|provide|create|make|write|do|get|summarize|summarise|summary|summarization|"
+    r"key|main|important|points?|takeaways?|extract|list|what|are|is|whole|entire|full|"
+    r"documents?|handbook|files?|pdfs?|papers?|chapters?|lectures?|slides|notes)\b")
+
+
+def is_digest_request(query: str, filenames: List[str]) -> bool:
+    """
+    Whether a request asks for nothing beyond a summary or key points of whole documents
+
+    Args:
+        query: User's query text
+        filenames: Names of the documents the request refers to
+
+    Returns:
+        True if the stored digests answer the request as asked
+    """
+    words = set(re.findall(r"[a-z0-9]+", DIGEST_REQUEST_RE.sub(" ", query.lower())))
+    for filename in filenames:
+        words -= set(re.findall(r"[a-z0-9]+", os.path.splitext(filename)[0].lower()))
+    return not words
+
+
+def format_digests(records: List[Dict[str, Any]], key_points: bool = False) -> str:
+    """
+    Format stored document summaries, or their key points, as a response
+
+    Args:
+        records: Stored summary records
+        key_points: Format the key points instead of the summaries
+
+    Returns:
+        Markdown with a section per document
+    """
+    sections = []
+    for record in records:
+        if key_points:
+            body = "\n".join(f"- {point}" for point in record["key_points"])
+        else:
+            body = record["summary"]
+        sections.append(f"## {record['filename'] or 'Document'}\n\n{body}")
+    return "\n\n".join(sections)
+
+
+def document_collection(metadata: Dict[str, Any]) -> str:
+    """Collection a chunk's document was stored in, from the chunk's metadata"""
+    if metadata.get("collection"):
+        return metadata["collection"]
+    if metadata.get("module_code"):
+        return f"module_{metadata['module_code']}"
+    return "bloom_documents"
+
+
+# What each action needs from the course material, for sub-query generation
+ACTION_GOALS = {
+    "summarize": "summarize it",
+    "extract_key_points": "extract its key points",
+    "create_study_guide": "build a study guide from it",
+    "compare_documents": "compare the documents"
+}
+
+
+def format_action_header(action_type: str) -> str:
+    """
+    Header that prefixes agent responses shown to the user
+
+    Args:
+        action_type: The agent action
+
+    Returns:
+        Header text, including the blank line before the response
+    """
+    return f"[BLOOM Agent - {action_type.replace('_', ' ').title()}]\n\n"
 
 
 class BloomAgent:
@@ -25,17 +123,29 @@ class BloomAgent:
     Enhanced agent capabilities for BLOOM Assistant
     """
 
-    def __init__(self, session_id: str = "default"):
+    def __init__(self, session_id: str = "default", agent_history: Optional[List[Dict[str, Any]]] = None,
+                 collection_name: Optional[str] = None, where: Optional[Dict[str, Any]] = None):
         self.session_id = session_id
-        self.agent_history = []
-
-    async def process_request(self, query: str, relevant_chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # Shared with the session record so actions are persisted with it
+        self.agent_history = agent_history if agent_history is not None else []
+        # Where the question's chunks were searched, so actions can retrieve more
+        self.collection_name = collection_name
+        self.where = where
+
+    def _record_action(self, action: Dict[str, Any]):
+        """Record an action in the agent history, keeping only the most recent"""
+        self.agent_history.append(action)
+        del self.agent_history[:-MAX_AGENT_HISTORY]
+
+    async def process_request(self, query: str, relevant_chunks: List[Dict[str, Any]],
+                              on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
         """
         Process a user query to determine if agent actions are needed
 
         Args:
             query: User's query text
             relevant_chunks: Relevant document chunks
+            on_token: Optional callback receiving the response as it streams
 
         Returns:
             Dictionary with response and any agent actions
@@ -47,66 +157,189 @@ class BloomAgent:
             # Not an agent request, return None to use standard response
             return None
 
+        if on_token:
+            on_token(format_action_header(action_type))
+
+        # Stored digests answer without any model call, so check them before expanding retrieval
+        if action_type in ("summarize", "extract_key_points"):
+            response = await self._stored_digest_response(query, action_type, relevant_chunks, on_token)
+            if response:
+                return response
+
+        relevant_chunks = await self._expand_chunks(query, action_type, relevant_chunks)
+
         # Execute the appropriate agent action
         if action_type == "summarize":
-            return await self._execute_summarize_action(query, relevant_chunks)
+            return await self._execute_summarize_action(query, relevant_chunks, on_token)
         elif action_type == "extract_key_points":
-            return await self._execute_extract_points_action(query, relevant_chunks)
+            return await self._execute_extract_points_action(query, relevant_chunks, on_token)
         elif action_type == "create_study_guide":
-            return await self._execute_study_guide_action(query, relevant_chunks)
+            return await self._execute_study_guide_action(query, relevant_chunks, on_token)
         elif action_type == "compare_documents":
-            return await self._execute_compare_action(query, relevant_chunks)
+            return await self._execute_compare_action(query, relevant_chunks, on_token)
 
         # Fallback to regular response if action not implemented
         return None
 
-    def _detect_action_type(self, query: str) -> Optional[str]:
+    async def _expand_chunks(self, query: str, action_type: str,
+                             relevant_chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
-        Detect if the query is requesting an agent action
+        Retrieve more chunks for an action by searching for several sub-queries
+
+        The chunks found for the literal question rarely cover a whole topic,
+        so the question is expanded into focused sub-queries that are searched
+        as one batch. The results are merged with the original chunks by
+        reciprocal rank fusion and deduplicated, so chunks found by several
+        searches rank first.
 
         Args:
             query: User's query text
+            action_type: The agent action
+            relevant_chunks: Chunks found for the query
 
         Returns:
-            Action type or None
+            The merged chunks, most relevant first
         """
-        query_lower = query.lower()
+        if not AGENT_QUERY_EXPANSION or self.collection_name is None:
+            return relevant_chunks
+
+        sub_queries = await self._generate_sub_queries(query, action_type, relevant_chunks)
+        if not sub_queries:
+            return relevant_chunks
+
+        # Search runs blocking I/O, so keep it off the event loop
+        loop = asyncio.get_running_loop()
+        try:
+            batches = await loop.run_in_executor(None, partial(
+                search_documents_batch, sub_queries, self.collection_name,
+                AGENT_RESULTS_PER_QUERY, self.where))
+        except Exception as e:
+            logger.error(f"Error searching agent sub-queries: {str(e)}")
+            return relevant_chunks
+
+        rankings = [relevant_chunks] + batches
+        fused = reciprocal_rank_fusion(
+            [[chunk["id"] for chunk in ranking] for ranking in rankings], RRF_K)
+
+        # Scores from different searches aren't comparable, so the fused score replaces them
+        merged = {}
+        for ranking in rankings:
+            for chunk in ranking:
+                if chunk["id"] not in merged:
+                    merged[chunk["id"]] = {
+                        **{key: value for key, value in chunk.items() if key != "rerank_score"},
+                        "rrf_score": fused[chunk["id"]]
+                    }
+        chunks = sorted(merged.values(), key=lambda chunk: -chunk["rrf_score"])
+
+        logger.info(
+            f"Expanded {action_type} retrieval with {len(sub_queries)} sub-queries: "
+            f"{len(relevant_chunks)} -> {len(chunks)} chunks")
+        return chunks
+
+    async def _generate_sub_queries(self, query: str, action_type: str,
+                                    relevant_chunks: List[Dict[str, Any]]) -> List[str]:
+        """
+        Ask the model for search queries covering what an action needs
 
-        # Check for summarization requests
-        if re.search(r'\b(summarize|summary|summarization)\b', query_lower):
-            return "summarize"
+        Args:
+            query: User's query text
+            action_type: The agent action
+            relevant_chunks: Chunks found for the query, whose filenames guide the queries
 
-        # Check for key points extraction
-        if re.search(r'\b(key points|main points|important points|extract points)\b', query_lower):
-            return "extract_key_points"
+        Returns:
+            Up to AGENT_SUB_QUERIES queries, or an empty list if generation fails
+        """
+        filenames = sorted(set(chunk.get("metadata", {}).get("filename", "")
+                               for chunk in relevant_chunks) - {""})[:5]
+        prompt = (
+            f"A student asked: {query}\n"
+            f"Documents found so far: {', '.join(filenames) or 'none'}\n\n"
+            f"Write {AGENT_SUB_QUERIES} short search queries for the course material passages "
+            f"needed to {ACTION_GOALS[action_type]}. Cover different topics or sections "
+            f"rather than rephrasing the question. Reply with one query per line and nothing else."
+        )
 
-        # Check for study guide creation
-        if re.search(r'\b(study guide|study notes|create notes|make notes)\b', query_lower):
-            return "create_study_guide"
+        try:
+            response = await chat_completion(
+                model=SUMMARY_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.3,
+                max_tokens=200
+            )
+        except Exception as e:
+            logger.error(f"Error generating agent sub-queries: {str(e)}")
+            return []
 
-        # Check for document comparison
-        if re.search(r'\b(compare|comparison|differences|similarities)\b', query_lower):
-            return "compare_documents"
+        lines = response.choices[0].message['content'].splitlines()
+        # Strip list markers the model may add anyway
+        sub_queries = [re.sub(r'^\s*(?:[-*•]|\d+[.)])\s*', '', line).strip().strip('"') for line in lines]
+        return [sub_query for sub_query in sub_queries if sub_query][:AGENT_SUB_QUERIES]
 
-        return None
+    def _detect_action_type(self, query: str) -> Optional[str]:
+        """
+        Detect if the query is requesting an agent action
 
-    async def _execute_summarize_action(self, query: str, relevant_chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
+        Args:
+            query: User's query text
+
+        Returns:
+            Action type or None
+        """
+        route = router.route(query)
+        if not route:
+            return None
+
+        logger.info(
+            f"Routing to {route['action']} (confidence {route['confidence']}, scores: {route['scores']})")
+        return route["action"]
+
+    async def _execute_summarize_action(self, query: str, relevant_chunks: List[Dict[str, Any]],
+                                        on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
         """
         Execute document summarization action
 
         Args:
             query: User's query text
             relevant_chunks: Relevant document chunks
+            on_token: Optional callback receiving the response as it streams
 
         Returns:
             Summary response
         """
-        # Format context from relevant chunks
-        context = self._format_chunks_for_context(relevant_chunks)
+        # Requests about whole documents get map-reduce summaries of every chunk
+        document_summaries = []
+        documents = self._documents_to_summarize(query, relevant_chunks)
+        if documents:
+            results = await asyncio.gather(
+                *[summarize_document(document_id, collection_name)
+                  for document_id, collection_name in documents],
+                return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.error(f"Error summarizing document: {str(result)}")
+                elif result:
+                    document_summaries.append(result)
+
+        # A plain request for the summary of whole documents is answered as stored
+        if (documents and len(document_summaries) == len(documents)
+                and is_digest_request(query, [summary["filename"] for summary in document_summaries])):
+            return self._respond_from_digests("summarize", document_summaries, relevant_chunks, on_token)
+
+        # Format context from the document summaries and the relevant chunks
+        if document_summaries:
+            summaries_context = "\n\n".join(
+                f"[Full summary of {summary['filename']}]\n{summary['summary']}"
+                for summary in document_summaries)
+            context = summaries_context + "\n\nRelevant excerpts:\n" + self._format_chunks_for_context(
+                relevant_chunks, AGENT_CONTEXT_TOKENS - count_tokens(summaries_context))
+        else:
+            context = self._format_chunks_for_context(relevant_chunks)
 
         # Record action in history
-        self.agent_history.append(
-            {"action": "summarize", "chunks_count": len(relevant_chunks)})
+        self._record_action(
+            {"action": "summarize", "chunks_count": len(relevant_chunks),
+             "documents_summarized": len(document_summaries)})
 
         # Create system message for summarization
         system_message = """
@@ -134,7 +367,7 @@ class BloomAgent:
         """
 
         # Call OpenAI with enhanced parameters for summarization
-        response = await self._call_openai(system_message, user_message)
+        response = await self._call_openai(system_message, user_message, on_token)
 
         # Format and return the agent response
         return {
@@ -142,17 +375,141 @@ class BloomAgent:
             "response": response,
             "metadata": {
                 "chunks_analyzed": len(relevant_chunks),
-                "document_count": len(set(chunk.get("metadata", {}).get("document_id", "") for chunk in relevant_chunks))
+                "document_count": len(set(chunk.get("metadata", {}).get("document_id", "") for chunk in relevant_chunks)),
+                "documents_summarized": [summary["filename"] for summary in document_summaries]
+            }
+        }
+
+    def _documents_to_summarize(self, query: str, relevant_chunks: List[Dict[str, Any]]) -> List[tuple]:
+        """
+        Find the documents a summary, key point or study guide request refers to as a whole
+
+        Documents named in the query come first; otherwise, when the query
+        mentions a document rather than a topic, the documents with the most
+        top-ranked chunks are used.
+
+        Args:
+            query: User's query text
+            relevant_chunks: Relevant document chunks, most relevant first
+
+        Returns:
+            Up to MAX_SUMMARY_DOCUMENTS (document_id, collection_name) pairs
+        """
+        documents = {}
+        for chunk in relevant_chunks:
+            metadata = chunk.get("metadata", {})
+            if metadata.get("document_id"):
+                documents.setdefault(metadata["document_id"], metadata)
+
+        query_lower = query.lower()
+        chosen = [document_id for document_id, metadata in documents.items()
+                  if metadata.get("filename")
+                  and os.path.splitext(metadata["filename"])[0].lower() in query_lower]
+        if not chosen:
+            if not WHOLE_DOCUMENT_RE.search(query_lower):
+                return []
+            counts = Counter(chunk.get("metadata", {}).get("document_id")
+                             for chunk in relevant_chunks[:8])
+            chosen = [document_id for document_id, _ in counts.most_common() if document_id]
+
+        return [(document_id, document_collection(documents[document_id]))
+                for document_id in chosen[:MAX_SUMMARY_DOCUMENTS]]
+
+    async def _stored_digests(self, documents: List[tuple]) -> List[Dict[str, Any]]:
+        """
+        Stored summaries of the current versions of documents, without generating any
+
+        Args:
+            documents: (document_id, collection_name) pairs
+
+        Returns:
+            The stored summary records found, in the order given
+        """
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(
+            *[loop.run_in_executor(None, stored_summary, document_id, collection_name)
+              for document_id, collection_name in documents],
+            return_exceptions=True)
+
+        digests = []
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"Error loading stored summary: {str(result)}")
+            elif result:
+                digests.append(result)
+        return digests
+
+    async def _stored_digest_response(self, query: str, action_type: str,
+                                      relevant_chunks: List[Dict[str, Any]],
+                                      on_token: Optional[Callable[[str], None]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Answer a plain request for the summary or key points of whole documents from storage
+
+        Args:
+            query: User's query text
+            action_type: "summarize" or "extract_key_points"
+            relevant_chunks: Chunks found for the query
+            on_token: Optional callback receiving the response
+
+        Returns:
+            Agent response, or None if the request needs a model call
+        """
+        documents = self._documents_to_summarize(query, relevant_chunks)
+        if not documents:
+            return None
+
+        digests = await self._stored_digests(documents)
+        if len(digests) < len(documents):
+            return None
+        if action_type == "extract_key_points" and not all(digest.get("key_points") for digest in digests):
+            return None
+        if not is_digest_request(query, [digest["filename"] for digest in digests]):
+            return None
+        return self._respond_from_digests(action_type, digests, relevant_chunks, on_token)
+
+    def _respond_from_digests(self, action_type: str, digests: List[Dict[str, Any]],
+                              relevant_chunks: List[Dict[str, Any]],
+                              on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """
+        Answer a summary or key point request with stored document digests
+
+        Args:
+            action_type: "summarize" or "extract_key_points"
+            digests: Stored summary records of the requested documents
+            relevant_chunks: Relevant document chunks
+            on_token: Optional callback receiving the response
+
+        Returns:
+            Agent response
+        """
+        response = format_digests(digests, key_points=action_type == "extract_key_points")
+        if on_token:
+            on_token(response)
+
+        self._record_action(
+            {"action": action_type, "chunks_count": len(relevant_chunks),
+             "documents_summarized": len(digests), "from_storage": True})
+
+        return {
+            "agent_action": action_type,
+            "response": response,
+            "metadata": {
+                "chunks_analyzed": len(relevant_chunks),
+                "document_count": len(digests),
+                "documents_summarized": [digest["filename"] for digest in digests],
+                "from_storage": True
             }
         }
 
-    async def _execute_extract_points_action(self, query: str, relevant_chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    async def _execute_extract_points_action(self, query: str, relevant_chunks: List[Dict[str, Any]],
+                                             on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
         """
         Execute key points extraction action
 
         Args:
             query: User's query text
             relevant_chunks: Relevant document chunks
+            on_token: Optional callback receiving the response as it streams
 
         Returns:
             Key points response
@@ -161,7 +518,7 @@ class BloomAgent:
         context = self._format_chunks_for_context(relevant_chunks)
 
         # Record action in history
-        self.agent_history.append(
+        self._record_action(
             {"action": "extract_key_points", "chunks_count": len(relevant_chunks)})
 
         # Create system message for key points extraction
@@ -190,7 +547,7 @@ class BloomAgent:
         """
 
         # Call OpenAI with enhanced parameters
-        response = await self._call_openai(system_message, user_message)
+        response = await self._call_openai(system_message, user_message, on_token)
 
         # Format and return the agent response
         return {
@@ -202,23 +559,40 @@ class BloomAgent:
             }
         }
 
-    async def _execute_study_guide_action(self, query: str, relevant_chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    async def _execute_study_guide_action(self, query: str, relevant_chunks: List[Dict[str, Any]],
+                                          on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
         """
         Execute study guide creation action
 
         Args:
             query: User's query text
             relevant_chunks: Relevant document chunks
+            on_token: Optional callback receiving the response as it streams
 
         Returns:
             Study guide response
         """
-        # Format context from relevant chunks
-        context = self._format_chunks_for_context(relevant_chunks)
+        # Stored digests of whole documents give the guide their full structure
+        digests = []
+        documents = self._documents_to_summarize(query, relevant_chunks)
+        if documents:
+            digests = await self._stored_digests(documents)
+
+        # Format context from the digests and the relevant chunks
+        if digests:
+            digests_context = "\n\n".join(
+                f"[Full summary of {digest['filename']}]\n{digest['summary']}" + "".join(
+                    f"\n- {point}" for point in digest.get("key_points", []))
+                for digest in digests)
+            context = digests_context + "\n\nRelevant excerpts:\n" + self._format_chunks_for_context(
+                relevant_chunks, AGENT_CONTEXT_TOKENS - count_tokens(digests_context))
+        else:
+            context = self._format_chunks_for_context(relevant_chunks)
 
         # Record action in history
-        self.agent_history.append(
-            {"action": "create_study_guide", "chunks_count": len(relevant_chunks)})
+        self._record_action(
+            {"action": "create_study_guide", "chunks_count": len(relevant_chunks),
+             "documents_summarized": len(digests)})
 
         # Create system message for study guide creation
         system_message = """
@@ -246,7 +620,7 @@ class BloomAgent:
         """
 
         # Call OpenAI with enhanced parameters
-        response = await self._call_openai(system_message, user_message)
+        response = await self._call_openai(system_message, user_message, on_token)
 
         # Format and return the agent response
         return {
@@ -258,13 +632,15 @@ class BloomAgent:
             }
         }
 
-    async def _execute_compare_action(self, query: str, relevant_chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    async def _execute_compare_action(self, query: str, relevant_chunks: List[Dict[str, Any]],
+                                      on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
         """
         Execute document comparison action
 
         Args:
             query: User's query text
             relevant_chunks: Relevant document chunks
+            on_token: Optional callback receiving the response as it streams
 
         Returns:
             Comparison response
@@ -279,11 +655,11 @@ class BloomAgent:
             if doc_id not in documents:
                 documents[doc_id] = {
                     "name": doc_name,
-                    "content": [],
+                    "chunks": [],
                     "metadata": chunk.get("metadata", {})
                 }
 
-            documents[doc_id]["content"].append(chunk.get("text", ""))
+            documents[doc_id]["chunks"].append(chunk)
 
         # Need at least 2 documents to compare
         if len(documents) < 2:
@@ -296,14 +672,23 @@ class BloomAgent:
                 }
             }
 
-        # Format documents for comparison
+        # Compare the documents with the most relevant chunks
+        if len(documents) > COMPARE_MAX_DOCUMENTS:
+            ranked = sorted(documents, key=lambda doc_id: -len(documents[doc_id]["chunks"]))
+            documents = {doc_id: documents[doc_id] for doc_id in ranked[:COMPARE_MAX_DOCUMENTS]}
+
+        # Stage one: condense each document for the question, concurrently
+        document_budget = AGENT_CONTEXT_TOKENS // len(documents)
+        digests = await asyncio.gather(
+            *[self._document_digest(query, doc, document_budget) for doc in documents.values()])
+
+        # Stage two: one comparison over the digests
         docs_context = ""
-        for doc_id, doc in documents.items():
-            docs_context += f"\n\nDOCUMENT: {doc['name']}\n"
-            docs_context += "\n".join(doc["content"])
+        for doc, digest in zip(documents.values(), digests):
+            docs_context += f"\n\nDOCUMENT: {doc['name']}\n{digest}"
 
         # Record action in history
-        self.agent_history.append(
+        self._record_action(
             {"action": "compare_documents", "documents": list(documents.keys())})
 
         # Create system message for document comparison
@@ -324,7 +709,7 @@ class BloomAgent:
 
         # Create user message with comparison request
         user_message = f"""
-        I need you to compare these documents:
+        I need you to compare these documents, each condensed to what it says about my question:
         
         {docs_context}
         
@@ -332,7 +717,7 @@ class BloomAgent:
         """
 
         # Call OpenAI with enhanced parameters
-        response = await self._call_openai(system_message, user_message)
+        response = await self._call_openai(system_message, user_message, on_token)
 
         # Format and return the agent response
         return {
@@ -344,59 +729,111 @@ class BloomAgent:
             }
         }
 
-    def _format_chunks_for_context(self, chunks: List[Dict[str, Any]]) -> str:
+    async def _document_digest(self, query: str, document: Dict[str, Any], fallback_tokens: int) -> str:
+        """
+        Condense one document's chunks for a comparison
+
+        Args:
+            query: User's query text
+            document: The document's name, metadata and relevant chunks
+            fallback_tokens: Budget for the raw excerpts used if the digest fails
+
+        Returns:
+            A digest of what the document says about the query
+        """
+        chunks = fit_chunks(document["chunks"], COMPARE_DOCUMENT_TOKENS,
+                            lambda chunk, _: chunk.get("text", ""))
+        chunks.sort(key=lambda chunk: chunk.get("metadata", {}).get("chunk_index", 0))
+
+        # A stored summary adds the context of the whole document
+        summary = None
+        metadata = document["metadata"]
+        if metadata.get("document_id"):
+            try:
+                loop = asyncio.get_running_loop()
+                record = await loop.run_in_executor(
+                    None, stored_summary, metadata["document_id"], document_collection(metadata))
+                summary = record["summary"] if record else None
+            except Exception as e:
+                logger.error(f"Error loading stored summary: {str(e)}")
+
+        try:
+            return await question_digest(query, chunks, summary)
+        except Exception as e:
+            logger.error(f"Error condensing {document['name']} for comparison: {str(e)}")
+            chunks = fit_chunks(document["chunks"], fallback_tokens,
+                                lambda chunk, _: chunk.get("text", ""))
+            return "\n".join(chunk.get("text", "") for chunk in chunks)
+
+    def _format_chunks_for_context(self, chunks: List[Dict[str, Any]],
+                                   max_tokens: int = AGENT_CONTEXT_TOKENS) -> str:
         """
         Format document chunks into a context string
 
         Args:
             chunks: List of document chunks
+            max_tokens: Token budget for the context
 
         Returns:
             Formatted context string
         """
-        context_parts = []
-
-        for i, chunk in enumerate(chunks):
-            # Include metadata about the source document
-            metadata = chunk.get("metadata", {})
-            filename = metadata.get("filename", "Unknown")
-
-            # Format the chunk with source information
-            context_part = f"[Document: {filename}, Chunk {i+1}]\n{chunk.get('text', '')}\n"
-            context_parts.append(context_part)
+        # Keep the most relevant chunks that fit in the context budget
+        chunks = fit_chunks(chunks, max_tokens)
 
         # Combine all context parts
-        return "\n".join(context_parts)
+        return "\n".join(format_chunk(chunk, i) for i, chunk in enumerate(chunks))
 
-    async def _call_openai(self, system_message: str, user_message: str) -> str:
+    async def _call_openai(self, system_message: str, user_message: str,
+                           on_token: Optional[Callable[[str], None]] = None) -> str:
         """
         Call OpenAI API with the provided messages
 
         Args:
             system_message: System message
             user_message: User message
+            on_token: Optional callback; when set the response is streamed to it
 
         Returns:
             Generated response
+
+        Failures are raised rather than returned as text, so an error message is
+        never recorded or cached as if it were an answer.
         """
         try:
             messages = [
                 {"role": "system", "content": system_message},
                 {"role": "user", "content": user_message}
             ]
+            logger.info(
+                f"Sending agent prompt ({count_message_tokens(messages)} tokens) to OpenAI API")
 
             # FIX: Add 'await' before the openai call
-            response = await openai.ChatCompletion.acreate(
+            response = await chat_completion(
                 model=CHAT_MODEL,
                 messages=messages,
                 temperature=0.3,  # Lower temperature for more structured and factual responses
                 max_tokens=1500,
                 top_p=0.95,
                 frequency_penalty=0.0,
-                presence_penalty=0.0
+                presence_penalty=0.0,
+                stream=on_token is not None
             )
 
-            return response.choices[0].message['content']
+            if on_token is None:
+                return response.choices[0].message['content']
+
+            # Pass tokens on as they arrive
+            parts = []
+            try:
+                async for chunk in response:
+                    token = chunk.choices[0].delta.get('content')
+                    if token:
+                        parts.append(token)
+                        on_token(token)
+            finally:
+                # Frees the model's concurrency slot even if reading stops early
+                await response.aclose()
+            return "".join(parts)
         except Exception as e:
             logger.error(f"Error calling OpenAI API: {str(e)}")
-            return f"I encountered an error while processing your request. Please try again."
+            raise
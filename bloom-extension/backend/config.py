@@ -5,7 +5,141 @@ load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 EMBEDDING_MODEL = "text-embedding-3-small"
+# Shortened embedding size for new collections (None keeps the model's full
+# 1536), with per-collection overrides, e.g. {"bloom_documents": 512}.
+# Existing collections keep their size until reembed_collections.py is run.
+EMBEDDING_DIMENSIONS = None
+COLLECTION_EMBEDDING_DIMENSIONS = {}
 CHAT_MODEL = "gpt-4.1"
+SUMMARY_MODEL = "gpt-4.1-mini"
 CHROMA_DB_DIR = "../database/chroma_db"
+# Vector store backend: "chroma", or "numpy" for in-process exact search
+# (fastest for collections of up to tens of thousands of chunks)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+NUMPY_STORE_DIR = "../database/numpy_store"
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
+
+# Semantic response cache
+RESPONSE_CACHE_SIMILARITY = 0.95
+RESPONSE_CACHE_TTL = 3600  # seconds
+RESPONSE_CACHE_MAX_ENTRIES = 1000
+
+# Session store
+SESSION_MAX_COUNT = 1000
+SESSION_IDLE_TTL = 24 * 3600  # seconds
+SESSION_MAX_BYTES = 50 * 1024 * 1024
+# SQLite file for persistent sessions shared across workers; unset keeps them in memory
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH")
+
+# Prompt token budgets
+PROMPT_MAX_TOKENS = 12000
+PROMPT_BUDGET_SYSTEM = 1000
+PROMPT_BUDGET_HISTORY = 3000
+PROMPT_BUDGET_CONTEXT = 6000
+PROMPT_BUDGET_QUESTION = 1000
+
+# Rolling conversation summaries: once a session has more than
+# SUMMARY_TRIGGER_MESSAGES messages, all but the last SUMMARY_KEEP_MESSAGES
+# are folded into a running summary
+SUMMARY_TRIGGER_MESSAGES = 12
+SUMMARY_KEEP_MESSAGES = 6
+
+# Reranking: "fusion" blends lexical and embedding similarity, "cross-encoder"
+# uses RERANK_MODEL locally (needs sentence-transformers), "none" keeps search order
+RERANKER = os.getenv("RERANKER", "fusion")
+RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_CANDIDATES = 40
+RERANK_TOP_N = 5
+RERANK_SEMANTIC_WEIGHT = 0.7
+
+# Hybrid search: BM25 over a per-collection inverted index, fused with
+# vector results by reciprocal rank fusion
+HYBRID_SEARCH = True
+RRF_K = 60
+LEXICAL_INDEX_DIR = "../database/lexical_index"
+
+# Maximal Marginal Relevance: fetch MMR_FETCH_MULTIPLIER x k candidates and
+# pick k that balance relevance (weight MMR_LAMBDA) against redundancy,
+# with at most MMR_MAX_PER_DOCUMENT chunks from one document
+MMR_ENABLED = True
+MMR_LAMBDA = 0.7
+MMR_FETCH_MULTIPLIER = 3
+MMR_MAX_PER_DOCUMENT = 3
+
+# Unified index: store every module in one collection, partitioned by a
+# "collection" metadata key, instead of one collection per module.
+# Run migrate_collections.py before turning this on for an existing database.
+UNIFIED_COLLECTION = False
+UNIFIED_COLLECTION_NAME = "bloom_unified"
+
+# Quantized search for the NumPy backend: "int8" (4x smaller) or "binary"
+# (32x smaller) codes are scanned first, then the best
+# QUANTIZATION_RESCORE_MULTIPLIER x k candidates are rescored at full precision.
+# "none" searches the float32 vectors directly.
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+QUANTIZATION_RESCORE_MULTIPLIER = {"int8": 4, "binary": 20}
+
+# Most questions accepted by one /search/batch request, and most results per question
+SEARCH_BATCH_MAX_QUERIES = 100
+SEARCH_BATCH_MAX_K = 50
+
+# Agent retrieval: summaries, key points, study guides and comparisons also
+# search AGENT_SUB_QUERIES generated sub-queries (AGENT_RESULTS_PER_QUERY
+# results each) in one batch, merged with the chunks found for the question
+AGENT_QUERY_EXPANSION = True
+AGENT_SUB_QUERIES = 4
+AGENT_RESULTS_PER_QUERY = 8
+
+# Whole-document summaries (map-reduce): a document's chunks are grouped into
+# windows of SUMMARY_WINDOW_TOKENS, summarized SUMMARY_CONCURRENCY at a time,
+# and the partial summaries are reduced until one remains. Longer documents
+# get larger windows (up to SUMMARY_MAX_WINDOW_TOKENS) so there are at most
+# SUMMARY_MAX_WINDOWS, which bounds the time a summary takes.
+DOCUMENT_SUMMARY_DIR = "../database/document_summaries"
+SUMMARY_WINDOW_TOKENS = 6000
+SUMMARY_MAX_WINDOWS = 16
+SUMMARY_MAX_WINDOW_TOKENS = 100000
+SUMMARY_CONCURRENCY = 8
+SUMMARY_PARTIAL_TOKENS = 500
+SUMMARY_DOCUMENT_TOKENS = 1000
+
+# Precomputed digests: when PRECOMPUTE_SUMMARIES is true, every ingested
+# document is summarized in the background, with a list of key points, so
+# agent summary and key-point requests for whole documents are answered from
+# storage
+PRECOMPUTE_SUMMARIES = os.getenv("PRECOMPUTE_SUMMARIES", "false").lower() == "true"
+SUMMARY_KEY_POINTS_TOKENS = 600
+
+# Document comparison: each of up to COMPARE_MAX_DOCUMENTS documents is first
+# condensed, from COMPARE_DOCUMENT_TOKENS of its excerpts and any stored
+# summary, into a digest of COMPARE_DIGEST_TOKENS about the question (these
+# calls share the SUMMARY_CONCURRENCY limit); one call then compares the
+# digests. The last DIGEST_CACHE_MAX_ENTRIES digests are reused.
+COMPARE_MAX_DOCUMENTS = 5
+COMPARE_DOCUMENT_TOKENS = 6000
+COMPARE_DIGEST_TOKENS = 600
+DIGEST_CACHE_MAX_ENTRIES = 256
+
+# Agent routing: with AGENT_ROUTER_CLASSIFIER on, a query containing an action
+# keyword only starts the action if a small local model of the query's wording
+# gives it a confidence of at least AGENT_ROUTER_THRESHOLD; off, any keyword does
+AGENT_ROUTER_CLASSIFIER = os.getenv("AGENT_ROUTER_CLASSIFIER", "true").lower() == "true"
+AGENT_ROUTER_THRESHOLD = 0.6
+
+# Shared OpenAI gateway: every model call is limited per model to "concurrency"
+# requests at a time and to "rpm" requests and "tpm" tokens a minute (set these
+# to your account's rate limits), and retried up to LLM_MAX_RETRIES times with
+# jittered exponential backoff on rate limits and server errors. Identical calls
+# in flight at the same time share one request. Latency percentiles cover the
+# last LLM_METRICS_WINDOW calls per model.
+LLM_MODEL_LIMITS = {
+    CHAT_MODEL: {"concurrency": 16, "rpm": 500, "tpm": 30000},
+    SUMMARY_MODEL: {"concurrency": 16, "rpm": 500, "tpm": 200000},
+    EMBEDDING_MODEL: {"concurrency": 8, "rpm": 3000, "tpm": 1000000}
+}
+LLM_DEFAULT_LIMITS = {"concurrency": 8, "rpm": 500, "tpm": 30000}
+LLM_MAX_RETRIES = 4
+LLM_RETRY_BASE_SECONDS = 0.5
+LLM_RETRY_MAX_SECONDS = 20
+LLM_METRICS_WINDOW = 1000
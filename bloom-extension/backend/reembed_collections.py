@@ -0,0 +1,175 @@
+"""
+BLOOM Re-embedding Migration
+
+Command-line tool that changes the embedding dimensions of existing
+collections to match EMBEDDING_DIMENSIONS / COLLECTION_EMBEDDING_DIMENSIONS
+in config.py (or --dimensions). text-embedding-3 embeddings can be shortened
+by truncating and re-normalizing them, so by default the stored vectors are
+shortened locally without any API calls. --from-api embeds the chunk texts
+again instead, which is needed to make embeddings longer.
+
+Each collection is copied into a temporary collection at the new size, checked,
+and then swapped in under the original name; chunk IDs, texts and metadata are
+unchanged, so lexical indexes stay valid. Stop the server while this runs and
+start it again afterwards.
+
+Usage (from the backend directory):
+    python reembed_collections.py
+    python reembed_collections.py --collection module_CST3350 --dimensions 512
+    python reembed_collections.py --dimensions 1536 --from-api
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+from typing import Dict, List, Any, Optional
+
+from config import EMBEDDING_MODEL
+from services.embedding_service import get_embeddings, shorten_embeddings, MODEL_DIMENSIONS
+from services.vector_store import get_client, configured_dimensions
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+TEMP_SUFFIX = "_reembed"
+
+
+def stored_dimensions(collection) -> Optional[int]:
+    """Length of the embeddings stored in a collection, or None if it is empty"""
+    metadata = collection.metadata or {}
+    if metadata.get("embedding_dimensions"):
+        return metadata["embedding_dimensions"]
+    sample = collection.get(limit=1, include=["embeddings"])
+    return len(sample["embeddings"][0]) if sample["ids"] else None
+
+
+def reembed_collection(client, name: str, dimensions: Optional[int], from_api: bool,
+                       batch_size: int) -> Dict[str, Any]:
+    """
+    Rebuild one collection at new embedding dimensions
+
+    Args:
+        client: Vector store client
+        name: Collection to rebuild
+        dimensions: Target dimensions, or None for the model's full size
+        from_api: Embed the texts again instead of shortening stored vectors
+        batch_size: Chunks read and written per request
+
+    Returns:
+        Report for the collection
+    """
+    source = client.get_collection(name)
+    total = source.count()
+    current = stored_dimensions(source)
+    # No dimensions means the model's full size
+    target_dimensions = dimensions or MODEL_DIMENSIONS.get(EMBEDDING_MODEL)
+    if current is None or current == target_dimensions:
+        return {"chunks": total, "dimensions": current, "status": "unchanged"}
+    if not from_api and (target_dimensions is None or target_dimensions > current):
+        raise ValueError(
+            f"stored embeddings have {current} dimensions and cannot be lengthened; use --from-api")
+
+    # Start from a clean copy if a previous run was interrupted
+    temp_name = f"{name}{TEMP_SUFFIX}"
+    if temp_name in [collection.name for collection in client.list_collections()]:
+        client.delete_collection(temp_name)
+    target = client.get_or_create_collection(temp_name)
+    metadata = {key: value for key, value in (source.metadata or {}).items()
+                if not key.startswith("hnsw:")}
+    target.modify(metadata={**metadata, "embedding_dimensions": dimensions or 0})
+
+    include = ["documents", "metadatas"] if from_api else ["documents", "metadatas", "embeddings"]
+    for offset in range(0, total, batch_size):
+        batch = source.get(limit=batch_size, offset=offset, include=include)
+        if not batch["ids"]:
+            break
+        if from_api:
+            embeddings = get_embeddings(batch["documents"], dimensions)
+        else:
+            embeddings = shorten_embeddings(batch["embeddings"], dimensions)
+        target.add(
+            ids=batch["ids"],
+            documents=batch["documents"],
+            metadatas=batch["metadatas"],
+            embeddings=embeddings
+        )
+        sys.stderr.write(
+            f"\r{name}: {min(offset + batch_size, total)}/{total} chunks")
+        sys.stderr.flush()
+    sys.stderr.write("\n")
+
+    copied = target.count()
+    if copied != total:
+        raise ValueError(
+            f"only {copied}/{total} chunks copied; original left in place, partial copy in {temp_name}")
+
+    client.delete_collection(name)
+    target.modify(name=name)
+    return {"chunks": total, "dimensions": dimensions, "previous_dimensions": current,
+            "status": "reembedded"}
+
+
+def run_reembed(names: Optional[List[str]] = None, dimensions: Optional[int] = None,
+                from_api: bool = False, batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, Any]:
+    """
+    Rebuild collections at their configured (or the given) embedding dimensions
+
+    Args:
+        names: Collections to rebuild (default: all)
+        dimensions: Target dimensions for every collection (default: from config)
+        from_api: Embed the texts again instead of shortening stored vectors
+        batch_size: Chunks read and written per request
+
+    Returns:
+        Migration report
+    """
+    client = get_client()
+    started = time.monotonic()
+    report = {"collections": {}, "errors": []}
+
+    if not names:
+        names = [collection.name for collection in client.list_collections()
+                 if not collection.name.endswith(TEMP_SUFFIX)]
+
+    for name in names:
+        target = dimensions if dimensions else configured_dimensions(name)
+        try:
+            report["collections"][name] = reembed_collection(
+                client, name, target, from_api, batch_size)
+        except Exception as e:
+            logger.error(f"Failed to re-embed {name}: {str(e)}")
+            report["errors"].append(f"{name}: {str(e)}")
+
+    report["elapsed_seconds"] = round(time.monotonic() - started, 2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Change the embedding dimensions of existing collections")
+    parser.add_argument("--collection", action="append", dest="collections",
+                        help="Collection to rebuild (repeatable; default: all)")
+    parser.add_argument("--dimensions", type=int,
+                        help="Target dimensions (default: EMBEDDING_DIMENSIONS / COLLECTION_EMBEDDING_DIMENSIONS)")
+    parser.add_argument("--from-api", action="store_true",
+                        help="Embed chunk texts again instead of shortening stored embeddings")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Chunks per read and write")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Show service logs")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(
+        logging.INFO if args.verbose else logging.WARNING)
+
+    report = run_reembed(args.collections, args.dimensions,
+                         args.from_api, args.batch_size)
+
+    print(json.dumps(report, indent=2))
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
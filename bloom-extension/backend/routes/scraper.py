@@ -42,6 +42,7 @@ class StartScrapingRequest(BaseModel):
     cookies: Dict[str, str]
     documents: Optional[List[Dict[str, str]]] = None
     has_folders: Optional[bool] = False
+    crawl_folders: Optional[bool] = False
 
 
 class FolderDocumentsRequest(BaseModel):
@@ -80,9 +81,14 @@ async def start_scraping(request: StartScrapingRequest):
             request.module_name,
             request.cookies,
             request.documents,
-            request.has_folders
+            request.has_folders,
+            request.crawl_folders
         )
-        return {"task_id": task_id, "status": "started"}
+        return {
+            "task_id": task_id,
+            "status": "started",
+            "crawl_folders": request.crawl_folders
+        }
     except Exception as e:
         logger.error(f"Error starting scraping task: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,218 @@
+import os
+import re
+import json
+import math
+import logging
+from typing import Dict, List, Any, Optional
+
+from config import AGENT_ROUTER_CLASSIFIER, AGENT_ROUTER_THRESHOLD
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Keywords that can start each agent action, in priority order for keyword-only routing
+ACTION_KEYWORDS = {
+    "summarize": ["summarize", "summarise", "summary", "summarization"],
+    "extract_key_points": ["key points", "main points", "important points", "extract points"],
+    "create_study_guide": ["study guide", "study notes", "create notes", "make notes"],
+    "compare_documents": ["compare", "comparison", "differences", "similarities"]
+}
+
+# Everything before the keyword is polite request wording, e.g. "Can you please summarize";
+# also used on the text after the keyword, e.g. "summary please"
+REQUEST_PREFIX_RE = re.compile(
+    r"^(?:\W*\b(?:please|hey|hi|ok|okay|bloom|can|could|would|will|you|i|i'd|id|like|want|need|to|"
+    r"give|get|me|us|a|an|the|quick|short|brief|detailed|full|create|make|write|produce|generate|"
+    r"provide|do|let's|lets|now|also|and|then)\b)*\W*$")
+QUESTION_RE = re.compile(
+    r"^\W*(?:what|how|why|when|where|who|which|is|are|does|do|did|should|was|were)\b")
+# Asking how to do something rather than asking for it, e.g. "how do I compare two strings"
+HOW_TO_RE = re.compile(
+    r"\bhow (?:do|can|should|would|could|to|does)\b[\w\s']{0,30}?"
+    r"\b(?:compare|contrast|summari[sz]e|write|make|create|take|structure)\b")
+DOCUMENT_RE = re.compile(
+    r"\b(?:this|these|those|both|them|whole|entire|documents?|handbooks?|files?|pdfs?|papers?|chapters?|"
+    r"lectures?|slides|notes|readings?|modules?|sources?|briefs?|rubrics?|specifications?|specs?|"
+    r"guidelines|syllabus|handouts?|coursework|assignments?|textbooks?|articles?|(?:week|unit|topic) \d+)\b")
+# Uses of the keywords that are about something else
+NEGATIVE_RE = {
+    "summarize": re.compile(r"\bsummary (?:statistics?|tables?|judge?ments?|offences?)\b"),
+    "create_study_guide": re.compile(r"\b(?:where|is there|are there)\b[\w\s']*\bstudy (?:guides?|notes)\b"),
+    "compare_documents": re.compile(r"\b(?:comparison (?:operators?|sorts?|functions?)|comparators?|compareto)\b")
+}
+
+# Logistic weights per action: bias plus one weight per feature. A keyword alone
+# is enough for the single-document actions; a comparison also needs to mention
+# the documents or be a bare request ("compare", "compare them"), since
+# "compare TCP and UDP" is a question about the topics, not the documents.
+# Tuned against LABELLED_QUERIES_PATH; run evaluate_router.py after changing them.
+FEATURE_WEIGHTS = {
+    "summarize": {"bias": -1.0, "keyword": 2.0, "request": 0.5, "alone": 0.5, "question": -0.5,
+                  "document": 1.0, "how_to": -3.0, "negative": -3.0},
+    "extract_key_points": {"bias": -1.0, "keyword": 2.0, "request": 0.5, "alone": 0.5, "question": -0.5,
+                           "document": 1.0, "how_to": -3.0, "negative": -3.0},
+    "create_study_guide": {"bias": -1.0, "keyword": 2.0, "request": 0.5, "alone": 0.5, "question": -0.5,
+                           "document": 0.5, "how_to": -3.0, "negative": -3.0},
+    "compare_documents": {"bias": -2.0, "keyword": 1.0, "request": 1.0, "alone": 1.5, "question": -0.5,
+                          "document": 2.0, "how_to": -3.0, "negative": -3.0}
+}
+
+# Queries labelled with the action they should route to (null for none), one JSON object per line
+LABELLED_QUERIES_PATH = os.path.join(os.path.dirname(__file__), "intent_router_queries.jsonl")
+
+
+class IntentRouter:
+    """
+    Routes queries to agent actions.
+
+    All action keywords are matched in one pass of a single compiled regex.
+    With the classifier on, each matched action gets a confidence from a small
+    logistic model over cheap regex features (polite request wording, a bare
+    request with nothing else, question form, "how do I ...", references to
+    documents, known non-action phrases),
+    and the most confident action above the threshold is chosen. Otherwise the
+    first action in ACTION_KEYWORDS order with a keyword match is chosen.
+    """
+
+    def __init__(self, keywords: Dict[str, List[str]] = ACTION_KEYWORDS,
+                 use_classifier: bool = AGENT_ROUTER_CLASSIFIER,
+                 threshold: float = AGENT_ROUTER_THRESHOLD):
+        self.actions = list(keywords)
+        self.use_classifier = use_classifier
+        self.threshold = threshold
+        # One named group per action, longest keywords first
+        self.pattern = re.compile(r"\b(?:" + "|".join(
+            f"(?P<{action}>" + "|".join(re.escape(keyword) for keyword in
+                                        sorted(words, key=len, reverse=True)) + ")"
+            for action, words in keywords.items()) + r")\b")
+
+    def candidates(self, query: str) -> Dict[str, int]:
+        """
+        Actions whose keywords appear in a query
+
+        Args:
+            query: Lowercased query text
+
+        Returns:
+            Action -> position of its first keyword
+        """
+        found = {}
+        for match in self.pattern.finditer(query):
+            found.setdefault(match.lastgroup, match.start())
+        return found
+
+    def features(self, query: str, action: str, position: int) -> Dict[str, bool]:
+        """
+        Features of a query for one candidate action
+
+        Args:
+            query: Lowercased query text
+            action: Candidate action
+            position: Where the action's keyword starts
+
+        Returns:
+            Feature name -> whether it is present
+        """
+        negative = NEGATIVE_RE.get(action)
+        end = self.pattern.match(query, position).end()
+        return {
+            "keyword": True,
+            "request": bool(REQUEST_PREFIX_RE.match(query[:position])),
+            "alone": bool(REQUEST_PREFIX_RE.match(query[:position]) and REQUEST_PREFIX_RE.match(query[end:])),
+            "question": bool(QUESTION_RE.match(query)),
+            "document": bool(DOCUMENT_RE.search(query)),
+            "how_to": bool(HOW_TO_RE.search(query)),
+            "negative": bool(negative and negative.search(query))
+        }
+
+    def confidence(self, query: str, action: str, position: int) -> float:
+        """Probability that a query asks for an action, from the logistic model"""
+        weights = FEATURE_WEIGHTS[action]
+        score = weights["bias"] + sum(
+            weights[name] for name, present in self.features(query, action, position).items() if present)
+        return 1.0 / (1.0 + math.exp(-score))
+
+    def route(self, query: str) -> Optional[Dict[str, Any]]:
+        """
+        Choose the agent action a query asks for
+
+        Args:
+            query: User's query text
+
+        Returns:
+            {"action", "confidence", "scores"}, or None for an ordinary question
+        """
+        query_lower = query.lower()
+        found = self.candidates(query_lower)
+        if not found:
+            return None
+
+        if not self.use_classifier:
+            action = next(action for action in self.actions if action in found)
+            return {"action": action, "confidence": 1.0, "scores": {action: 1.0}}
+
+        scores = {action: round(self.confidence(query_lower, action, position), 3)
+                  for action, position in found.items()}
+        action = max(scores, key=lambda name: (scores[name], -found[name]))
+        if scores[action] < self.threshold:
+            logger.debug(f"Not routing query to an agent action (scores: {scores})")
+            return None
+        return {"action": action, "confidence": scores[action], "scores": scores}
+
+
+def load_labelled_queries(path: str = LABELLED_QUERIES_PATH) -> List[Dict[str, Any]]:
+    """Load labelled queries, each {"query", "action"}"""
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def evaluate(router: IntentRouter, examples: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Measure how well a router matches labelled queries
+
+    Args:
+        router: The router to evaluate
+        examples: Labelled queries, each {"query", "action"}
+
+    Returns:
+        Accuracy, per-action precision and recall, and the misrouted queries
+    """
+    counts = {action: {"true_positives": 0, "predicted": 0, "expected": 0} for action in router.actions}
+    errors = []
+    for example in examples:
+        route = router.route(example["query"])
+        predicted = route["action"] if route else None
+        expected = example["action"]
+        if predicted:
+            counts[predicted]["predicted"] += 1
+        if expected:
+            counts[expected]["expected"] += 1
+        if predicted == expected:
+            if predicted:
+                counts[predicted]["true_positives"] += 1
+        else:
+            # Scores below the threshold aren't returned by route, so work them out here
+            query_lower = example["query"].lower()
+            scores = route["scores"] if route else {
+                action: round(router.confidence(query_lower, action, position), 3)
+                for action, position in router.candidates(query_lower).items()}
+            errors.append({"query": example["query"], "expected": expected, "predicted": predicted,
+                           "scores": scores})
+
+    return {
+        "queries": len(examples),
+        "accuracy": round(1 - len(errors) / len(examples), 3) if examples else 0,
+        "actions": {
+            action: {
+                "precision": round(count["true_positives"] / count["predicted"], 3) if count["predicted"] else None,
+                "recall": round(count["true_positives"] / count["expected"], 3) if count["expected"] else None
+            }
+            for action, count in counts.items()
+        },
+        "errors": errors
+    }
+
+
+# Built once at import
+router = IntentRouter()
@@ -0,0 +1,389 @@
+import os
+import re
+import math
+import pickle
+import logging
+import threading
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import LEXICAL_INDEX_DIR
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Keeps identifiers like CST3350 and CW2 as single tokens
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Chunks read per request when building an index from an existing collection
+REBUILD_BATCH_SIZE = 1000
+
+# Changes are appended to a log next to the saved index, which is folded into a
+# new snapshot once it covers this many chunks and at least half the index
+LOG_COMPACT_MIN_CHUNKS = 5000
+
+# collection_name -> LexicalIndex
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase alphanumeric tokens, skipping single characters"""
+    return [token for token in TOKEN_RE.findall(text.lower()) if len(token) > 1]
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over the chunks of one collection.
+
+    Postings are stored per term as two parallel arrays (chunk positions and
+    term frequencies), so the index stays compact and can be scored with
+    NumPy. New chunks are appended incrementally; chunks already indexed are
+    skipped, as ChromaDB skips existing IDs on add. Removed chunks keep their
+    postings but are masked out of scoring and document counts.
+
+    On disk the index is a pickled snapshot plus a log of the changes made
+    since, so indexing a batch appends to the log rather than rewriting the
+    whole index. Replaying the log is safe to repeat, since adds skip known
+    IDs and removals of unknown IDs do nothing.
+    """
+
+    def __init__(self, collection_name: str):
+        self.collection_name = collection_name
+        self.chunk_ids = []
+        self._positions = {}
+        self._terms = {}
+        self._postings = []
+        self._frequencies = []
+        self._lengths = array('I')
+        self._total_length = 0
+        self._removed = array('I')
+        self._lock = threading.Lock()
+        self._loaded_mtime = None
+        self._log_offset = 0
+        self._log_chunks = 0
+
+    @property
+    def path(self) -> str:
+        return os.path.join(LEXICAL_INDEX_DIR, f"{self.collection_name}.idx")
+
+    @property
+    def log_path(self) -> str:
+        return os.path.join(LEXICAL_INDEX_DIR, f"{self.collection_name}.log")
+
+    def __len__(self):
+        return len(self._positions)
+
+    def add(self, ids: List[str], texts: List[str]) -> int:
+        """
+        Index new chunks
+
+        Args:
+            ids: Chunk IDs, as stored in the collection
+            texts: Chunk texts
+
+        Returns:
+            Number of chunks added
+        """
+        added = 0
+        with self._lock:
+            for chunk_id, text in zip(ids, texts):
+                if chunk_id in self._positions:
+                    continue
+
+                position = len(self.chunk_ids)
+                self._positions[chunk_id] = position
+                self.chunk_ids.append(chunk_id)
+
+                counts = Counter(tokenize(text or ""))
+                length = sum(counts.values())
+                self._lengths.append(length)
+                self._total_length += length
+
+                for term, frequency in counts.items():
+                    term_id = self._terms.get(term)
+                    if term_id is None:
+                        term_id = self._terms[term] = len(self._postings)
+                        self._postings.append(array('I'))
+                        self._frequencies.append(array('H'))
+                    self._postings[term_id].append(position)
+                    self._frequencies[term_id].append(min(frequency, 65535))
+                added += 1
+        return added
+
+    def remove(self, ids: List[str]) -> int:
+        """
+        Drop chunks from the index
+
+        Args:
+            ids: Chunk IDs deleted from the collection
+
+        Returns:
+            Number of chunks removed
+        """
+        removed = 0
+        with self._lock:
+            for chunk_id in ids:
+                position = self._positions.pop(chunk_id, None)
+                if position is None:
+                    continue
+                self._removed.append(position)
+                self._total_length -= self._lengths[position]
+                removed += 1
+        return removed
+
+    def search(self, query: str, k: int = 10, allowed_ids: Optional[List[str]] = None) -> List[Tuple[str, float]]:
+        """
+        Find the chunks that best match a query
+
+        Args:
+            query: The user's query
+            k: Number of results to return
+            allowed_ids: Only return these chunks (e.g. those matching a metadata filter)
+
+        Returns:
+            List of (chunk_id, BM25 score), best first
+        """
+        with self._lock:
+            count = len(self._positions)
+            if not count:
+                return []
+
+            rows = len(self.chunk_ids)
+            live = None
+            if self._removed:
+                live = np.ones(rows, dtype=bool)
+                live[np.frombuffer(self._removed, dtype=np.uint32)] = False
+            lengths = np.frombuffer(self._lengths, dtype=np.uint32).astype(np.float32)
+            norms = BM25_K1 * (1 - BM25_B + BM25_B * lengths / (self._total_length / count or 1))
+            scores = np.zeros(rows, dtype=np.float32)
+
+            for term in set(tokenize(query)):
+                term_id = self._terms.get(term)
+                if term_id is None:
+                    continue
+                positions = np.frombuffer(self._postings[term_id], dtype=np.uint32)
+                frequencies = np.frombuffer(
+                    self._frequencies[term_id], dtype=np.uint16).astype(np.float32)
+                matching = len(positions) if live is None else int(live[positions].sum())
+                idf = math.log(1 + (count - matching + 0.5) / (matching + 0.5))
+                scores[positions] += idf * frequencies * (BM25_K1 + 1) / (frequencies + norms[positions])
+
+            if live is not None:
+                scores[~live] = 0
+            if allowed_ids is not None:
+                allowed = np.zeros(rows, dtype=bool)
+                allowed[[self._positions[chunk_id] for chunk_id in allowed_ids
+                         if chunk_id in self._positions]] = True
+                scores[~allowed] = 0
+
+            matches = np.flatnonzero(scores)
+            if not len(matches):
+                return []
+            if len(matches) > k:
+                matches = matches[np.argpartition(-scores[matches], k - 1)[:k]]
+            matches = matches[np.argsort(-scores[matches])]
+            return [(self.chunk_ids[i], float(scores[i])) for i in matches]
+
+    def log(self, operation: str, ids: List[str], texts: Optional[List[str]] = None):
+        """
+        Record a change on disk by appending it to the log
+
+        Args:
+            operation: "add" or "remove"
+            ids: Chunk IDs
+            texts: Chunk texts, for "add"
+        """
+        os.makedirs(LEXICAL_INDEX_DIR, exist_ok=True)
+        with self._lock:
+            with open(self.log_path, 'ab') as f:
+                start = f.tell()
+                pickle.dump((operation, ids, texts), f, protocol=pickle.HIGHEST_PROTOCOL)
+                end = f.tell()
+            # Only skip our own record if no other process appended before it
+            if start == self._log_offset:
+                self._log_offset = end
+            self._log_chunks += len(ids)
+            compact = self._log_chunks >= max(LOG_COMPACT_MIN_CHUNKS, len(self._positions) // 2)
+        if compact:
+            self.save()
+
+    def replay_log(self):
+        """Apply changes appended to the log since it was last read, including by other processes"""
+        try:
+            size = os.path.getsize(self.log_path)
+        except FileNotFoundError:
+            return
+        if size == self._log_offset:
+            return
+        if size < self._log_offset:
+            # Another process folded the log into a new snapshot
+            self.load()
+            return
+
+        with open(self.log_path, 'rb') as f:
+            f.seek(self._log_offset)
+            while True:
+                try:
+                    operation, ids, texts = pickle.load(f)
+                except Exception:
+                    # End of the log, or a record still being written
+                    break
+                if operation == "add":
+                    self.add(ids, texts)
+                else:
+                    self.remove(ids)
+                self._log_offset = f.tell()
+                self._log_chunks += len(ids)
+
+    def save(self):
+        """Write the whole index to disk atomically, emptying the log"""
+        os.makedirs(LEXICAL_INDEX_DIR, exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with self._lock:
+            state = {
+                "chunk_ids": self.chunk_ids,
+                "terms": self._terms,
+                "postings": self._postings,
+                "frequencies": self._frequencies,
+                "lengths": self._lengths,
+                "total_length": self._total_length,
+                "removed": self._removed
+            }
+            with open(temp_path, 'wb') as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self.path)
+            open(self.log_path, 'wb').close()
+            self._log_offset = 0
+            self._log_chunks = 0
+        self._loaded_mtime = os.path.getmtime(self.path)
+
+    def load(self) -> bool:
+        """Load the index and its log from disk, returning False if it hasn't been saved"""
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, 'rb') as f:
+            state = pickle.load(f)
+        with self._lock:
+            self.chunk_ids = state["chunk_ids"]
+            self._removed = state.get("removed", array('I'))
+            removed = set(self._removed)
+            self._positions = {chunk_id: i for i, chunk_id in enumerate(self.chunk_ids)
+                               if i not in removed}
+            self._terms = state["terms"]
+            self._postings = state["postings"]
+            self._frequencies = state["frequencies"]
+            self._lengths = state["lengths"]
+            self._total_length = state["total_length"]
+            self._log_offset = 0
+            self._log_chunks = 0
+        self._loaded_mtime = os.path.getmtime(self.path)
+        self.replay_log()
+        return True
+
+    def is_stale(self) -> bool:
+        """Whether another process has saved a newer version to disk"""
+        return os.path.exists(self.path) and os.path.getmtime(self.path) != self._loaded_mtime
+
+
+def rebuild_index(index: LexicalIndex, collection):
+    """
+    Index every chunk already stored in a collection
+
+    Args:
+        index: The index to fill
+        collection: The ChromaDB collection
+    """
+    total = collection.count()
+    for offset in range(0, total, REBUILD_BATCH_SIZE):
+        batch = collection.get(limit=REBUILD_BATCH_SIZE,
+                               offset=offset, include=["documents"])
+        index.add(batch["ids"], batch["documents"])
+    index.save()
+    logger.info(
+        f"Built lexical index for {index.collection_name} with {len(index)} chunks")
+
+
+def get_lexical_index(collection_name: str, collection=None) -> Optional[LexicalIndex]:
+    """
+    Get the lexical index for a collection, loading or building it if needed
+
+    Args:
+        collection_name: Name of the collection
+        collection: The ChromaDB collection, used to build a missing index
+
+    Returns:
+        The index, or None if it doesn't exist and can't be built
+    """
+    with _indexes_lock:
+        index = _indexes.get(collection_name)
+        if index is None:
+            index = LexicalIndex(collection_name)
+            if not index.load():
+                if collection is None:
+                    return None
+                rebuild_index(index, collection)
+            _indexes[collection_name] = index
+        elif index.is_stale():
+            index.load()
+        else:
+            index.replay_log()
+        return index
+
+
+def index_chunks(collection_name: str, ids: List[str], texts: List[str], collection=None):
+    """
+    Add newly stored chunks to a collection's lexical index and log them to disk
+
+    Args:
+        collection_name: Name of the collection
+        ids: Chunk IDs
+        texts: Chunk texts
+        collection: The ChromaDB collection, used to build a missing index
+    """
+    index = get_lexical_index(collection_name, collection)
+    if index is None:
+        return
+    if index.add(ids, texts):
+        index.log("add", ids, texts)
+
+
+def remove_chunks(collection_name: str, ids: List[str]):
+    """
+    Remove deleted chunks from a collection's lexical index and log them to disk
+
+    Args:
+        collection_name: Name of the collection
+        ids: Chunk IDs
+    """
+    index = get_lexical_index(collection_name)
+    if index is None:
+        return
+    if index.remove(ids):
+        index.log("remove", ids)
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> Dict[str, float]:
+    """
+    Fuse several rankings of chunk IDs
+
+    Args:
+        rankings: Lists of chunk IDs, best first
+        k: RRF constant; larger values flatten the contribution of top ranks
+
+    Returns:
+        Fused score per chunk ID (higher is better)
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+    return fused
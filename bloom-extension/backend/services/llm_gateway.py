@@ -0,0 +1,360 @@
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import threading
+import weakref
+from collections import deque
+from concurrent.futures import Future
+from typing import Dict, Any
+
+import openai
+
+from config import (OPENAI_API_KEY, LLM_MODEL_LIMITS, LLM_DEFAULT_LIMITS, LLM_MAX_RETRIES,
+                    LLM_RETRY_BASE_SECONDS, LLM_RETRY_MAX_SECONDS, LLM_METRICS_WINDOW)
+from services.prompt_builder import count_message_tokens, CHARS_PER_TOKEN
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set API key
+openai.api_key = OPENAI_API_KEY
+
+# Errors worth trying again: rate limits, timeouts and server-side failures
+RETRYABLE_ERRORS = (openai.error.RateLimitError, openai.error.APIError, openai.error.Timeout,
+                    openai.error.ServiceUnavailableError, openai.error.APIConnectionError,
+                    openai.error.TryAgain)
+
+
+class TokenBucket:
+    """
+    Rate limiter that refills at per_minute / 60 units a second, up to one minute's worth.
+
+    Callers reserve what they need and wait out any shortfall. Reservations
+    can take the bucket below zero, so later callers queue behind earlier ones.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """
+        Take amount from the bucket
+
+        Returns:
+            Seconds to wait before using it
+        """
+        with self._lock:
+            self._refill()
+            # A request larger than the bucket would otherwise never fit
+            self.available -= min(amount, self.capacity)
+            return max(0.0, -self.available / self.rate)
+
+    def pause(self, seconds: float):
+        """Empty the bucket so that nothing is let through for the given time"""
+        with self._lock:
+            self._refill()
+            self.available = min(self.available, -seconds * self.rate)
+
+
+class ModelLimiter:
+    """Concurrency and rate limits for one model, with its call metrics"""
+
+    def __init__(self, model: str, concurrency: int, rpm: int, tpm: int):
+        self.model = model
+        self.concurrency = concurrency
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        # Synchronous callers run in threads; async callers get a semaphore per event loop
+        self.thread_semaphore = threading.BoundedSemaphore(concurrency)
+        self._loop_semaphores = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "errors": 0, "retries": 0, "rate_limited": 0,
+                         "coalesced": 0, "in_flight": 0, "estimated_tokens": 0, "wait_seconds": 0.0}
+        self.latencies = deque(maxlen=LLM_METRICS_WINDOW)
+
+    def loop_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._loop_semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._loop_semaphores[loop] = asyncio.Semaphore(self.concurrency)
+        return semaphore
+
+    def reserve(self, estimated_tokens: int) -> float:
+        """Reserve one request and its tokens; returns the seconds to wait"""
+        self.count("estimated_tokens", estimated_tokens)
+        return max(self.requests.reserve(1), self.tokens.reserve(estimated_tokens))
+
+    def rate_limited(self, seconds: float):
+        """Hold back every caller of this model after the API reports a rate limit"""
+        self.count("rate_limited")
+        self.requests.pause(seconds)
+
+    def count(self, name: str, amount: float = 1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def record_latency(self, seconds: float):
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters and latency percentiles over the last LLM_METRICS_WINDOW calls"""
+        with self._lock:
+            metrics = dict(self.counters)
+            latencies = sorted(self.latencies)
+        metrics["wait_seconds"] = round(metrics["wait_seconds"], 3)
+        if latencies:
+            metrics["latency_ms"] = {
+                "p50": round(latencies[len(latencies) // 2] * 1000, 1),
+                "p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+                "max": round(latencies[-1] * 1000, 1)
+            }
+        return metrics
+
+
+# model -> ModelLimiter
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+# Identical calls in flight: request key -> task (async) or future (threads)
+_in_flight = {}
+_thread_in_flight = {}
+_thread_in_flight_lock = threading.Lock()
+
+
+def get_limiter(model: str) -> ModelLimiter:
+    """The limiter for a model, created from LLM_MODEL_LIMITS on first use"""
+    with _limiters_lock:
+        limiter = _limiters.get(model)
+        if limiter is None:
+            limits = {**LLM_DEFAULT_LIMITS, **LLM_MODEL_LIMITS.get(model, {})}
+            limiter = _limiters[model] = ModelLimiter(
+                model, limits["concurrency"], limits["rpm"], limits["tpm"])
+        return limiter
+
+
+def request_key(kind: str, arguments: Dict[str, Any]) -> str:
+    """Key identifying a call by its kind and arguments"""
+    return kind + ":" + hashlib.sha256(
+        json.dumps(arguments, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    """
+    Seconds to wait before retrying a failed call
+
+    Uses the API's Retry-After header when it sends one, otherwise
+    exponential backoff with full jitter.
+    """
+    headers = getattr(error, "headers", None) or {}
+    try:
+        retry_after = float(headers.get("retry-after", 0))
+    except (TypeError, ValueError):
+        retry_after = 0
+    if retry_after > 0:
+        return min(retry_after, LLM_RETRY_MAX_SECONDS)
+    return random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** attempt))
+
+
+def _handle_failure(limiter: ModelLimiter, error: Exception, attempt: int) -> float:
+    """Record a failed attempt and return the delay before the next, or raise if there is none"""
+    limiter.count("errors")
+    if not isinstance(error, RETRYABLE_ERRORS) or attempt >= LLM_MAX_RETRIES:
+        raise error
+
+    delay = retry_delay(error, attempt)
+    limiter.count("retries")
+    logger.warning(
+        f"{limiter.model} call failed ({type(error).__name__}: {str(error)}), "
+        f"retrying in {delay:.1f}s (attempt {attempt + 1}/{LLM_MAX_RETRIES})")
+    if isinstance(error, openai.error.RateLimitError):
+        # Pausing the model's bucket holds back this call along with every other
+        limiter.rate_limited(delay)
+        return 0.0
+    return delay
+
+
+async def _call_async(limiter: ModelLimiter, create, arguments: Dict[str, Any], estimated_tokens: int):
+    """Make an async API call within the model's limits, retrying failures"""
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        wait = limiter.reserve(estimated_tokens)
+        if wait > 0:
+            limiter.count("wait_seconds", wait)
+            await asyncio.sleep(wait)
+
+        semaphore = limiter.loop_semaphore()
+        await semaphore.acquire()
+        limiter.count("in_flight")
+        started = time.monotonic()
+        streaming = False
+        try:
+            limiter.count("calls")
+            response = await create(**arguments)
+            if arguments.get("stream"):
+                streaming = True
+                return ReleasingStream(limiter, semaphore, response, started)
+            limiter.record_latency(time.monotonic() - started)
+            return response
+        except Exception as e:
+            delay = _handle_failure(limiter, e, attempt)
+        finally:
+            # Streams release their slot once they have been read
+            if not streaming:
+                limiter.count("in_flight", -1)
+                semaphore.release()
+        await asyncio.sleep(delay)
+
+
+class ReleasingStream:
+    """
+    Streamed response that holds its model's concurrency slot until it is done with.
+
+    The slot is released once, when the stream ends or fails, when it is
+    closed with aclose(), or when it is garbage collected, so a caller that
+    never iterates it, or stops early, can't leak the slot.
+    """
+
+    def __init__(self, limiter: ModelLimiter, semaphore: asyncio.Semaphore, response, started: float):
+        self.limiter = limiter
+        self.semaphore = semaphore
+        self.started = started
+        self._response = response.__aiter__()
+        self._released = False
+
+    def _release(self):
+        if self._released:
+            return
+        self._released = True
+        self.limiter.count("in_flight", -1)
+        self.semaphore.release()
+        self.limiter.record_latency(time.monotonic() - self.started)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._released:
+            raise StopAsyncIteration
+        try:
+            return await self._response.__anext__()
+        except BaseException:
+            # The end of the stream, an API error or cancellation
+            self._release()
+            raise
+
+    async def aclose(self):
+        """Stop reading the stream and give up its slot"""
+        try:
+            close = getattr(self._response, "aclose", None)
+            if close is not None and not self._released:
+                await close()
+        finally:
+            self._release()
+
+    def __del__(self):
+        self._release()
+
+
+def _call_sync(limiter: ModelLimiter, create, arguments: Dict[str, Any], estimated_tokens: int):
+    """Make a blocking API call within the model's limits, retrying failures"""
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        wait = limiter.reserve(estimated_tokens)
+        if wait > 0:
+            limiter.count("wait_seconds", wait)
+            time.sleep(wait)
+
+        started = time.monotonic()
+        with limiter.thread_semaphore:
+            limiter.count("in_flight")
+            try:
+                limiter.count("calls")
+                response = create(**arguments)
+            except Exception as e:
+                delay = _handle_failure(limiter, e, attempt)
+            else:
+                limiter.record_latency(time.monotonic() - started)
+                return response
+            finally:
+                limiter.count("in_flight", -1)
+        time.sleep(delay)
+
+
+async def chat_completion(**arguments):
+    """
+    Create a chat completion through the shared gateway
+
+    Takes the same arguments as openai.ChatCompletion.acreate and returns
+    the same response (an async iterator of chunks when stream is set).
+    Identical non-streaming calls in flight at the same time share one request.
+    """
+    limiter = get_limiter(arguments["model"])
+    estimated_tokens = count_message_tokens(arguments["messages"]) + arguments.get("max_tokens", 0)
+    create = openai.ChatCompletion.acreate
+
+    if arguments.get("stream"):
+        return await _call_async(limiter, create, arguments, estimated_tokens)
+
+    key = request_key("chat", arguments)
+    task = _in_flight.get(key)
+    if task is not None:
+        limiter.count("coalesced")
+    else:
+        task = asyncio.ensure_future(_call_async(limiter, create, arguments, estimated_tokens))
+        _in_flight[key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(key, None))
+    # One caller giving up must not cancel the call for the others
+    return await asyncio.shield(task)
+
+
+def create_embeddings(**arguments):
+    """
+    Create embeddings through the shared gateway
+
+    Takes the same arguments as openai.Embedding.create and returns the same
+    response. Blocking, so it can be called from threads and scripts;
+    identical calls in flight at the same time share one request.
+    """
+    limiter = get_limiter(arguments["model"])
+    texts = arguments["input"] if isinstance(arguments["input"], list) else [arguments["input"]]
+    estimated_tokens = sum(len(text) for text in texts) // CHARS_PER_TOKEN + 1
+
+    key = request_key("embedding", arguments)
+    with _thread_in_flight_lock:
+        future = _thread_in_flight.get(key)
+        owner = future is None
+        if owner:
+            future = _thread_in_flight[key] = Future()
+    if not owner:
+        limiter.count("coalesced")
+        return future.result()
+
+    try:
+        response = _call_sync(limiter, openai.Embedding.create, arguments, estimated_tokens)
+        future.set_result(response)
+        return response
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _thread_in_flight_lock:
+            _thread_in_flight.pop(key, None)
+
+
+def get_metrics() -> Dict[str, Any]:
+    """Call metrics for every model used so far"""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.model: limiter.snapshot() for limiter in limiters}
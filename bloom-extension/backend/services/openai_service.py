@@ -1,32 +1,59 @@
-import openai
-from config import OPENAI_API_KEY, CHAT_MODEL
+from config import CHAT_MODEL, SUMMARY_MODEL, SUMMARY_KEEP_MESSAGES, SUMMARY_TRIGGER_MESSAGES
+import asyncio
 import logging
-from bloom_agent import BloomAgent  # Import the agent module
+from bloom_agent import BloomAgent, format_action_header  # Import the agent module
+from services.session_store import create_session_store
+from services.prompt_builder import build_prompt
+from services.llm_gateway import chat_completion
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Set API key
-openai.api_key = OPENAI_API_KEY
+# Conversation history and agent state per session, bounded by LRU and
+# idle-TTL eviction and optionally persisted to SQLite (see config.py)
+conversation_history = create_session_store()
+# Each record looks like:
+# {
+#     "messages": [
+#         {"role": "system", "content": "..."},
+#         {"role": "user", "content": "..."},
+#         {"role": "assistant", "content": "..."}
+#     ],
+#     "document_ids": ["doc_id1", "doc_id2"],
+#     "agent_history": [{"action": "summarize", ...}],
+#     "summary": "Running summary of turns folded out of messages"
+# }
+
+# Background summarization tasks, at most one per session
+summary_tasks = {}
+
+
+def get_session(session_id):
+    """
+    Get a session's record, creating an empty one if needed
 
-# Maintain conversation history - persists between server restarts
-conversation_history = {
-    # "session_id": {
-    #     "messages": [
-    #         {"role": "system", "content": "..."},
-    #         {"role": "user", "content": "..."},
-    #         {"role": "assistant", "content": "..."}
-    #     ],
-    #     "document_ids": ["doc_id1", "doc_id2"]
-    # }
-}
+    Args:
+        session_id (str): Identifier for the conversation session
 
-# Initialize agent instances
-active_agents = {}
+    Returns:
+        dict: The session's record
+    """
+    session = conversation_history.get(session_id)
+    if session is None:
+        logger.info(
+            f"Creating new conversation history for session: {session_id}")
+        session = {
+            "messages": [],
+            "document_ids": [],
+            "agent_history": [],
+            "summary": ""
+        }
+    return session
 
 
-async def generate_response(query, relevant_chunks, session_id="default"):
+async def generate_response(query, relevant_chunks, session_id="default", on_token=None,
+                            collection_name=None, where=None):
     """
     Generate a response using GPT-4o or the BloomAgent based on the query,
     relevant document chunks, and conversation history.
@@ -35,6 +62,11 @@ async def generate_response(query, relevant_chunks, session_id="default"):
         query (str): The user's query
         relevant_chunks (list): List of relevant document chunks
         session_id (str): Identifier for the conversation session
+        on_token (callable, optional): Receives the response text as it streams;
+            conversation history is only updated once the response is complete
+        collection_name (str, optional): Collection the chunks were searched in,
+            which agent actions search again for more material
+        where (dict, optional): Metadata filter the chunks were searched with
 
     Returns:
         str: Generated response
@@ -46,142 +78,79 @@ async def generate_response(query, relevant_chunks, session_id="default"):
     document_ids = list(set([chunk["metadata"]["document_id"]
                         for chunk in relevant_chunks if "metadata" in chunk and "document_id" in chunk["metadata"]]))
 
-    # Initialize agent if needed
-    if session_id not in active_agents:
-        active_agents[session_id] = BloomAgent(session_id)
+    session = get_session(session_id)
 
     # Check if this is an agent action request
     try:
+        # The agent records its actions in the session's agent history
+        agent = BloomAgent(session_id, session["agent_history"], collection_name, where)
         # FIX: Add 'await' here to properly await the coroutine
-        agent_response = await active_agents[session_id].process_request(query, relevant_chunks)
+        agent_response = await agent.process_request(query, relevant_chunks, on_token)
         if agent_response:
-            # Add to conversation history
-            if session_id not in conversation_history:
-                logger.info(
-                    f"Creating new conversation history for session: {session_id}")
-                conversation_history[session_id] = {
-                    "messages": [],
-                    "document_ids": []
-                }
-
-            # Update document IDs for this session
-            for doc_id in document_ids:
-                if doc_id not in conversation_history[session_id]["document_ids"]:
-                    conversation_history[session_id]["document_ids"].append(
-                        doc_id)
-
-            # Initialize conversation with system message if needed
-            if not conversation_history[session_id]["messages"]:
-                conversation_history[session_id]["messages"].append(
-                    {"role": "system", "content": build_system_message()}
-                )
-
             # Add user query and agent response to conversation history
-            conversation_history[session_id]["messages"].append(
-                {"role": "user", "content": query}
-            )
-            conversation_history[session_id]["messages"].append(
-                {"role": "assistant", "content": agent_response["response"]}
-            )
-
-            # Keep conversation history manageable
-            if len(conversation_history[session_id]["messages"]) > 41:
-                conversation_history[session_id]["messages"] = [
-                    # system message
-                    conversation_history[session_id]["messages"][0]
-                ] + conversation_history[session_id]["messages"][-40:]  # last 40 messages
+            record_exchange(session_id, query,
+                            agent_response["response"], document_ids, session)
 
             # Return the agent's response
-            return f"[BLOOM Agent - {agent_response['agent_action'].replace('_', ' ').title()}]\n\n{agent_response['response']}"
+            return format_action_header(agent_response['agent_action']) + agent_response['response']
     except Exception as e:
         logger.error(f"Error in agent processing: {str(e)}")
         # Continue with standard response if agent processing fails
 
-    # Format context from relevant chunks with metadata
-    context_parts = []
-
-    for i, chunk in enumerate(relevant_chunks):
-        # Include metadata about the source document
-        metadata = chunk.get("metadata", {})
-        filename = metadata.get("filename", "Unknown")
-
-        # Format the chunk with source information
-        context_part = f"[Document: {filename}, Chunk {i+1}]\n{chunk['text']}\n"
-        context_parts.append(context_part)
+    # Use the session's existing system message, or build one with Middlesex University context
+    system_message = session["messages"][0]["content"] if session["messages"] else build_system_message()
 
-    # Combine all context parts
-    context = "\n".join(context_parts)
-
-    # Initialize conversation history if needed
-    if session_id not in conversation_history:
-        logger.info(
-            f"Creating new conversation history for session: {session_id}")
-        conversation_history[session_id] = {
-            "messages": [],
-            "document_ids": []
-        }
+    # Older turns are carried in the running summary rather than as raw messages
+    if session.get("summary"):
+        system_message += f"\n\nSummary of the earlier conversation:\n{session['summary']}"
 
-    # Update document IDs for this session
-    for doc_id in document_ids:
-        if doc_id not in conversation_history[session_id]["document_ids"]:
-            conversation_history[session_id]["document_ids"].append(doc_id)
-
-    # Build system message with Middlesex University context
-    system_message = build_system_message()
-
-    # Construct conversation messages
-    messages = []
-
-    # Add system message
-    if not conversation_history[session_id]["messages"]:
-        messages.append({"role": "system", "content": system_message})
-        conversation_history[session_id]["messages"].append(
-            {"role": "system", "content": system_message})
-    else:
-        # Add existing system message
-        messages.append(conversation_history[session_id]["messages"][0])
-
-    # Add recent conversation history (limited to last 10 exchanges to manage context length)
-    # Skip system message, take last 20
-    history_messages = conversation_history[session_id]["messages"][1:][-20:]
-    messages.extend(history_messages)
-
-    # Add current query with context
-    user_message = f"I need information from my course materials. Here are the relevant excerpts:\n\n{context}\n\nMy question is: {query}"
-    messages.append({"role": "user", "content": user_message})
+    # Fit the system message, recent history (at most the last 10 exchanges), the
+    # most relevant chunks and the question into the prompt's token budget
+    prompt = build_prompt(
+        system_message,
+        query,
+        user_template="I need information from my course materials. Here are the relevant excerpts:\n\n{context}\n\nMy question is: {question}",
+        history=session["messages"][1:][-20:],
+        chunks=relevant_chunks
+    )
+    messages = prompt["messages"]
 
     # Log message count for debugging
     logger.info(
-        f"Sending {len(messages)} messages to OpenAI API (including system message and new query)")
+        f"Sending {len(messages)} messages ({prompt['report']['total_tokens']} tokens) to OpenAI API (including system message and new query)")
 
     try:
         # Call OpenAI API with enhanced parameters for conversation memory
-        response = await openai.ChatCompletion.acreate(
+        response = await chat_completion(
             model=CHAT_MODEL,
             messages=messages,
             temperature=0.2,  # Lower temperature for more factual responses
             max_tokens=1000,
             top_p=0.95,
             frequency_penalty=0.5,  # Increase frequency penalty to avoid repetition in conversations
-            presence_penalty=0.5    # Increase presence penalty for more varied responses
+            presence_penalty=0.5,   # Increase presence penalty for more varied responses
+            stream=on_token is not None
         )
 
-        assistant_message = response.choices[0].message['content']
+        if on_token is None:
+            assistant_message = response.choices[0].message['content']
+        else:
+            # Pass tokens on as they arrive
+            parts = []
+            try:
+                async for chunk in response:
+                    token = chunk.choices[0].delta.get('content')
+                    if token:
+                        parts.append(token)
+                        on_token(token)
+            finally:
+                # Frees the model's concurrency slot even if reading stops early
+                await response.aclose()
+            assistant_message = "".join(parts)
 
         # Update conversation history with the actual query (not the context-enhanced one)
-        conversation_history[session_id]["messages"].append(
-            {"role": "user", "content": query})
-        conversation_history[session_id]["messages"].append(
-            {"role": "assistant", "content": assistant_message})
-
-        # Keep conversation history manageable (maintain system message + last 20 exchanges)
-        # system message + 40 exchange messages
-        if len(conversation_history[session_id]["messages"]) > 41:
-            # Keep system message and trim the oldest exchanges
-            conversation_history[session_id]["messages"] = [
-                # system message
-                conversation_history[session_id]["messages"][0]
-            ] + conversation_history[session_id]["messages"][-40:]  # last 40 messages
+        record_exchange(session_id, query, assistant_message,
+                        document_ids, session)
 
         return assistant_message
 
@@ -190,6 +159,118 @@ async def generate_response(query, relevant_chunks, session_id="default"):
         raise e
 
 
+def record_exchange(session_id, query, response, document_ids=None, session=None):
+    """
+    Add a query and its response to a session's conversation history
+
+    Args:
+        session_id (str): Identifier for the conversation session
+        query (str): The user's query (without retrieved context)
+        response (str): The assistant's response
+        document_ids (list, optional): Documents the response drew on
+        session (dict, optional): The session's record, if already loaded
+    """
+    if session is None:
+        session = get_session(session_id)
+
+    # Update document IDs for this session
+    for doc_id in document_ids or []:
+        if doc_id not in session["document_ids"]:
+            session["document_ids"].append(doc_id)
+
+    # Initialize conversation with system message if needed
+    if not session["messages"]:
+        session["messages"].append(
+            {"role": "system", "content": build_system_message()})
+
+    session["messages"].append({"role": "user", "content": query})
+    session["messages"].append({"role": "assistant", "content": response})
+
+    # Keep conversation history manageable (maintain system message + last 20 exchanges)
+    # system message + 40 exchange messages; normally summarization keeps it well below this
+    if len(session["messages"]) > 41:
+        # Keep system message and trim the oldest exchanges
+        session["messages"] = [
+            session["messages"][0]  # system message
+        ] + session["messages"][-40:]  # last 40 messages
+
+    conversation_history.save(session_id, session)
+
+    if len(session["messages"]) - 1 > SUMMARY_TRIGGER_MESSAGES:
+        schedule_summary(session_id)
+
+
+def schedule_summary(session_id):
+    """
+    Fold a session's older turns into its running summary in the background
+
+    Args:
+        session_id (str): Identifier for the conversation session
+    """
+    if session_id in summary_tasks:
+        return
+
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # No event loop (e.g. a script); history is still trimmed at 41 messages
+        return
+
+    task = loop.create_task(summarize_history(session_id))
+    summary_tasks[session_id] = task
+    task.add_done_callback(lambda _: summary_tasks.pop(session_id, None))
+
+
+async def summarize_history(session_id):
+    """
+    Fold all but the most recent turns of a session into its running summary
+
+    Args:
+        session_id (str): Identifier for the conversation session
+    """
+    session = conversation_history.get(session_id)
+    if session is None:
+        return
+
+    folded = session["messages"][1:-SUMMARY_KEEP_MESSAGES]
+    if not folded:
+        return
+
+    transcript = "\n\n".join(
+        f"{message['role'].capitalize()}: {message['content']}" for message in folded)
+    previous_summary = session.get("summary") or "(none)"
+
+    try:
+        response = await chat_completion(
+            model=SUMMARY_MODEL,
+            messages=[
+                {"role": "system", "content": "You maintain a running summary of a conversation between a student and BLOOM, a course materials assistant. Update the summary with the new turns. Keep the student's goals, the modules and documents discussed, key facts given in answers and any open questions. Write at most 200 words in plain prose."},
+                {"role": "user", "content": f"Current summary:\n{previous_summary}\n\nNew turns:\n{transcript}"}
+            ],
+            temperature=0.2,
+            max_tokens=400
+        )
+        summary = response.choices[0].message['content'].strip()
+    except Exception as e:
+        logger.error(
+            f"Error summarizing conversation for session {session_id}: {str(e)}")
+        return
+
+    # The session may have changed while the summary was generated
+    session = conversation_history.get(session_id)
+    if session is None or session["messages"][1:1 + len(folded)] != folded:
+        logger.info(
+            f"Conversation for session {session_id} changed during summarization, discarding summary")
+        return
+
+    session["summary"] = summary
+    session["messages"] = session["messages"][:1] + \
+        session["messages"][1 + len(folded):]
+    conversation_history.save(session_id, session)
+    logger.info(
+        f"Folded {len(folded)} messages into the summary for session: {session_id}")
+
+
 # Helper function to build system message
 def build_system_message():
     return """
@@ -211,30 +292,30 @@ def build_system_message():
 
 def clear_conversation(session_id="default"):
     """Clear the conversation history for a specific session"""
-    if session_id in conversation_history:
+    session = conversation_history.get(session_id)
+    if session is not None:
         # Preserve document IDs but reset messages to only system message
-        system_message = conversation_history[session_id]["messages"][
-            0] if conversation_history[session_id]["messages"] else None
-        conversation_history[session_id] = {
-            "messages": [system_message] if system_message else [],
-            "document_ids": conversation_history[session_id]["document_ids"]
-        }
+        session["messages"] = session["messages"][:1]
+        session["summary"] = ""
+        conversation_history.save(session_id, session)
         logger.info(f"Cleared conversation history for session: {session_id}")
     return {"status": "Conversation cleared"}
 
 
 def get_document_ids_for_session(session_id="default"):
     """Get document IDs associated with a session"""
-    if session_id in conversation_history:
-        return conversation_history[session_id]["document_ids"]
+    session = conversation_history.get(session_id)
+    if session is not None:
+        return session["document_ids"]
     return []
 
 
 def get_conversation_history(session_id="default", max_messages=10):
     """Get recent conversation history for a session"""
-    if session_id in conversation_history:
+    session = conversation_history.get(session_id)
+    if session is not None:
         # Skip system message and return most recent messages
-        messages = conversation_history[session_id]["messages"][1:][-max_messages:]
+        messages = session["messages"][1:][-max_messages:]
         return [
             {
                 "role": msg["role"],
@@ -0,0 +1,155 @@
+import re
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+
+from config import RESPONSE_CACHE_SIMILARITY, RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_ENTRIES
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class CachedResponse:
+    """A generated response and the sources it was built from"""
+
+    def __init__(self, collection_name: str, query: str, embedding: np.ndarray,
+                 response: str, sources: List[Dict[str, Any]]):
+        self.collection_name = collection_name
+        self.query = query
+        self.embedding = embedding
+        self.response = response
+        self.sources = sources
+        self.created_at = time.monotonic()
+        self.hits = 0
+
+
+class ResponseCache:
+    """
+    Caches chat responses per collection, matched on query similarity.
+
+    Lookups try the normalized query text first, which needs no embedding,
+    then the closest cached query embedding in the same collection. Entries
+    expire after a TTL, the least recently used are evicted beyond the size
+    limit, and a collection's entries are dropped whenever its documents change.
+    """
+
+    def __init__(self, similarity_threshold: float = RESPONSE_CACHE_SIMILARITY,
+                 ttl: float = RESPONSE_CACHE_TTL, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # (collection_name, normalized query) -> CachedResponse, in LRU order
+        self._entries = OrderedDict()
+        # collection_name -> (keys, embedding matrix), rebuilt when entries change
+        self._matrices = {}
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """Lowercase and strip punctuation and extra whitespace"""
+        return " ".join(re.sub(r'[^\w\s]', ' ', query.lower()).split())
+
+    def lookup(self, collection_name: str, query: str,
+               embedding: Optional[List[float]] = None) -> Optional[CachedResponse]:
+        """
+        Find a cached response for a query
+
+        Args:
+            collection_name: Collection the query searches
+            query: The user's query
+            embedding: Query embedding; without it only exact matches are found
+
+        Returns:
+            The cached response, or None on a miss
+        """
+        key = (collection_name, self.normalize_query(query))
+        entry = self._entries.get(key)
+
+        if entry is None and embedding is not None:
+            keys, matrix = self._get_matrix(collection_name)
+            if keys:
+                similarities = matrix @ self._unit(embedding)
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    key = keys[best]
+                    entry = self._entries[key]
+
+        if entry is None:
+            return None
+
+        if time.monotonic() - entry.created_at > self.ttl:
+            self._remove(key)
+            return None
+
+        entry.hits += 1
+        self._entries.move_to_end(key)
+        logger.info(
+            f"Response cache hit in {collection_name} for '{query}' (cached query: '{entry.query}')")
+        return entry
+
+    def store(self, collection_name: str, query: str, embedding: List[float],
+              response: str, sources: List[Dict[str, Any]]):
+        """
+        Cache a response for a query
+
+        Args:
+            collection_name: Collection the query searched
+            query: The user's query
+            embedding: Query embedding
+            response: The generated response
+            sources: Sources returned with the response
+        """
+        key = (collection_name, self.normalize_query(query))
+        self._entries[key] = CachedResponse(
+            collection_name, query, self._unit(embedding), response, sources)
+        self._entries.move_to_end(key)
+        self._matrices.pop(collection_name, None)
+
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+
+    def invalidate(self, collection_name: str):
+        """
+        Drop cached responses that may depend on a collection's documents
+
+        Args:
+            collection_name: The collection whose documents changed
+        """
+        stale = [key for key in self._entries
+                 if key[0] in (collection_name, "all")]
+        for key in stale:
+            self._remove(key)
+
+        if stale:
+            logger.info(
+                f"Invalidated {len(stale)} cached responses for {collection_name}")
+
+    def clear(self):
+        """Drop every cached response"""
+        self._entries.clear()
+        self._matrices.clear()
+
+    def _remove(self, key):
+        del self._entries[key]
+        self._matrices.pop(key[0], None)
+
+    def _get_matrix(self, collection_name: str):
+        if collection_name not in self._matrices:
+            keys = [key for key in self._entries if key[0] == collection_name]
+            matrix = np.stack([self._entries[key].embedding for key in keys]) if keys else None
+            self._matrices[collection_name] = (keys, matrix)
+        return self._matrices[collection_name]
+
+    @staticmethod
+    def _unit(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+# Shared cache instance
+response_cache = ResponseCache()
@@ -3,14 +3,16 @@ import requests
 import uuid
 import asyncio
 import logging
-from urllib.parse import urljoin, urlparse
-from typing import Dict, List, Any, Optional, Tuple
-from bs4 import BeautifulSoup
+from urllib.parse import urljoin, urlparse, unquote
+from typing import Callable, Dict, List, Any, Optional, Tuple
+from bs4 import BeautifulSoup, NavigableString, Tag
 import re
 from datetime import datetime
+from functools import partial
 
-from services.vector_store import add_documents
+from services.vector_store import add_documents, DocumentWriteBuffer
 from services.document_processor import process_document
+from services.document_summarizer import schedule_summary
 from utils.folder_manager import create_module_folders, save_file_to_module
 from utils.text_splitter import split_text
 
@@ -25,6 +27,53 @@ HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
 }
 
+# Prefer the lxml tree builder, which is several times faster than html.parser
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+# Link classification patterns, compiled once at import
+FILE_LINK_HREF_PATTERNS = (
+    '.pdf', '.docx', '.doc', '.pptx', '.ppt', '.xlsx', '.xls',
+    'resource/view.php', 'mod/resource/view.php',
+    'pluginfile.php', 'forcedownload=1',
+    'mod/assign/view.php'
+)
+TEXT_INDICATORS = (
+    'handbook', 'guide', 'syllabus', 'lecture', 'notes', 'assignment',
+    'document', 'resource', 'material', 'reading', 'pdf', 'doc', 'ppt'
+)
+TEXT_INDICATOR_PATTERNS = tuple(re.compile(indicator, re.I)
+                                for indicator in TEXT_INDICATORS)
+TEXT_INDICATOR_PREFILTER = re.compile('|'.join(TEXT_INDICATORS), re.I)
+DOCUMENT_EXTENSION_RE = re.compile(r'\.(pdf|docx?|pptx?|xlsx?)($|\?)', re.I)
+RESOURCE_VIEW_RE = re.compile(r'/(resource|mod/resource)/view\.php', re.I)
+FOLDER_VIEW_RE = re.compile(r'/mod/folder/view\.php', re.I)
+
+# Server-side folder crawl limits
+FOLDER_CRAWL_MAX_DEPTH = 3
+FOLDER_CRAWL_MAX_PAGES = 50
+FOLDER_CRAWL_CONCURRENCY = 4
+
+# Concurrent HEAD requests when resolving resource/view.php links
+RESOLVE_CONCURRENCY = 8
+
+# File extensions for the document types Moodle serves
+CONTENT_TYPE_EXTENSIONS = {
+    'application/pdf': '.pdf',
+    'application/msword': '.doc',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': '.docx',
+    'application/vnd.ms-powerpoint': '.ppt',
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation': '.pptx',
+    'application/vnd.ms-excel': '.xls',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': '.xlsx'
+}
+DOCUMENT_FILENAME_RE = re.compile(r'\.(pdf|docx?|pptx?|xlsx?)$', re.I)
+CONTENT_DISPOSITION_RE = re.compile(
+    r"filename\*=(?:UTF-8'')?([^;]+)|filename=\"?([^\";]+)\"?", re.I)
+
 # Track scraping status
 scraping_status = {}
 
@@ -47,6 +96,10 @@ class ScrapingTask:
         self.completed_files = 0
         self.cookies = {}  # Store cookies for authentication
         self.has_folders = False  # Flag for folder processing
+        self.crawl_folders = False  # Traverse folders server-side
+        self.folders_crawled = 0
+        # Resolved resource/view.php links: {view_url: (filename, url)}
+        self.resolved_resources = {}
 
     def to_dict(self) -> Dict[str, Any]:
         """Convert task to dictionary for status reporting"""
@@ -64,12 +117,15 @@ class ScrapingTask:
             "errors": self.errors,
             "total_files": self.total_files,
             "completed_files": self.completed_files,
-            "has_folders": self.has_folders
+            "has_folders": self.has_folders,
+            "crawl_folders": self.crawl_folders,
+            "folders_crawled": self.folders_crawled
         }
 
 
 async def start_scraping_task(url: str, module_code: str, module_name: str, cookies: Dict[str, str],
-                              documents: List[Dict[str, str]] = None, has_folders: bool = False) -> str:
+                              documents: List[Dict[str, str]] = None, has_folders: bool = False,
+                              crawl_folders: bool = False) -> str:
     """
     Start a new scraping task for a Moodle module page
 
@@ -80,6 +136,7 @@ async def start_scraping_task(url: str, module_code: str, module_name: str, cook
         cookies: The cookies from the browser for authentication
         documents: Pre-extracted documents from client-side (optional)
         has_folders: Whether the page has folders that need traversal
+        crawl_folders: Crawl folders server-side instead of waiting for the client
 
     Returns:
         The task ID
@@ -88,6 +145,7 @@ async def start_scraping_task(url: str, module_code: str, module_name: str, cook
     task = ScrapingTask(url, module_code, module_name)
     task.cookies = cookies  # Save cookies for folder traversal
     task.has_folders = has_folders  # Set folder flag
+    task.crawl_folders = crawl_folders
     scraping_status[task.task_id] = task
 
     logger.info(
@@ -128,6 +186,9 @@ async def scrape_moodle_course(task: ScrapingTask, cookies: Dict[str, str],
         # Determine collection name for this module
         collection_name = f"module_{task.module_code}"
 
+        # Batch vector store writes across every file in the task
+        write_buffer = DocumentWriteBuffer()
+
         # Fetch the course page
         try:
             logger.info(f"Fetching course page: {task.url}")
@@ -135,7 +196,7 @@ async def scrape_moodle_course(task: ScrapingTask, cookies: Dict[str, str],
             response.raise_for_status()
 
             # Parse HTML
-            soup = BeautifulSoup(response.text, 'html.parser')
+            soup = make_soup(response.text)
             logger.info(f"Successfully parsed Moodle page HTML")
 
             # Always extract HTML content from the page first
@@ -154,17 +215,19 @@ async def scrape_moodle_course(task: ScrapingTask, cookies: Dict[str, str],
                 logger.info(f"Saved page content to {content_path}")
 
                 # Add page content to vector database
+                on_flush, on_error = track_file(task, content_filename)
                 document_id = await process_text_content(
                     page_content,
                     task.module_code,
                     task.module_name,
                     content_filename,
-                    source_type="moodle_page"
+                    source_type="moodle_page",
+                    write_buffer=write_buffer,
+                    on_flush=on_flush,
+                    on_error=on_error
                 )
                 logger.info(
                     f"Processed page content with document ID: {document_id}")
-                task.files_downloaded.append(content_filename)
-                task.completed_files += 1
 
             # Use provided documents if available, otherwise extract from page
             file_links = []
@@ -179,6 +242,10 @@ async def scrape_moodle_course(task: ScrapingTask, cookies: Dict[str, str],
                 logger.info(
                     f"Extracted {len(file_links)} document links from page")
 
+            # Swap resource/view.php links for their direct file URLs
+            file_links = await resolve_resource_links(
+                file_links, task, cookies)
+
             task.files_found = [filename for filename, _ in file_links]
             task.total_files = len(file_links) + 1  # +1 for the page content
 
@@ -193,11 +260,10 @@ async def scrape_moodle_course(task: ScrapingTask, cookies: Dict[str, str],
                     logger.info(
                         f"Processing file {i+1}/{len(file_links)}: {filename}")
 
-                    success = await download_and_process_file(url, filename, task.module_code, module_dir, cookies)
+                    success = await download_and_process_file(url, filename, task.module_code, module_dir, cookies,
+                                                              write_buffer, *track_file(task, filename))
 
                     if success:
-                        task.files_downloaded.append(filename)
-                        task.completed_files += 1
                         logger.info(f"Successfully processed {filename}")
                     else:
                         task.errors.append(f"Failed to process {filename}")
@@ -210,8 +276,17 @@ async def scrape_moodle_course(task: ScrapingTask, cookies: Dict[str, str],
                     task.errors.append(
                         f"Failed to download {filename}: {str(e)}")
 
+            # Crawl folder pages ourselves when the client asked us to
+            if task.crawl_folders:
+                task.status = "crawling_folders"
+                await crawl_module_folders(
+                    task, soup, module_dir, {url for _, url in file_links}, write_buffer)
+
+            # Write whatever is still buffered before reporting completion
+            await flush_write_buffer(task, write_buffer)
+
             # If no folders need traversal, mark as completed
-            if not task.has_folders:
+            if not task.has_folders or task.crawl_folders:
                 task.status = "completed"
                 task.progress = 100
                 logger.info(
@@ -233,6 +308,11 @@ async def scrape_moodle_course(task: ScrapingTask, cookies: Dict[str, str],
         task.status = "failed"
         task.errors.append(str(e))
 
+    finally:
+        # Folder processing still needs the resolved links; otherwise the task is done with them
+        if task.status != "awaiting_folders":
+            task.resolved_resources.clear()
+
 
 async def add_folder_documents(task_id: str, module_code: str, folder_url: str, documents: List[Dict[str, str]]):
     """
@@ -256,6 +336,11 @@ async def add_folder_documents(task_id: str, module_code: str, folder_url: str,
     logger.info(
         f"Processing folder {folder_url} with {len(documents)} documents for task {task_id}")
 
+    # Swap resource/view.php links for their direct file URLs
+    file_links = await resolve_resource_links(
+        [(doc["name"], doc["url"]) for doc in documents], task, task.cookies)
+    documents = [{"name": filename, "url": url} for filename, url in file_links]
+
     # Add documents to files_found
     for doc in documents:
         task.files_found.append(doc["name"])
@@ -266,6 +351,9 @@ async def add_folder_documents(task_id: str, module_code: str, folder_url: str,
     module_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
                               "data", "modules", module_code)
 
+    # Batch vector store writes across the folder's files
+    write_buffer = DocumentWriteBuffer()
+
     # Process each document
     for doc in documents:
         try:
@@ -280,12 +368,12 @@ async def add_folder_documents(task_id: str, module_code: str, folder_url: str,
                 filename,
                 module_code,
                 module_dir,
-                task.cookies  # Use cookies from the task
+                task.cookies,  # Use cookies from the task
+                write_buffer,
+                *track_file(task, filename)
             )
 
             if success:
-                task.files_downloaded.append(filename)
-                task.completed_files += 1
                 logger.info(f"Successfully processed folder file {filename}")
             else:
                 task.errors.append(f"Failed to process folder file {filename}")
@@ -297,6 +385,8 @@ async def add_folder_documents(task_id: str, module_code: str, folder_url: str,
             task.errors.append(
                 f"Failed to process folder file {doc['name']}: {str(e)}")
 
+    await flush_write_buffer(task, write_buffer)
+
     # Update progress (based on total files completed)
     if task.total_files > 0:
         task.progress = min(
@@ -323,6 +413,7 @@ async def complete_folder_traversal(task_id: str):
     # Update task status and progress
     task.status = "completed"
     task.progress = 100
+    task.resolved_resources.clear()
     logger.info(f"Folder traversal completed for task {task_id}")
 
     return {
@@ -332,10 +423,319 @@ async def complete_folder_traversal(task_id: str):
     }
 
 
+async def crawl_module_folders(task: ScrapingTask, soup: BeautifulSoup, module_dir: str,
+                               seen_file_urls: set,
+                               write_buffer: Optional[DocumentWriteBuffer] = None) -> None:
+    """
+    Crawl the module's folder pages breadth-first and process their files
+
+    Uses the task's saved cookies, so the extension does not have to open
+    each folder and post its contents back one round-trip at a time.
+
+    Args:
+        task: The scraping task
+        soup: BeautifulSoup object of the course page
+        module_dir: The module directory
+        seen_file_urls: URLs of files already processed for this task
+        write_buffer: Buffer for batching vector store writes (optional)
+    """
+    loop = asyncio.get_event_loop()
+    semaphore = asyncio.Semaphore(FOLDER_CRAWL_CONCURRENCY)
+    visited = {task.url.split('#')[0]}
+    # Folders are fetched with the user's Moodle cookies, so never leave the course's host
+    host = urlparse(task.url).netloc
+    frontier = [url for _, url in extract_folder_links(soup, task.url, host)]
+    depth = 0
+
+    async def fetch(folder_url: str) -> Optional[BeautifulSoup]:
+        async with semaphore:
+            try:
+                return await loop.run_in_executor(
+                    None, partial(fetch_soup, folder_url, task.cookies))
+            except Exception as e:
+                logger.error(f"Error fetching folder {folder_url}: {str(e)}")
+                task.errors.append(
+                    f"Failed to fetch folder {folder_url}: {str(e)}")
+                return None
+
+    while frontier and depth <= FOLDER_CRAWL_MAX_DEPTH:
+        # Take the unvisited folders for this level, within the page budget
+        level = []
+        for folder_url in frontier:
+            if len(visited) > FOLDER_CRAWL_MAX_PAGES:
+                logger.warning(
+                    f"Folder crawl page limit reached for task {task.task_id}")
+                break
+            if folder_url not in visited:
+                visited.add(folder_url)
+                level.append(folder_url)
+
+        if not level:
+            break
+
+        logger.info(
+            f"Crawling {len(level)} folders at depth {depth} for task {task.task_id}")
+        pages = await asyncio.gather(*(fetch(url) for url in level))
+
+        frontier = []
+        for folder_url, folder_soup in zip(level, pages):
+            if folder_soup is None:
+                continue
+            task.folders_crawled += 1
+
+            # Queue subfolders for the next level
+            frontier.extend(
+                url for _, url in extract_folder_links(folder_soup, folder_url, host))
+
+            # Process files we have not seen anywhere else in the module
+            file_links = await resolve_resource_links(
+                [(filename, url)
+                 for filename, url in extract_file_links(folder_soup, folder_url)
+                 if not FOLDER_VIEW_RE.search(url)],
+                task, task.cookies)
+            file_links = [(filename, url) for filename, url in file_links
+                          if url not in seen_file_urls]
+            seen_file_urls.update(url for _, url in file_links)
+
+            task.files_found.extend(filename for filename, _ in file_links)
+            task.total_files += len(file_links)
+            logger.info(
+                f"Found {len(file_links)} new files in folder {folder_url}")
+
+            for filename, url in file_links:
+                success = await download_and_process_file(
+                    url, filename, task.module_code, module_dir, task.cookies, write_buffer,
+                    *track_file(task, filename))
+
+                if success:
+                    logger.info(f"Successfully processed folder file {filename}")
+                else:
+                    task.errors.append(f"Failed to process folder file {filename}")
+                    logger.error(f"Failed to process folder file {filename}")
+
+            if task.total_files > 0:
+                task.progress = min(
+                    95, int(100 * task.completed_files / task.total_files))
+
+        depth += 1
+
+    logger.info(
+        f"Crawled {task.folders_crawled} folders for task {task.task_id}")
+
+
+async def resolve_resource_links(file_links: List[Tuple[str, str]], task: ScrapingTask,
+                                 cookies: Dict[str, str]) -> List[Tuple[str, str]]:
+    """
+    Resolve resource/view.php links to direct file URLs before downloading
+
+    Resolution runs concurrently and is cached on the task, so each view.php
+    link costs at most one round-trip per task instead of an HTML page
+    download plus a second GET at download time. Links that cannot be
+    resolved are returned unchanged.
+
+    Args:
+        file_links: List of tuples (filename, url)
+        task: The scraping task, which holds the resolved links
+        cookies: The cookies for authentication
+
+    Returns:
+        List of tuples (filename, url) with resolved links substituted
+    """
+    cache = task.resolved_resources
+    pending = list({url for _, url in file_links
+                    if RESOURCE_VIEW_RE.search(url) and url not in cache})
+
+    if pending:
+        loop = asyncio.get_event_loop()
+        semaphore = asyncio.Semaphore(RESOLVE_CONCURRENCY)
+
+        async def resolve(url: str) -> Optional[Tuple[str, str]]:
+            async with semaphore:
+                try:
+                    return await loop.run_in_executor(
+                        None, partial(resolve_resource_url, url, cookies))
+                except Exception as e:
+                    logger.warning(f"Could not resolve {url}: {str(e)}")
+                    return None
+
+        resolved = await asyncio.gather(*(resolve(url) for url in pending))
+        for url, result in zip(pending, resolved):
+            if result:
+                cache[url] = result
+
+        logger.info(
+            f"Resolved {sum(1 for r in resolved if r)}/{len(pending)} resource links for {task.module_code}")
+
+    # Substitute resolved links, dropping any that now point at the same file
+    seen_urls = set()
+    unique_links = []
+
+    for filename, url in file_links:
+        if url in cache:
+            filename, url = cache[url]
+        if url not in seen_urls:
+            unique_links.append((filename, url))
+            seen_urls.add(url)
+
+    return unique_links
+
+
+def resolve_resource_url(url: str, cookies: Dict[str, str]) -> Optional[Tuple[str, str]]:
+    """
+    Follow a resource/view.php link to the file it serves
+
+    Moodle usually redirects view.php straight to pluginfile.php, so a HEAD
+    request is enough. Resources set to embed or open in a popup return an
+    HTML page instead, in which case the first direct file link is used.
+
+    Args:
+        url: The resource/view.php URL
+        cookies: The cookies for authentication
+
+    Returns:
+        Tuple (filename, url) of the file, or None if it can't be resolved
+    """
+    response = requests.head(url, headers=HEADERS, cookies=cookies,
+                             allow_redirects=True, timeout=15)
+
+    if 'text/html' in response.headers.get('Content-Type', '') or response.status_code >= 400:
+        page = requests.get(url, headers=HEADERS, cookies=cookies, timeout=30)
+        page.raise_for_status()
+
+        soup = make_soup(page.content)
+        file_url = None
+        for link in soup.find_all('a', href=True):
+            if any(pattern in link['href'] for pattern in ['pluginfile.php', 'forcedownload=1']):
+                file_url = urljoin(page.url, link['href'])
+                break
+
+        if not file_url:
+            return None
+
+        response = requests.head(file_url, headers=HEADERS, cookies=cookies,
+                                 allow_redirects=True, timeout=15)
+
+    response.raise_for_status()
+    filename = get_filename_from_headers(response.headers, response.url)
+    if not filename:
+        return None
+
+    return filename, response.url
+
+
+def get_filename_from_headers(headers, url: str) -> Optional[str]:
+    """
+    Determine a file's name and type from its response headers
+
+    Args:
+        headers: The response headers
+        url: The final URL of the file
+
+    Returns:
+        A filename with an extension matching the content type, or None
+    """
+    content_type = headers.get('Content-Type', '').split(';')[0].strip().lower()
+    extension = CONTENT_TYPE_EXTENSIONS.get(content_type)
+
+    # Prefer the server's filename, then the last part of the URL path
+    filename = ""
+    match = CONTENT_DISPOSITION_RE.search(headers.get('Content-Disposition', ''))
+    if match:
+        filename = unquote(match.group(1) or match.group(2)).strip()
+    if not filename:
+        filename = unquote(os.path.basename(urlparse(url).path))
+
+    filename = re.sub(r'[^\w\-. ]', '_', filename)
+
+    if extension:
+        if not filename or len(filename) < 3:
+            filename = f"resource_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        if not filename.lower().endswith(extension):
+            filename = os.path.splitext(filename)[0] + extension
+    elif not DOCUMENT_FILENAME_RE.search(filename):
+        # Not a document type we know how to process
+        return None
+
+    return filename
+
+
+def track_file(task: ScrapingTask, filename: str) -> Tuple[Callable[[], None], Callable[[Exception], None]]:
+    """
+    Callbacks that record a file on the task once its buffered chunks are written or fail
+
+    Args:
+        task: The scraping task
+        filename: The file's name
+
+    Returns:
+        Tuple (on_flush, on_error) for the write buffer
+    """
+    def written():
+        task.files_downloaded.append(filename)
+        task.completed_files += 1
+
+    def failed(error):
+        task.errors.append(f"Failed to write {filename}: {str(error)}")
+
+    return written, failed
+
+
+async def flush_write_buffer(task: ScrapingTask, write_buffer: DocumentWriteBuffer) -> None:
+    """
+    Flush a task's write buffer, recording a failure on the task
+
+    Args:
+        task: The scraping task
+        write_buffer: The buffer to flush
+    """
+    try:
+        await write_buffer.flush_async()
+        logger.info(
+            f"Wrote {write_buffer.chunks_written} chunks in {write_buffer.flushes} batches for task {task.task_id}")
+    except Exception as e:
+        logger.error(f"Error writing buffered chunks: {str(e)}")
+        task.errors.append(f"Failed to write buffered chunks: {str(e)}")
+
+
+def fetch_soup(url: str, cookies: Dict[str, str]) -> BeautifulSoup:
+    """
+    Fetch a Moodle page and parse it
+
+    Args:
+        url: The page URL
+        cookies: The cookies for authentication
+
+    Returns:
+        BeautifulSoup object of the page
+    """
+    response = requests.get(url, headers=HEADERS, cookies=cookies, timeout=30)
+    response.raise_for_status()
+    return make_soup(response.content)
+
+
+def make_soup(markup) -> BeautifulSoup:
+    """
+    Parse HTML with the fastest available BeautifulSoup tree builder
+
+    Args:
+        markup: HTML text or bytes
+
+    Returns:
+        BeautifulSoup object of the page
+    """
+    return BeautifulSoup(markup, HTML_PARSER)
+
+
 def extract_file_links(soup: BeautifulSoup, base_url: str) -> List[Tuple[str, str]]:
     """
     Extract PDF and DOCX links from a Moodle page
 
+    Walks the parse tree once and classifies every anchor against the
+    precompiled patterns. Each anchor is ranked the way the original
+    multi-pass extractor would have found it (href patterns first, then
+    text indicators, then the General section) so the returned list and
+    its order are unchanged.
+
     Args:
         soup: BeautifulSoup object of the page
         base_url: The base URL for resolving relative links
@@ -343,78 +743,136 @@ def extract_file_links(soup: BeautifulSoup, base_url: str) -> List[Tuple[str, st
     Returns:
         List of tuples (filename, url)
     """
-    file_links = []
-
-    # Pattern 1: Standard resource links with icon classes (enhanced)
-    file_patterns = [
-        'a[href*=".pdf"]', 'a[href*=".docx"]', 'a[href*=".doc"]',
-        'a[href*=".pptx"]', 'a[href*=".ppt"]', 'a[href*=".xlsx"]', 'a[href*=".xls"]',
-        'a[href*="resource/view.php"]', 'a[href*="mod/resource/view.php"]',
-        'a[href*="pluginfile.php"]', 'a[href*="forcedownload=1"]',
-        'a[href*="mod/assign/view.php"]'
-    ]
-
-    for pattern in file_patterns:
-        for link in soup.select(pattern):
-            # Skip if href is missing
-            if not link.get('href'):
+    # Best rank seen for each anchor, keyed by id() of the tag
+    ranks = {}
+    anchors = {}
+    urls = {}
+
+    def resolve(link) -> str:
+        key = id(link)
+        if key not in urls:
+            urls[key] = urljoin(base_url, link['href'])
+        return urls[key]
+
+    def offer(link, rank):
+        key = id(link)
+        if key not in ranks or rank < ranks[key]:
+            ranks[key] = rank
+            anchors[key] = link
+
+    # Anchors (innermost first) enclosing each tag, stopping at <body>
+    anchor_chains = {}
+    # Document position of the outermost General section enclosing each tag
+    general_sections = {}
+
+    for position, node in enumerate(soup.descendants):
+        parent_key = id(node.parent)
+
+        if isinstance(node, NavigableString):
+            chain = anchor_chains.get(parent_key)
+            if not chain or not TEXT_INDICATOR_PREFILTER.search(node):
                 continue
 
-            url = urljoin(base_url, link['href'])
-            filename = get_filename_from_link(link, url)
-
-            if filename:
-                file_links.append((filename, url))
-
-    # Pattern 2: Find elements with specific text mentions
-    text_indicators = [
-        'handbook', 'guide', 'syllabus', 'lecture', 'notes', 'assignment',
-        'document', 'resource', 'material', 'reading', 'pdf', 'doc', 'ppt'
-    ]
-
-    for indicator in text_indicators:
-        elements = soup.find_all(string=re.compile(indicator, re.I))
-        for element in elements:
-            # Find parent link if exists
-            parent_links = []
-            parent = element.parent
-            while parent and parent.name != 'body':
-                if parent.name == 'a' and parent.get('href'):
-                    parent_links.append(parent)
-                parent = parent.parent
-
-            # Process found links
-            for link in parent_links:
-                url = urljoin(base_url, link['href'])
-                if is_document_url(url):
-                    filename = get_filename_from_link(link, url)
-                    if filename:
-                        file_links.append((filename, url))
-
-    # Pattern 3: Check the General section specifically for handbooks and resources
-    general_sections = soup.select(
-        '.section.main#section-0, [aria-label="General"]')
-    for section in general_sections:
-        links = section.find_all('a', href=True)
-        for link in links:
-            url = urljoin(base_url, link['href'])
-            if is_document_url(url) or 'view.php' in url:
-                filename = get_filename_from_link(link, url)
-                if filename:
-                    file_links.append((filename, url))
-
-    # Filter out duplicates
+            # Pattern 2: text indicators, ranked by indicator order first
+            for index, pattern in enumerate(TEXT_INDICATOR_PATTERNS):
+                if pattern.search(node):
+                    for depth, link in enumerate(chain):
+                        if is_document_url(resolve(link)):
+                            offer(link, (1, index, position, depth))
+                    break
+            continue
+
+        if not isinstance(node, Tag):
+            continue
+
+        if node.name == 'body':
+            chain = ()
+        else:
+            chain = anchor_chains.get(parent_key, ())
+
+        section = general_sections.get(parent_key)
+        if section is not None:
+            general_sections[id(node)] = section
+        elif _is_general_section(node):
+            general_sections[id(node)] = position
+
+        if node.name == 'a':
+            href = node.get('href')
+
+            if href:
+                chain = (node,) + chain
+
+                # Pattern 1: href patterns, ranked by pattern order first
+                for index, needle in enumerate(FILE_LINK_HREF_PATTERNS):
+                    if needle in href:
+                        offer(node, (0, index, position))
+                        break
+
+            # Pattern 3: General section links
+            if section is not None and href is not None:
+                url = resolve(node)
+                if is_document_url(url) or 'view.php' in url:
+                    offer(node, (2, section, position))
+
+        if chain:
+            anchor_chains[id(node)] = chain
+
+    # Filter out duplicates, keeping the best ranked anchor for each URL
     seen_urls = set()
     unique_links = []
 
-    for filename, url in file_links:
-        if url not in seen_urls:
+    for key in sorted(ranks, key=ranks.get):
+        link = anchors[key]
+        url = resolve(link)
+        if url in seen_urls:
+            continue
+
+        filename = get_filename_from_link(link, url)
+        if filename:
             unique_links.append((filename, url))
             seen_urls.add(url)
 
     return unique_links
 
 
+def extract_folder_links(soup: BeautifulSoup, base_url: str,
+                         host: Optional[str] = None) -> List[Tuple[str, str]]:
+    """
+    Extract Moodle folder links from a page
+
+    Args:
+        soup: BeautifulSoup object of the page
+        base_url: The base URL for resolving relative links
+        host: Only keep links to this host (defaults to base_url's host)
+
+    Returns:
+        List of tuples (folder name, url)
+    """
+    folder_links = []
+    seen_urls = set()
+    host = host or urlparse(base_url).netloc
+
+    for link in soup.find_all('a', href=True):
+        url = urljoin(base_url, link['href']).split('#')[0]
+        if urlparse(url).netloc != host:
+            continue
+        if FOLDER_VIEW_RE.search(url) and url not in seen_urls:
+            folder_links.append((link.get_text(strip=True) or url, url))
+            seen_urls.add(url)
+
+    return folder_links
+
+
+def _is_general_section(tag: Tag) -> bool:
+    """Match '.section.main#section-0, [aria-label="General"]'"""
+    if tag.get('aria-label') == 'General':
+        return True
+    if tag.get('id') != 'section-0':
+        return False
+    classes = tag.get('class') or []
+    return 'section' in classes and 'main' in classes
+
+
 def get_filename_from_link(link, url: str) -> Optional[str]:
     """
     Extract a reasonable filename from a link element or URL
@@ -515,11 +973,11 @@ def is_document_url(url: str) -> bool:
         return False
 
     # File extensions
-    if re.search(r'\.(pdf|docx?|pptx?|xlsx?)($|\?)', url, re.I):
+    if DOCUMENT_EXTENSION_RE.search(url):
         return True
 
     # Moodle resource links (expanded)
-    if re.search(r'/(resource|mod/resource)/view\.php', url, re.I):
+    if RESOURCE_VIEW_RE.search(url):
         return True
 
     # Moodle pluginfile links
@@ -648,7 +1106,10 @@ def extract_text_content(soup: BeautifulSoup) -> str:
 
 
 async def download_and_process_file(url: str, filename: str, module_code: str,
-                                    module_dir: str, cookies: Dict[str, str]) -> bool:
+                                    module_dir: str, cookies: Dict[str, str],
+                                    write_buffer: Optional[DocumentWriteBuffer] = None,
+                                    on_flush: Optional[Callable[[], None]] = None,
+                                    on_error: Optional[Callable[[Exception], None]] = None) -> bool:
     """
     Download a file and process it for the vector database
 
@@ -658,9 +1119,14 @@ async def download_and_process_file(url: str, filename: str, module_code: str,
         module_code: The module code
         module_dir: The module directory
         cookies: The cookies for authentication
+        write_buffer: Buffer for batching vector store writes (optional)
+        on_flush: Run once the file's chunks are written (optional)
+        on_error: Given the exception if writing the file's chunks fails (optional)
 
     Returns:
-        True if successful, False otherwise
+        True if the file was downloaded and processed, False otherwise. With a
+        write buffer its chunks may not be written yet; on_flush or on_error
+        reports the outcome.
     """
     try:
         logger.info(f"Downloading {filename} from {url}")
@@ -686,7 +1152,7 @@ async def download_and_process_file(url: str, filename: str, module_code: str,
 
                     # Parse the HTML to find the direct file link
                     html_content = response.content
-                    soup = BeautifulSoup(html_content, 'html.parser')
+                    soup = make_soup(html_content)
 
                     # Moodle often has a redirect link or embedded object
                     resource_link = None
@@ -709,6 +1175,12 @@ async def download_and_process_file(url: str, filename: str, module_code: str,
                         logger.warning(
                             f"Could not find direct download link in {url}")
 
+            # Trust the served content type over the guessed extension
+            extension = CONTENT_TYPE_EXTENSIONS.get(
+                response.headers.get('Content-Type', '').split(';')[0].strip().lower())
+            if extension and not filename.lower().endswith(extension):
+                filename = os.path.splitext(filename)[0] + extension
+
             # Get the file content with streaming
             content = response.content
         except requests.exceptions.RequestException as req_err:
@@ -737,9 +1209,13 @@ async def download_and_process_file(url: str, filename: str, module_code: str,
 
         try:
             # Pass module_code explicitly to ensure it's stored in the correct collection
-            document_id = await process_document(temp_file, module_code)
+            document_id = await process_document(
+                temp_file, module_code, write_buffer, source_type="scraped",
+                on_flush=on_flush, on_error=on_error)
             logger.info(
                 f"Successfully processed file with document ID: {document_id}")
+            if write_buffer is None and on_flush:
+                on_flush()
             return True
         except Exception as e:
             logger.error(
@@ -753,7 +1229,10 @@ async def download_and_process_file(url: str, filename: str, module_code: str,
 
 async def process_text_content(content: str, module_code: str,
                                module_name: str, filename: str,
-                               source_type: str = "scraped_text") -> str:
+                               source_type: str = "scraped_text",
+                               write_buffer: Optional[DocumentWriteBuffer] = None,
+                               on_flush: Optional[Callable[[], None]] = None,
+                               on_error: Optional[Callable[[Exception], None]] = None) -> str:
     """
     Process extracted text content for the vector database
 
@@ -763,6 +1242,9 @@ async def process_text_content(content: str, module_code: str,
         module_name: The module name
         filename: The filename
         source_type: Type of source (moodle_page, scraped_text, etc.)
+        write_buffer: Buffer for batching vector store writes (optional)
+        on_flush: Run once the chunks are written (optional)
+        on_error: Given the exception if writing the chunks fails (optional)
 
     Returns:
         Document ID
@@ -791,11 +1273,33 @@ async def process_text_content(content: str, module_code: str,
                 "source_type": source_type
             })
 
+        # Queue the chunks with the rest of the task's writes
+        if write_buffer is not None:
+            def written():
+                schedule_summary(document_id, collection_name)
+                if on_flush:
+                    on_flush()
+
+            try:
+                await write_buffer.add_async(texts, metadatas, collection_name,
+                                             on_flush=written, on_error=on_error)
+            except Exception as e:
+                # Every document in the failed flush, this one included, is told through on_error
+                logger.error(f"Error writing buffered chunks: {str(e)}")
+            logger.info(
+                f"Buffered {len(texts)} chunks for collection '{collection_name}' for document ID {document_id}")
+            return document_id
+
         # Add to vector database in the module collection
         try:
-            add_documents(texts, metadatas, collection_name)
+            # Embedding and writing block, so keep them off the event loop
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, partial(add_documents, texts, metadatas, collection_name))
             logger.info(
                 f"Added {len(texts)} chunks to collection '{collection_name}' for document ID {document_id}")
+            schedule_summary(document_id, collection_name)
+            if on_flush:
+                on_flush()
         except Exception as e:
             logger.error(
                 f"Error adding chunks to collection '{collection_name}': {str(e)}")